@@ -3,10 +3,27 @@ import requests
 import psycopg2
 import numpy as np
 import os
+import sys
+import io
+import csv
 import json
-from flask import Flask, jsonify, request
-from sgp4.api import Satrec, jday
+import codecs
+import time
+import atexit
+import threading
+import traceback
+import hashlib
+import base64
+import zlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import Flask, Response, jsonify, request, g, has_request_context, stream_with_context
+from sgp4.api import Satrec, SatrecArray, WGS72, jday
 from psycopg2 import sql
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 from datetime import datetime, timedelta
 from dotenv import load_dotenv, find_dotenv
 
@@ -39,6 +56,134 @@ SCRT_DB = os.getenv("SCRT_DB")
 USR_SPACETRACK = os.getenv("USR_SPACETRACK")
 SCRT_SPACETRACK = os.getenv("SCRT_SPACETRACK")
 
+# Pool di connessioni al database: "pool" (ThreadedConnectionPool nel processo)
+# oppure "pgbouncer" (una connessione per uso, pooling delegato a PgBouncer)
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "pool")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 5))
+DB_POOL_LEAK_SECONDS = float(os.getenv("DB_POOL_LEAK_SECONDS", 60))
+# Attesa massima di una connessione libera quando tutte le DB_POOL_MAX sono in uso.
+# Dimensionamento: ogni richiesta usa una connessione alla volta, ogni thread di
+# job (JOB_WORKER_THREADS o /jobs/work) fino a due insieme, quindi DB_POOL_MAX >=
+# 2 * thread di job + richieste concorrenti del processo
+DB_POOL_WAIT_SECONDS = float(os.getenv("DB_POOL_WAIT_SECONDS", 10))
+
+_db_pool = {"pool": None, "pid": None, "slots": None}
+_db_pool_lock = threading.Lock()
+_db_pool_stats = {"checkouts": 0, "returns": 0, "discarded": 0, "leaks": 0, "errors": 0}
+_borrowed_connections = {}
+
+# Numero di TLE caricati per blocco (un COPY e un commit per blocco)
+TLE_INGEST_BATCH_SIZE = int(os.getenv("TLE_INGEST_BATCH_SIZE", 5000))
+
+# Dimensione dei blocchi letti dalla risposta in streaming di Space-Track
+SPACETRACK_STREAM_CHUNK_BYTES = int(os.getenv("SPACETRACK_STREAM_CHUNK_BYTES", 64 * 1024))
+
+# Eta' massima (giorni dall'epoca) degli element set tenuti nel catalogo, sia dal
+# caricamento completo sia da quello incrementale
+SPACETRACK_MAX_EPOCH_AGE_DAYS = int(os.getenv("SPACETRACK_MAX_EPOCH_AGE_DAYS", 30))
+
+# Caricamento versionato del catalogo: staging, versioni archiviate mantenute e lock
+TLE_STAGING_TABLE = "tle_list_staging"
+TLE_CATALOG_RETENTION = int(os.getenv("TLE_CATALOG_RETENTION", 3))
+CATALOG_LOCK_KEY = 710001
+
+# Numero di satelliti elaborati per blocco dal kernel di screening
+SCREENING_CHUNK_SIZE = int(os.getenv("SCREENING_CHUNK_SIZE", 512))
+
+# Parametri del raffinamento del tempo di massimo avvicinamento (TCA)
+TCA_TOLERANCE_SECONDS = float(os.getenv("TCA_TOLERANCE_SECONDS", 0.001))
+TCA_MAX_ITERATIONS = int(os.getenv("TCA_MAX_ITERATIONS", 50))
+# Campioni per periodo orbitale usati per localizzare i minimi della distanza:
+# gli intervalli della griglia piu' lunghi vengono ricampionati con SGP4
+TCA_BRACKET_STEPS_PER_PERIOD = int(os.getenv("TCA_BRACKET_STEPS_PER_PERIOD", 20))
+
+# Costanti dei filtri orbitali (raggio equatoriale WGS-72 usato da Space-Track)
+EARTH_RADIUS_KM = 6378.135
+WGS72_MU_KM3_S2 = 398600.8
+ORBIT_PATH_COPLANAR_DEG = 0.5
+
+# Griglia spaziale dello screening all-vs-all: chiavi di cella e 27 celle adiacenti
+GRID_KEY_OFFSET = 1 << 20
+GRID_KEY_BASE = 1 << 21
+GRID_NEIGHBOUR_SHIFTS = np.array(
+    [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)], dtype=np.int64
+)
+# Passo massimo dei campioni da cui lo screening all-vs-all genera le coppie
+# candidate: griglie piu' larghe vengono ricampionate con SGP4
+SCREEN_CANDIDATE_STEP_SECONDS = float(os.getenv("SCREEN_CANDIDATE_STEP_SECONDS", 60))
+
+# Storico dei match: retention delle righe grezze, partizioni mensili create in
+# anticipo e dimensione delle pagine degli endpoint di consultazione
+MATCH_HISTORY_RETENTION_DAYS = int(os.getenv("MATCH_HISTORY_RETENTION_DAYS", 90))
+MATCH_HISTORY_PARTITIONS_AHEAD = int(os.getenv("MATCH_HISTORY_PARTITIONS_AHEAD", 2))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 100))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", 1000))
+
+# Job di screening asincroni: budget di ogni invocazione di /jobs/work, clienti per
+# blocco (checkpoint), job abbandonati da riprendere (heartbeat aggiornato anche
+# durante i blocchi) e thread di elaborazione locali
+JOB_WORK_SECONDS = float(os.getenv("JOB_WORK_SECONDS", 50))
+JOB_BATCH_CUSTOMERS = int(os.getenv("JOB_BATCH_CUSTOMERS", 50))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", 300))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", JOB_STALE_SECONDS / 5))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 5))
+JOB_WORKER_THREADS = int(os.getenv("JOB_WORKER_THREADS", 0))
+
+# Righe lette per ogni giro del cursore lato server degli endpoint di elenco
+LISTING_FETCH_SIZE = int(os.getenv("LISTING_FETCH_SIZE", 2000))
+
+# Pacchetti CZML tra uno svuotamento e l'altro del compressore gzip in streaming
+CZML_GZIP_FLUSH_PACKETS = int(os.getenv("CZML_GZIP_FLUSH_PACKETS", 50))
+
+# Output CZML: default completo (ogni passo, precisione piena) e modalita' "compact"
+# con un campione ogni sample_stride passi interpolato da Cesium
+DEFAULT_CZML = {"sample_stride": 1, "interpolation": None, "interpolation_degree": 5, "precision": None}
+CZML_COMPACT_DEFAULTS = {
+    "sample_stride": int(os.getenv("CZML_COMPACT_STRIDE", 10)),
+    "interpolation": "HERMITE",
+    "interpolation_degree": 3,
+    "precision": int(os.getenv("CZML_COMPACT_PRECISION", 3)),
+}
+
+# Propagazione parallela: processi del pool (default il numero di CPU, 1 la
+# disabilita), satelliti per blocco e soglia minima (satelliti x passi) sotto la
+# quale si propaga nel processo corrente
+PROPAGATION_WORKERS = int(os.getenv("PROPAGATION_WORKERS") or os.cpu_count() or 1)
+PROPAGATION_CHUNK_SATS = int(os.getenv("PROPAGATION_CHUNK_SATS", 1000))
+PROPAGATION_PARALLEL_MIN_POINTS = int(os.getenv("PROPAGATION_PARALLEL_MIN_POINTS", 5_000_000))
+PROPAGATION_START_METHOD = os.getenv("PROPAGATION_START_METHOD", "forkserver")
+
+_propagation_pool = {"executor": None, "pid": None}
+_propagation_pool_lock = threading.Lock()
+
+# Cache delle effemeridi propagate: LRU in memoria entro EPHEMERIS_CACHE_MB (0 la
+# disabilita), opzionalmente condivisa tra worker tramite un file .npy per batch in
+# EPHEMERIS_CACHE_DIR, potato al massimo ogni EPHEMERIS_CACHE_PRUNE_SECONDS
+EPHEMERIS_CACHE_MB = float(os.getenv("EPHEMERIS_CACHE_MB", 256))
+EPHEMERIS_CACHE_DTYPE = np.dtype(os.getenv("EPHEMERIS_CACHE_DTYPE", "float64"))
+EPHEMERIS_CACHE_DIR = os.getenv("EPHEMERIS_CACHE_DIR")
+EPHEMERIS_CACHE_DISK_MB = float(os.getenv("EPHEMERIS_CACHE_DISK_MB", 1024))
+EPHEMERIS_CACHE_PRUNE_SECONDS = float(os.getenv("EPHEMERIS_CACHE_PRUNE_SECONDS", 60))
+
+_ephemeris_cache = OrderedDict()
+_ephemeris_cache_lock = threading.Lock()
+_ephemeris_cache_stats = {"bytes": 0, "hits": 0, "misses": 0, "evictions": 0, "bypassed": 0}
+_ephemeris_prune_state = {"last": float("-inf")}
+
+# Quarantena SGP4: (NORAD, epoca dell'element set) -> JD dal quale la propagazione
+# fallisce sempre; condivisa tra i worker tramite tle_quarantine
+QUARANTINE_REFRESH_SECONDS = float(os.getenv("QUARANTINE_REFRESH_SECONDS", 300))
+QUARANTINE_RETENTION_DAYS = int(os.getenv("QUARANTINE_RETENTION_DAYS", 30))
+
+_quarantine = {}
+_quarantine_state = {"loaded_at": float("-inf"), "pending": []}
+_quarantine_lock = threading.Lock()
+
+# Catalogo in cache nel processo (indice degli elementi e Satrec), per versione del catalogo
+_catalog_index_cache = {"version": None, "index": None}
+
 # Configurazione dell'app Flask
 app = Flask(__name__)
 app.config["ENV"] = ENV
@@ -53,6 +198,123 @@ if app.config["DEBUG"]:
     logger.debug(f"URL_DB: {app.config['URL_DB']}")
 
 
+# Strumentazione: tempi per stadio (wall e CPU) e contatori, esposti su /metrics in
+# formato Prometheus e per richiesta nell'header Server-Timing
+STAGE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = {"stages": {}, "counters": {}}
+_metrics_lock = threading.Lock()
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Misura tempo reale e tempo CPU del thread per uno stadio della pipeline,
+    accumulandoli nelle metriche del processo e, durante una richiesta, nel
+    Server-Timing della risposta.
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+        with _metrics_lock:
+            stats = _metrics["stages"].setdefault(
+                stage, {"count": 0, "wall": 0.0, "cpu": 0.0, "buckets": [0] * len(STAGE_BUCKETS)}
+            )
+            stats["count"] += 1
+            stats["wall"] += wall
+            stats["cpu"] += cpu
+            for i, bound in enumerate(STAGE_BUCKETS):
+                if wall <= bound:
+                    stats["buckets"][i] += 1
+        if has_request_context():
+            timings = g.setdefault("server_timing", {})
+            timings[stage] = timings.get(stage, 0.0) + wall
+
+
+def count_metric(name, value=1, **labels):
+    """
+    Incrementa un contatore (es. punti propagati, righe scritte), con etichette
+    opzionali.
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _metrics["counters"][key] = _metrics["counters"].get(key, 0) + value
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def render_metrics():
+    """
+    Restituisce le metriche del processo nel formato testuale di Prometheus.
+    """
+    lines = []
+    with _metrics_lock:
+        stages = {stage: dict(stats, buckets=list(stats["buckets"])) for stage, stats in _metrics["stages"].items()}
+        counters = dict(_metrics["counters"])
+
+    lines.append("# TYPE spacepatrol_stage_seconds histogram")
+    for stage, stats in sorted(stages.items()):
+        for bound, hits in zip(STAGE_BUCKETS, stats["buckets"]):
+            lines.append(f'spacepatrol_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {hits}')
+        lines.append(f'spacepatrol_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'spacepatrol_stage_seconds_sum{{stage="{stage}"}} {stats["wall"]:.6f}')
+        lines.append(f'spacepatrol_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+    lines.append("# TYPE spacepatrol_stage_cpu_seconds_total counter")
+    for stage, stats in sorted(stages.items()):
+        lines.append(f'spacepatrol_stage_cpu_seconds_total{{stage="{stage}"}} {stats["cpu"]:.6f}')
+
+    typed = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            lines.append(f"# TYPE spacepatrol_{name}_total counter")
+            typed.add(name)
+        lines.append(f"spacepatrol_{name}_total{_prometheus_labels(labels)} {value}")
+
+    pool = get_pool_metrics()
+    for name in ("in_use", "idle", "checkouts", "leaks", "errors"):
+        lines.append(f"spacepatrol_db_pool_{name} {pool[name]}")
+    for name, value in _ephemeris_cache_stats.items():
+        lines.append(f"spacepatrol_ephemeris_cache_{name} {value}")
+    lines.append(f"spacepatrol_quarantined_element_sets {len(_quarantine)}")
+    return "\n".join(lines) + "\n"
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def add_server_timing(response):
+    """
+    Aggiunge alla risposta l'header Server-Timing con la durata (ms) degli stadi
+    eseguiti durante la richiesta e del totale.
+    """
+    timings = g.get("server_timing", {})
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if "request_start" in g:
+        entries.append(f"total;dur={(time.perf_counter() - g.request_start) * 1000:.1f}")
+    if entries:
+        response.headers["Server-Timing"] = ", ".join(entries)
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_api():
+    """
+    Metriche del processo in formato Prometheus.
+    """
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 # Endpoint di sistema da CANCELLARE
 @app.route("/__get_config", methods=["GET"])
 def get_config():
@@ -81,104 +343,138 @@ def get_config():
     except Exception as e:
         logger.error(f"Error retrieving configuration: {e}")
         return jsonify({"status": "error", "message": "Unable to retrieve configuration"}), 500
-# Endpoint di sistema da CANCELLARE
-@app.route("/__get_customers", methods=["GET"])
-def get_customers():
+# Tabelle consultabili dagli endpoint di elenco: chiave di paginazione e colonne ammesse
+LISTING_TABLES = {
+    "norad_list": {
+        "key": "id",
+        "columns": ["id", "norad_code", "subscription_level", "priority_level", "timestamp"],
+    },
+    "tle_list": {
+        "key": "idcounter",
+        "columns": [
+            "idcounter", "codnorad_riga1", "classificazione", "anno", "nrlancio_anno", "pezzo_lancio",
+            "annoepoca_astro", "epoca_astro", "derivata_prima", "derivata_seconda", "termine_trascinamento",
+            "tipo_effemeridi", "nrset", "chksum_riga1", "codnorad_riga2", "inclinazione", "ascensione_retta",
+            "eccentricita", "arg_perigeo", "anomalia_media", "moto_medio", "nr_rivoluzioni", "chksum_riga2",
+            "json", "sourceid", "dt", "extra_info", "apoapsis", "periapsis", "inclination", "gp_id", "creation_date",
+        ],
+    },
+    "match_actual": {
+        "key": "id",
+        "columns": ["id", "norad_code", "sat1", "sat2", "time", "distance", "coord1", "coord2", "created_at"],
+    },
+    "match_history": {
+        "key": "id",
+        "columns": ["id", "norad_code", "sat1", "sat2", "time", "distance", "coord1", "coord2", "created_at"],
+    },
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def iter_listing(table, columns, after=None, limit=None):
     """
-    Visualizza i customers
+    Legge la tabella in ordine di chiave con un cursore lato server e restituisce
+    una riga JSON per record (NDJSON): in memoria resta un solo blocco di
+    LISTING_FETCH_SIZE righe alla volta. La connessione viene rilasciata alla fine
+    dello stream.
     """
+    key = LISTING_TABLES[table]["key"]
+    query = sql.SQL("SELECT {} FROM {} WHERE {} > %s ORDER BY {}").format(
+        sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+        sql.Identifier(table),
+        sql.Identifier(key),
+        sql.Identifier(key),
+    )
+    params = [after if after is not None else -1]
+    if limit is not None:
+        query = sql.SQL("{} LIMIT %s").format(query)
+        params.append(limit)
+
     conn = get_db_connection()
     if conn is None:
         raise Exception("Database connection failed")
-
     try:
-        cursor = conn.cursor()
-        query = "SELECT * FROM norad_list ORDER BY id ASC"
-        cursor.execute(query)
-        customers = cursor.fetchall()  
-
-        return jsonify(customers), 200
-    
+        cursor = conn.cursor(name=f"listing_{table}_{os.getpid()}_{threading.get_ident()}")
+        cursor.itersize = LISTING_FETCH_SIZE
+        cursor.execute(query, params)
+        count = 0
+        for row in cursor:
+            count += 1
+            yield json.dumps(dict(zip(columns, row)), default=_json_default) + "\n"
+        cursor.close()
+        conn.commit()
+        logger.info(f"Listing of {table}: {count} rows streamed")
     except Exception as e:
         conn.rollback()
-        raise Exception(f"Failed to get customers from norad_list table: {str(e)}")
-
+        logger.error(f"Failed to stream {table}: {e}")
+        raise
     finally:
-        cursor.close()
-        conn.close()
+        release_db_connection(conn)
+
+
+def listing_response(table):
+    """
+    Risposta NDJSON in streaming per un endpoint di elenco. Parametri della query
+    string: "columns" (separate da virgola, tra quelle ammesse), "after" (chiave
+    dell'ultima riga gia' ricevuta) e "limit".
+    """
+    allowed = LISTING_TABLES[table]["columns"]
+    key = LISTING_TABLES[table]["key"]
+    try:
+        columns = [column for column in request.args.get("columns", "").split(",") if column] or list(allowed)
+        unknown = [column for column in columns if column not in allowed]
+        if unknown:
+            raise ValueError(f"Unknown columns for {table}: {', '.join(unknown)}")
+        # La chiave serve al client per richiedere la pagina successiva
+        if key not in columns:
+            columns.insert(0, key)
+        after = int(request.args["after"]) if "after" in request.args else None
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    return Response(stream_with_context(iter_listing(table, columns, after, limit)), mimetype="application/x-ndjson")
+
+
+# Endpoint di sistema da CANCELLARE
+@app.route("/__get_customers", methods=["GET"])
+def get_customers():
+    """
+    Visualizza i customers
+    """
+    return listing_response("norad_list")
 # Endpoint di sistema da CANCELLARE
 @app.route("/__get_tle_list", methods=["GET"])
 def get_tle_list():
     """
     Visualizza i tle
     """
-    conn = get_db_connection()
-    if conn is None:
-        raise Exception("Database connection failed")
-
-    try:
-        cursor = conn.cursor()
-        query = "SELECT * FROM tle_list ORDER BY idcounter ASC"
-        cursor.execute(query)
-        tle = cursor.fetchall()  
-
-        return jsonify(tle), 200
-    
-    except Exception as e:
-        conn.rollback()
-        raise Exception(f"Failed to get customers from tle_list table: {str(e)}")
-
-    finally:
-        cursor.close()
-        conn.close()
+    return listing_response("tle_list")
 @app.route("/__get_match_history", methods=["GET"])
-def get_match_history():
+def get_match_history_listing():
     """
     Visualizza i match_history
     """
-    conn = get_db_connection()
-    if conn is None:
-        raise Exception("Database connection failed")
-
-    try:
-        cursor = conn.cursor()
-        query = "SELECT * FROM match_history ORDER BY id ASC"
-        cursor.execute(query)
-        match_history = cursor.fetchall()  
-
-        return jsonify(match_history), 200
-    
-    except Exception as e:
-        conn.rollback()
-        raise Exception(f"Failed to get match_history from tle_list table: {str(e)}")
-
-    finally:
-        cursor.close()
-        conn.close()
+    return listing_response("match_history")
 @app.route("/__get_match_actual", methods=["GET"])
 def get_match_actual():
     """
     Visualizza i match_actual
     """
-    conn = get_db_connection()
-    if conn is None:
-        raise Exception("Database connection failed")
-
-    try:
-        cursor = conn.cursor()
-        query = "SELECT * FROM match_actual ORDER BY id ASC"
-        cursor.execute(query)
-        match_actual = cursor.fetchall()  
+    return listing_response("match_actual")
 
-        return jsonify(match_actual), 200
-    
-    except Exception as e:
-        conn.rollback()
-        raise Exception(f"Failed to get customers from match_actual table: {str(e)}")
 
-    finally:
-        cursor.close()
-        conn.close()
+@app.route("/__get_pool_metrics", methods=["GET"])
+def get_pool_metrics_api():
+    """
+    Visualizza le metriche del pool di connessioni
+    """
+    return jsonify(get_pool_metrics()), 200
 
 
 # ****************************************************************************************
@@ -186,490 +482,2244 @@ def get_match_actual():
 # ****************************************************************************************
 
 
-def filter_by_altitude(spacetrack_data, apoapsis, periapsis, tolerance_km=100):
-    filtered = [
-        obj for obj in spacetrack_data
-        if abs(float(obj["APOAPSIS"]) - apoapsis) <= tolerance_km and
-           abs(float(obj["PERIAPSIS"]) - periapsis) <= tolerance_km
-    ]
-    return filtered
+WINDOW_ELEMENT_FIELDS = ("a", "e", "inclination", "raan", "arg_perigee", "u_start", "u_rate", "nodedot", "argpdot", "ndot")
 
-def filter_by_inclination(data, inclination, tolerance_deg=2):
-    filtered = [
-        obj for obj in data
-        if abs(float(obj["INCLINATION"]) - inclination) <= tolerance_deg
-    ]
-    return filtered
 
-def filter_by_ra_of_asc_node(data, ra_of_asc_node, tolerance_deg=15):
-    filtered = [
-        obj for obj in data
-        if abs(float(obj["RA_OF_ASC_NODE"]) - ra_of_asc_node) <= tolerance_deg
-    ]
-    return filtered
-
-def filter_potential_colliders(spacetrack_data, target):
-    # Step 1: Filtra per altezza
-    filtered = filter_by_altitude(
-        spacetrack_data,
-        apoapsis=target["APOAPSIS"],
-        periapsis=target["PERIAPSIS"]
-    )
-    # Step 2: Filtra per inclinazione
-    filtered = filter_by_inclination(
-        filtered,
-        inclination=target["INCLINATION"]
-    )
-    # Step 3: Filtra per nodo ascendente
-    filtered = filter_by_ra_of_asc_node(
-        filtered,
-        ra_of_asc_node=target["RA_OF_ASC_NODE"]
+def _compute_window_elements(catalog_index, cache, rows, window):
+    start_jd, duration_seconds = window
+    cache["computed"][rows] = True
+    satrecs = [get_catalog_satrec(catalog_index, row) for row in rows.tolist()]
+    usable = np.array([satellite is not None and satellite.error == 0 for satellite in satrecs], dtype=bool)
+    rows = rows[usable]
+    satrecs = [satellite for satellite, ok in zip(satrecs, usable.tolist()) if ok]
+    if not satrecs:
+        return
+
+    def values(name):
+        return np.array([getattr(satellite, name) for satellite in satrecs])
+
+    # Tassi secolari SGP4 in rad/min, portati in rad/s
+    minutes = (start_jd - (values("jdsatepoch") + values("jdsatepochF"))) * 1440.0
+    nodedot, argpdot, mdot = values("nodedot"), values("argpdot"), values("mdot")
+    inclination = values("inclo")
+    raan = values("nodeo") + nodedot * minutes
+    arg_perigee = values("argpo") + argpdot * minutes
+
+    errors, positions, _ = SatrecArray(satrecs).sgp4(
+        np.array([start_jd, start_jd]), np.array([0.0, duration_seconds / 86400.0])
     )
-    return filtered
 
-def get_main_object(space_track_data, norad_cat_id):
+    def latitude_argument(position, node_angle):
+        node = np.stack([np.cos(node_angle), np.sin(node_angle), np.zeros_like(node_angle)], axis=-1)
+        normal = np.stack([np.sin(inclination) * np.sin(node_angle), -np.sin(inclination) * np.cos(node_angle), np.cos(inclination)], axis=-1)
+        in_plane = np.cross(normal, node)
+        return np.arctan2(np.einsum("ij,ij->i", position, in_plane), np.einsum("ij,ij->i", position, node))
+
+    # Velocita' angolare media lungo l'orbita dalla fase SGP4 a inizio e fine
+    # finestra: include la resistenza atmosferica accumulata dall'epoca
+    u_start = latitude_argument(positions[:, 0], raan)
+    expected = (mdot + argpdot) / 60.0 * duration_seconds
+    if duration_seconds > 0:
+        u_end = latitude_argument(positions[:, 1], raan + nodedot / 60.0 * duration_seconds)
+        turns = np.round((expected - (u_end - u_start)) / (2 * np.pi))
+        u_rate = (u_end - u_start + 2 * np.pi * turns) / duration_seconds
+    else:
+        u_rate = (mdot + argpdot) / 60.0
+
+    elements = {
+        "a": values("a") * satrecs[0].radiusearthkm,
+        "e": values("ecco"),
+        "inclination": inclination,
+        "raan": raan,
+        "arg_perigee": arg_perigee,
+        "u_start": u_start,
+        "u_rate": u_rate,
+        "nodedot": nodedot / 60.0,
+        "argpdot": argpdot / 60.0,
+        "ndot": values("ndot") / 3600.0,
+    }
+    for name, value in elements.items():
+        cache[name][rows] = value
+    cache["valid"][rows] = (errors == 0).all(axis=1)
+
+
+def _window_elements(catalog_index, rows, window):
     """
-    Trova il main object nel TLE_DATA_ARRAY in base al NORAD_CAT_ID ottenuto dal database.
+    Elementi delle orbite indicate all'inizio della finestra di screening: piano
+    orbitale e perigeo portati avanti con i tassi secolari del `Satrec`, fase
+    lungo l'orbita dallo stato SGP4. Gli elementi medi all'epoca del TLE, vecchi
+    anche di settimane, non descrivono piu' nodo e fase. Il calcolo e' fatto una
+    sola volta per riga e per finestra.
+
+    Returns:
+        dict: Array per riga: "valid" (False se il TLE non e' propagabile), "a",
+        "e", "inclination", "raan", "arg_perigee", "u_start" (argomento di
+        latitudine, rad), "u_rate", "nodedot", "argpdot" (rad/s) e "ndot" (rad/s^2).
     """
-    try:
-        # Cerca il record corrispondente nel TLE_DATA_ARRAY
-        for obj in space_track_data:
-            # Cambia l'accesso da chiave stringa a posizione
-            if obj[1] == int(norad_cat_id):
-                logger.info(f"Main object found for NORAD_CAT_ID {norad_cat_id}")
-                tl1 = obj[23]["tle_line1"]
-                tl2 = obj[23]["tle_line2"]
-                return {
-                    "TLE_LINE1": tl1,  # Modifica in base alla posizione corretta di TLE_LINE1
-                    "TLE_LINE2": tl2,  # Modifica in base alla posizione corretta di TLE_LINE2
-                }
-
-        # Solleva errore se il main object non viene trovato
-        raise ValueError(f"Main object con NORAD_CAT_ID {norad_cat_id} non trovato!")
-    except Exception as e:
-        logger.error(f"Errore in get_main_object: {e}")
-        raise
+    cache = catalog_index.get("window_elements")
+    if cache is None or cache["window"] != window:
+        size = len(catalog_index["norad"])
+        cache = {"window": window, "computed": np.zeros(size, dtype=bool), "valid": np.zeros(size, dtype=bool)}
+        for name in WINDOW_ELEMENT_FIELDS:
+            cache[name] = np.full(size, np.nan)
+        catalog_index["window_elements"] = cache
+
+    missing = rows[~cache["computed"][rows]]
+    if len(missing):
+        _compute_window_elements(catalog_index, cache, missing, window)
+    return {name: cache[name][rows] for name in ("valid",) + WINDOW_ELEMENT_FIELDS}
 
-def get_potential_colliders(space_track_data, norad_cat_id, min_or_equal_apoapsis_km_value, min_or_equal_periapsis_km_value, min_or_equal_inclination_degrees_value):
+
+def _orbit_geometry(elements):
     """
-    Calcola i potenziali collider basandosi sui dati del database e dei TLE.
+    Restituisce i versori (nodo ascendente, normale al piano, direzione a 90 gradi
+    dal nodo) delle orbite descritte da `_window_elements`.
     """
-    try:
-        # Cerca i dati del TLE corrispondenti al NORAD_CAT_ID
-        tle_record = next(
-            (item for item in space_track_data if item[1] == int(norad_cat_id)),
-            None
-        )
-        if not tle_record:
-            raise ValueError(f"Nessun TLE trovato per il NORAD_CAT_ID {norad_cat_id}")
+    inclination = elements["inclination"]
+    raan = elements["raan"]
+    node = np.stack([np.cos(raan), np.sin(raan), np.zeros_like(raan)], axis=-1)
+    normal = np.stack([np.sin(inclination) * np.sin(raan), -np.sin(inclination) * np.cos(raan), np.cos(inclination)], axis=-1)
+    in_plane = np.cross(normal, node)
+    return node, normal, in_plane
 
-        logger.info(f"TLE record for NORAD_CAT_ID {norad_cat_id} found: {tle_record}")
 
-        # Estrai i parametri dal record del TLE
-        try:
-            target = {
-                "APOAPSIS": float(tle_record[-3]),  # Posizione specifica per APOAPSIS
-                "PERIAPSIS": float(tle_record[-2]),  # Posizione specifica per PERIAPSIS
-                "INCLINATION": float(tle_record[-1])  # Posizione specifica per INCLINATION
-            }
-        except (KeyError, ValueError, IndexError) as e:
-            raise ValueError(f"Errore nell'estrazione dei parametri dal TLE record: {e}")
+def _orbit_radius(elements, u):
+    true_anomaly = u - elements["arg_perigee"][:, None]
+    a, e = elements["a"][:, None], elements["e"][:, None]
+    return a * (1 - e ** 2) / (1 + e * np.cos(true_anomaly))
 
-        logger.debug(f"Target TLE parameters: {target}")
 
-        # Filtra i potenziali collider basandoti sui parametri
-        colliders = []
-        for obj in space_track_data:
-            try:
-                # Controlla che l'oggetto abbia i parametri necessari
-                apoapsis = float(obj[-3])  # Indice per APOAPSIS
-                periapsis = float(obj[-2])  # Indice per PERIAPSIS
-                inclination = float(obj[-1])  # Indice per INCLINATION
-
-                # Salta il target stesso
-                if obj[1] == int(norad_cat_id):
-                    continue
-
-                # Controlla le condizioni per il potenziale collider
-                if (
-                    abs(target["APOAPSIS"] - apoapsis) <= min_or_equal_apoapsis_km_value
-                    and abs(target["PERIAPSIS"] - periapsis) <= min_or_equal_periapsis_km_value
-                    and abs(target["INCLINATION"] - inclination) <= min_or_equal_inclination_degrees_value
-                ):
-                    colliders.append(obj)
-            except (ValueError, IndexError) as e:
-                logger.warning(f"Errore durante la lettura dei dati dell'oggetto: {obj}, errore: {e}")
-                continue
+def _mutual_nodes(target, candidates):
+    """
+    Calcola la geometria dei nodi mutui tra l'orbita target e le orbite candidate
+    (elementi di `_window_elements`, il target ripetuto per ogni candidato).
 
-        logger.info(f"Potential colliders for NORAD_CAT_ID {norad_cat_id}: {len(colliders)} found")
-        return colliders
+    Returns:
+        dict: "coplanar" (bool per candidato), "relative_inclination" (rad),
+        "u_target"/"u_candidate" (argomento di latitudine dei due nodi mutui, shape
+        (n, 2)) e "radius_target"/"radius_candidate" (raggio orbitale ai nodi).
+    """
+    node_t, normal_t, in_plane_t = _orbit_geometry(target)
+    node_c, normal_c, in_plane_c = _orbit_geometry(candidates)
+
+    node_line = np.cross(normal_t, normal_c)
+    sin_relative = np.linalg.norm(node_line, axis=-1)
+    relative_inclination = np.arctan2(sin_relative, np.einsum("ij,ij->i", normal_t, normal_c))
+    coplanar = sin_relative < np.sin(np.radians(ORBIT_PATH_COPLANAR_DEG))
+    node_line = node_line / np.where(sin_relative > 0, sin_relative, 1.0)[:, None]
+
+    u_t = np.arctan2(np.einsum("ij,ij->i", node_line, in_plane_t), np.einsum("ij,ij->i", node_line, node_t))
+    u_c = np.arctan2(np.einsum("ij,ij->i", node_line, in_plane_c), np.einsum("ij,ij->i", node_line, node_c))
+    u_target = np.stack([u_t, u_t + np.pi], axis=-1)
+    u_candidate = np.stack([u_c, u_c + np.pi], axis=-1)
+    return {
+        "coplanar": coplanar,
+        "relative_inclination": relative_inclination,
+        "u_target": u_target,
+        "u_candidate": u_candidate,
+        "radius_target": _orbit_radius(target, u_target),
+        "radius_candidate": _orbit_radius(candidates, u_candidate),
+    }
+
+
+def _drift_pads(target, candidates, nodes, duration_seconds):
+    """
+    Margini aggiuntivi per coppia dovuti all'evoluzione delle orbite durante la
+    finestra, che i filtri valutano con la geometria di inizio finestra.
 
-    except ValueError as e:
-        logger.error(f"Errore di valore: {e}")
-        raise
-    except Exception as e:
-        logger.error(f"Errore inatteso: {e}")
-        raise
+    Returns:
+        tuple: (pad_km, pad_seconds) per candidato. pad_km copre la rotazione
+        relativa dei piani, lo spostamento dei nodi mutui e la rotazione del perigeo
+        (scalata sull'eccentricita'); pad_seconds lo spostamento del passaggio ai
+        nodi e la resistenza atmosferica non lineare nella finestra.
+    """
+    plane_drift = np.abs(target["nodedot"] - candidates["nodedot"]) * duration_seconds
+    node_shift = np.minimum(np.pi, plane_drift / np.maximum(np.sin(nodes["relative_inclination"]), 1e-3))
+    pad_km = np.maximum(target["a"] * (1 + target["e"]), candidates["a"] * (1 + candidates["e"])) * plane_drift
+    pad_seconds = np.zeros_like(pad_km)
+    for elements in (target, candidates):
+        apse_shift = np.abs(elements["argpdot"]) * duration_seconds + node_shift
+        pad_km += np.minimum(elements["a"] * elements["e"] * apse_shift, 2 * elements["a"] * elements["e"])
+        mean_motion = np.abs(elements["u_rate"])
+        pad_seconds = np.maximum(
+            pad_seconds,
+            (node_shift + 2 * elements["e"] * apse_shift + np.abs(elements["ndot"]) * duration_seconds ** 2 / 4) / mean_motion,
+        )
+    return pad_km, pad_seconds
 
 
-# ****************************************************************************************
-# Sezione 1: Funzioni di servizio
-# ****************************************************************************************
+def _node_radial_gap(target, candidates, nodes, distance_km):
+    """
+    Minima differenza di raggio possibile tra target e candidato vicino a ciascun
+    nodo mutuo, shape (n, 2). Due oggetti entro distance_km sono entrambi a meno
+    di distance_km dall'altro piano, quindi entro un arco attorno al nodo la cui
+    ampiezza cresce al diminuire dell'inclinazione relativa: lungo l'arco il raggio
+    varia al piu' di a * e per radiante. Se l'arco copre l'intera orbita vale -inf.
+    """
+    radius = np.maximum(target["a"] * (1 - target["e"]), candidates["a"] * (1 - candidates["e"]))
+    ratio = distance_km / np.maximum(radius * np.sin(nodes["relative_inclination"]), 1e-9)
+    half_width = np.arcsin(np.clip(ratio, 0.0, 1.0)) + distance_km / radius
+    slack = (target["a"] * target["e"] + candidates["a"] * candidates["e"]) * half_width
+    gap = np.abs(nodes["radius_target"] - nodes["radius_candidate"]) - slack[:, None]
+    gap[ratio >= 1.0] = -np.inf
+    return gap
 
-def get_db_connection():
-    try:
-        # Controlla l'ambiente
-        if ENV == "development":  # Locale
-            logger.info("Connecting to the local database.")
-            db_user = os.getenv("DB_USER", "postgres")
-            db_password = os.getenv("DB_PASS", "password")
-            db_host = os.getenv("DB_HOST", "localhost")
-            db_name = os.getenv("DB_NAME", "spacepatrol")
-            db_port = os.getenv("DB_PORT", 5432)
-            
-            conn = psycopg2.connect(
-                user=db_user,
-                password=db_password,
-                host=db_host,
-                port=db_port,
-                database=db_name
-            )
-        else:  # Su Vercel
-            logger.info("Connecting to the remote database using URL_DB.")
-            conn = psycopg2.connect(URL_DB)
-        
-        return conn
-    except Exception as e:
-        logger.error("Database connection error: %s", e)
-        return None
 
-def retrieve_tle_engaged(min_or_equal_apoapsis_km_value, min_or_equal_periapsis_km_value, min_or_equal_inclination_degrees_value, norad_cat_id_to_check):
-    try:
-        logger.info("Retrieving TLE and parameters...")
+def _pair_elements(catalog_index, target_row, rows, window):
+    target = _window_elements(catalog_index, np.array([target_row]), window)
+    candidates = _window_elements(catalog_index, rows, window)
+    target = {name: np.repeat(value, len(rows)) for name, value in target.items()}
+    return target, candidates
 
-        # Connessione al database
-        conn = get_db_connection()
-        if conn is None:
-            raise Exception("Connessione al database non riuscita.")
 
-        # Recupera il TLE_DATA_ARRAY dal database
-        tle_data_query = "SELECT * FROM tle_list"  # Adatta alla struttura della tabella
-        cursor = conn.cursor()
-        cursor.execute(tle_data_query)
-        space_track_data = cursor.fetchall()
-        logger.info(f"{len(space_track_data)} lines in own space track data database found")
-        cursor.close()
+def filter_by_tolerance(catalog_index, target_row, rows, config, threshold_km, window):
+    """
+    Filtro storico: apoapsis, periapsis e inclinazione entro le tolleranze richieste.
+    """
+    candidates = query_catalog_index(
+        catalog_index,
+        catalog_index["apoapsis"][target_row], catalog_index["periapsis"][target_row], catalog_index["inclination"][target_row],
+        config["apoapsis_km"], config["periapsis_km"], config["inclination_deg"],
+    )
+    return rows[np.isin(rows, candidates)]
 
-        try:
-            main_object = get_main_object(space_track_data, norad_cat_id_to_check)
-            logger.debug(f"Main object trovato: {main_object}")
-        except ValueError as e:
-            logger.error(f"Errore nella ricerca del main object: {e}")
-            raise
 
-        try:
-            potential_colliders = get_potential_colliders(space_track_data, norad_cat_id_to_check, min_or_equal_apoapsis_km_value, min_or_equal_periapsis_km_value, min_or_equal_inclination_degrees_value)
-            logger.debug(f"TLE - Potential Colliders: {len(potential_colliders)}")
-        except ValueError as e:
-            logger.error(f"Errore nella ricerca dei colliders: {e}")
-            raise
+def filter_by_apsis(catalog_index, target_row, rows, config, threshold_km, window):
+    """
+    Setaccio apogeo/perigeo: scarta le orbite il cui intervallo di quota
+    [perigeo, apogeo] dista dall'intervallo del target piu' di soglia + pad.
+    """
+    distance_km = threshold_km + config["pad_km"]
+    highest_perigee = np.maximum(catalog_index["periapsis"][rows], catalog_index["periapsis"][target_row])
+    lowest_apogee = np.minimum(catalog_index["apoapsis"][rows], catalog_index["apoapsis"][target_row])
+    return rows[highest_perigee - lowest_apogee <= distance_km]
 
-        logger.debug(f"Main object structure: {main_object}")
-        # logger.debug(f"Potential collider structure: {potential_colliders}")
 
-        tle_set = {
-            "main_object": [main_object.get("TLE_LINE1", ""), main_object.get("TLE_LINE2", "")]
-        }
+def filter_by_orbit_path(catalog_index, target_row, rows, config, threshold_km, window):
+    """
+    Filtro geometrico sul percorso orbitale: due orbite non complanari possono
+    avvicinarsi solo lungo la linea dei nodi mutui, quindi si scartano i candidati
+    la cui differenza di raggio con il target supera, vicino a entrambi i nodi (vedi
+    `_node_radial_gap`), soglia + pad + deriva delle orbite nella finestra (vedi
+    `_drift_pads`). Gli oggetti non
+    propagabili all'inizio della finestra vengono mantenuti.
+    """
+    if len(rows) == 0:
+        return rows
+    target, candidates = _pair_elements(catalog_index, target_row, rows, window)
+    if not target["valid"][0]:
+        return rows
+    nodes = _mutual_nodes(target, candidates)
+    pad_km, _ = _drift_pads(target, candidates, nodes, window[1])
+    distance_km = threshold_km + config["pad_km"] + pad_km
+    radial_gap = _node_radial_gap(target, candidates, nodes, distance_km).min(axis=-1)
+    return rows[~candidates["valid"] | nodes["coplanar"] | (radial_gap <= distance_km)]
+
+
+def _node_windows(elements, u_node, relative_inclination, distance_km, duration_seconds, pad_seconds):
+    """
+    Finestre temporali, in secondi dall'inizio della finestra di screening, in cui
+    ogni oggetto si trova entro distance_km dall'altro piano orbitale vicino al nodo
+    mutuo u_node. Restituisce (start, end) con shape (n, k); le finestre fuori
+    dall'intervallo di screening valgono NaN.
+    """
+    a, e = elements["a"], elements["e"]
+    arg_perigee = elements["arg_perigee"]
+    mean_motion = elements["u_rate"] - elements["argpdot"]
+    radius = a * (1 - e ** 2) / (1 + e * np.cos(u_node - arg_perigee))
+
+    ratio = distance_km / np.maximum(radius * np.sin(relative_inclination), 1e-9)
+    half_width = np.arcsin(np.clip(ratio, 0.0, 1.0))
+
+    def mean_anomaly(true_anomaly):
+        eccentric = 2 * np.arctan2(np.sqrt(1 - e) * np.sin(true_anomaly / 2), np.sqrt(1 + e) * np.cos(true_anomaly / 2))
+        return eccentric - e * np.sin(eccentric)
+
+    m_low = mean_anomaly(u_node - half_width - arg_perigee)
+    m_span = np.mod(mean_anomaly(u_node + half_width - arg_perigee) - m_low, 2 * np.pi)
+    m_start = mean_anomaly(elements["u_start"] - arg_perigee)
+    first = np.mod(m_low - m_start, 2 * np.pi) / mean_motion - 2 * np.pi / mean_motion
+
+    period = 2 * np.pi / mean_motion
+    n_windows = int(np.ceil(duration_seconds / np.nanmin(period))) + 2 if len(period) else 0
+    k = np.arange(n_windows)
+    starts = first[:, None] + k[None, :] * period[:, None] - pad_seconds[:, None]
+    ends = starts + (m_span / mean_motion)[:, None] + 2 * pad_seconds[:, None]
+
+    # Oggetti sempre entro la distanza dal piano: finestra unica sull'intero intervallo
+    always = ratio >= 1.0
+    starts[always] = np.nan
+    ends[always] = np.nan
+    starts[always, 0] = 0.0
+    ends[always, 0] = duration_seconds
+
+    outside = (ends < 0) | (starts > duration_seconds)
+    starts[outside] = np.nan
+    ends[outside] = np.nan
+    return starts, ends
+
+
+def filter_by_time(catalog_index, target_row, rows, config, threshold_km, window):
+    """
+    Filtro temporale: per ogni nodo mutuo compatibile in quota verifica che target e
+    candidato attraversino la zona del nodo in finestre temporali sovrapposte
+    all'interno dell'intervallo di screening. Pad in km e in secondi crescono con
+    la deriva delle orbite nella finestra (vedi `_drift_pads`).
+    """
+    if len(rows) == 0:
+        return rows
+    target, candidates = _pair_elements(catalog_index, target_row, rows, window)
+    if not target["valid"][0]:
+        return rows
+    duration_seconds = window[1]
+    nodes = _mutual_nodes(target, candidates)
+    pad_km, pad_seconds = _drift_pads(target, candidates, nodes, duration_seconds)
+    distance_km = threshold_km + config["pad_km"] + pad_km
+    pad_seconds = config["pad_seconds"] + pad_seconds
+    keep = nodes["coplanar"] | ~candidates["valid"]
+    radial_gap = _node_radial_gap(target, candidates, nodes, distance_km)
+
+    for node in range(2):
+        radial_ok = radial_gap[:, node] <= distance_km
+        check = radial_ok & ~keep
+        if not check.any():
+            continue
+        t_start, t_end = _node_windows(
+            {name: value[check] for name, value in target.items()}, nodes["u_target"][check, node],
+            nodes["relative_inclination"][check], distance_km[check], duration_seconds, pad_seconds[check],
+        )
+        c_start, c_end = _node_windows(
+            {name: value[check] for name, value in candidates.items()}, nodes["u_candidate"][check, node],
+            nodes["relative_inclination"][check], distance_km[check], duration_seconds, pad_seconds[check],
+        )
+        overlap = (c_start[:, :, None] <= t_end[:, None, :]) & (t_start[:, None, :] <= c_end[:, :, None])
+        keep[np.flatnonzero(check)[overlap.any(axis=(1, 2))]] = True
 
-        for i, obj in enumerate(potential_colliders):
-            tle_line1 = obj[23]["tle_line1"]
-            tle_line2 = obj[23]["tle_line2"]
-            
-            if tle_line1 and tle_line2:  # Aggiungi solo se entrambi esistono
-                tle_set[f"object_{i + 1}"] = [tle_line1, tle_line2]
+    return rows[keep]
 
 
-        logger.debug(f"Generated TLE Set: {len(tle_set)}")
-        conn.close()  # Chiude la connessione
-        return tle_set
-    except Exception as e:
-        logger.error("Error retrieving TLE and parameters: %s", e)
-        raise
+FILTER_STAGES = [
+    ("tolerance", filter_by_tolerance),
+    ("apsis", filter_by_apsis),
+    ("orbit_path", filter_by_orbit_path),
+    ("time", filter_by_time),
+]
 
-# def calculate_positions(tle, start_time, duration_minutes, step_seconds=60):
-#     satellite = Satrec.twoline2rv(tle[0], tle[1])
-#     positions = []
-#     current_time = start_time
-
-#     for _ in range(0, duration_minutes * 60, step_seconds):
-#         jd, fr = jday(
-#             current_time.year,
-#             current_time.month,
-#             current_time.day,
-#             current_time.hour,
-#             current_time.minute,
-#             current_time.second,
-#         )
-#         e, r, _ = satellite.sgp4(jd, fr)
-#         if e == 0:
-#             offset_seconds = (current_time - start_time).total_seconds()
-#             positions.append((offset_seconds, r))
-#         else:
-#             logger.warning(f"SGP4 Error at {current_time}: e={e}, jd={jd}, fr={fr}")
-#         current_time += timedelta(seconds=step_seconds)
-
-#     # logger.debug(f"Calculated Positions for TLE: {tle}")
-#     return positions
-def calculate_positions(tle, start_time, duration_minutes, step_seconds=60):
+# orbit_path e time sono disattivati per default: si abilitano per richiesta con
+# "filters" dopo averli validati sul catalogo reale (vedi tests/test_filters.py)
+DEFAULT_FILTERS = {
+    "tolerance": {"enabled": True},
+    "apsis": {"enabled": True, "pad_km": 25.0},
+    "orbit_path": {"enabled": False, "pad_km": 25.0},
+    "time": {"enabled": False, "pad_km": 25.0, "pad_seconds": 120.0},
+}
+
+
+def build_filter_config(data, min_or_equal_apoapsis_km_value, min_or_equal_periapsis_km_value, min_or_equal_inclination_degrees_value):
     """
-    Calcola le posizioni di un satellite in un determinato intervallo di tempo.
+    Unisce la configurazione "filters" della richiesta con i default degli stadi.
+    Le tolleranze del filtro storico arrivano dai parametri min_or_equal_*.
+    """
+    requested = data.get("filters") or {}
+    filters = {}
+    for stage, _ in FILTER_STAGES:
+        config = dict(DEFAULT_FILTERS[stage])
+        config.update(requested.get(stage) or {})
+        filters[stage] = config
+    filters["tolerance"].update({
+        "apoapsis_km": min_or_equal_apoapsis_km_value,
+        "periapsis_km": min_or_equal_periapsis_km_value,
+        "inclination_deg": min_or_equal_inclination_degrees_value,
+    })
+    return filters
+
+
+def run_filter_pipeline(catalog_index, target_row, filters, threshold_km, window):
+    """
+    Esegue in sequenza gli stadi di filtro abilitati sull'intero catalogo.
 
     Args:
-        tle (list): Due linee del TLE.
-        start_time (datetime): Tempo di inizio.
-        duration_minutes (int): Durata in minuti.
-        step_seconds (int): Intervallo di tempo tra i passi in secondi.
+        catalog_index (dict): Indice prodotto da `build_catalog_index`.
+        target_row (int): Riga del target nell'indice.
+        filters (dict): Configurazione per stadio, vedi `build_filter_config`.
+        threshold_km (float): Soglia di screening, sommata al pad di ogni stadio.
+        window (tuple): (start_jd, duration_seconds) della finestra di screening.
 
     Returns:
-        list: Posizioni del satellite [(offset_seconds, [x, y, z]), ...].
+        tuple: (righe candidate, [{"stage": nome, "kept": n}, ...]).
     """
-    try:
-        # Inizializza il satellite usando il TLE
-        satellite = Satrec.twoline2rv(tle[0], tle[1])
-
-        # Genera i tempi richiesti
-        time_steps = [
-            start_time + timedelta(seconds=i)
-            for i in range(0, duration_minutes * 60, step_seconds)
-        ]
-
-        # Pre-calcolo jd e fr per tutti i passi temporali
-        jd_fr_list = [
-            jday(
-                current_time.year,
-                current_time.month,
-                current_time.day,
-                current_time.hour,
-                current_time.minute,
-                current_time.second,
-            )
-            for current_time in time_steps
-        ]
-
-        # Calcolo delle posizioni in batch
-        results = [satellite.sgp4(jd, fr) for jd, fr in jd_fr_list]
-
-        # Creazione della lista di posizioni
-        positions = []
-        for offset_seconds, (e, r, _) in zip(
-            range(0, duration_minutes * 60, step_seconds), results
-        ):
-            if e == 0:  # Solo se il calcolo è valido
-                positions.append((offset_seconds, r))
-            else:
-                logger.warning(f"SGP4 Error at offset {offset_seconds}: e={e}")
-
-        return positions
+    target_norad = catalog_index["norad"][target_row]
+    rows = np.flatnonzero(catalog_index["norad"] != target_norad)
+    stats = [{"stage": "catalog", "kept": int(len(rows))}]
+    for stage, stage_filter in FILTER_STAGES:
+        if not filters[stage].get("enabled"):
+            continue
+        rows = stage_filter(catalog_index, target_row, rows, filters[stage], threshold_km, window)
+        stats.append({"stage": stage, "kept": int(len(rows))})
+    return rows, stats
+
+
+# Colonne del catalogo lette per l'indice: (espressione SQL, nome, dtype NumPy).
+# I valori numerici mancanti arrivano come NaN, i TLE mancanti come stringa vuota.
+CATALOG_COLUMNS = [
+    ("codnorad_riga1", "norad", "i8"),
+    ("COALESCE(apoapsis, 'NaN')", "apoapsis", "f8"),
+    ("COALESCE(periapsis, 'NaN')", "periapsis", "f8"),
+    ("COALESCE(inclination, 'NaN')", "inclination", "f8"),
+    ("COALESCE(ascensione_retta, 'NaN')", "raan", "f8"),
+    ("COALESCE(eccentricita, 'NaN')", "eccentricity", "f8"),
+    ("COALESCE(arg_perigeo, 'NaN')", "arg_perigee", "f8"),
+    ("COALESCE(anomalia_media, 'NaN')", "mean_anomaly", "f8"),
+    ("COALESCE(moto_medio, 'NaN')", "mean_motion", "f8"),
+    ("COALESCE(annoepoca_astro::double precision, 'NaN')", "epoch_year", "f8"),
+    ("COALESCE(epoca_astro, 'NaN')", "epoch_day", "f8"),
+    ("COALESCE(json->>'tle_line1', '')", "tle_line1", "U80"),
+    ("COALESCE(json->>'tle_line2', '')", "tle_line2", "U80"),
+]
+CATALOG_DTYPE = np.dtype([(name, dtype) for _, name, dtype in CATALOG_COLUMNS])
+
+
+def load_catalog_columns(conn, norad_codes=None):
+    """
+    Legge da tle_list solo le colonne dell'indice con un COPY ... TO STDOUT e le
+    converte direttamente in un array strutturato NumPy, senza passare da una
+    tupla Python per riga e senza trasferire la colonna json completa.
 
-    except Exception as e:
-        logger.error(f"Error calculating positions: {e}")
-        return []
+    Args:
+        conn: Connessione al database.
+        norad_codes (list, optional): Limita la lettura a questi NORAD.
 
+    Returns:
+        numpy.ndarray: Array strutturato con dtype CATALOG_DTYPE.
+    """
+    query = sql.SQL("SELECT {} FROM tle_list").format(
+        sql.SQL(", ").join(sql.SQL(expression) for expression, _, _ in CATALOG_COLUMNS)
+    )
+    cursor = conn.cursor()
+    if norad_codes is not None:
+        query = sql.SQL("{} WHERE codnorad_riga1 = ANY({})").format(query, sql.Literal(list(norad_codes)))
+    buffer = io.StringIO()
+    cursor.copy_expert(sql.SQL("COPY ({}) TO STDOUT").format(query), buffer)
+    cursor.close()
 
-def from_tle_to_positions(tle_set, start_time, duration_minutes, step_seconds=60):
-    tle_positions = {}
-    for satellite_id, tle in tle_set.items():
-        # logger.info(f"Processing TLE for Satellite: {satellite_id}")
-        positions = calculate_positions(tle, start_time, duration_minutes, step_seconds)
-        if not positions:
-            logger.warning(f"No positions calculated for {satellite_id}. Skipping.")
-        else:
-            tle_positions[satellite_id] = positions
-    logger.debug(f"Processed Positions Dict: {tle_positions}")
-    return tle_positions
+    if not buffer.tell():
+        return np.empty(0, dtype=CATALOG_DTYPE)
+    buffer.seek(0)
+    return np.loadtxt(buffer, dtype=CATALOG_DTYPE, delimiter="\t", comments=None, quotechar=None, ndmin=1)
 
-def calculate_intersections(tle_positions, threshold_km=5000.0):
-    main_object_id = "main_object"
-    intersections = []
 
-    main_positions = tle_positions.get(main_object_id, [])
-    for satellite_id, related_positions in tle_positions.items():
-        if satellite_id == main_object_id:
-            continue
-        for pos_main, pos_related in zip(main_positions, related_positions):
-            _, coord_main = pos_main
-            _, coord_related = pos_related
-            distance = np.linalg.norm(np.array(coord_main) - np.array(coord_related))
-            if distance <= threshold_km:
-                intersections.append({
-                    "time": pos_main[0],
-                    "sat1": main_object_id,
-                    "sat2": satellite_id,
-                    "coord1": coord_main,
-                    "coord2": coord_related,
-                    "distance": distance
-                })
-        print(f"Intersections for {satellite_id}:")  # Log delle intersezioni trovate
-
-    print("Total Intersections:", len(intersections))  # Log del totale delle intersezioni
-    return intersections
+def build_catalog_index(catalog):
+    """
+    Costruisce l'indice degli elementi orbitali sull'array strutturato del catalogo
+    restituito da `load_catalog_columns`.
 
-def create_czml(tle_positions, epoch, intersections=None):
-    # {
-    #     "start_time": "2024-11-25T00:00:00Z",
-    #     "duration_minutes": 120,
-    #     "step_seconds": 1800,
-    #     "min_or_equal_apoapsis_km_value": 100,
-    #     "min_or_equal_periapsis_km_value": 100,
-    #     "min_or_equal_inclination_degrees_value": 1,
-    #     "threshold": 5000
-    # }
-    czml = [
-        {
-            "id": "document",
-            "name": "Satellite Orbits",
-            "version": "1.0",
-            "clock": {
-                "interval": f"{epoch.isoformat()}Z/{(epoch + timedelta(hours=2)).isoformat()}Z",
-                "currentTime": epoch.isoformat() + "Z",
-                "multiplier": 1,
-                "range": "CLAMPED"
-            }
-        }
-    ]
+    L'apoapsis e' tenuto anche ordinato per rispondere alle query di tolleranza con
+    una ricerca binaria. I valori mancanti sono NaN e non soddisfano mai una query.
 
-    for idx, (satellite_id, positions) in enumerate(tle_positions.items(), start=1):
-        if len(positions) < 2:
-            logger.warning(f"Satellite {satellite_id} has insufficient data: {positions}")
-            continue
+    Returns:
+        dict: Indice con l'array del catalogo ("catalog"), gli array per elemento,
+        l'ordinamento per apoapsis, la mappa NORAD -> riga e la cache dei `Satrec`
+        gia' inizializzati (per NORAD, riempita da `get_catalog_satrec`).
+    """
+    norad = catalog["norad"]
+    apoapsis = catalog["apoapsis"]
+    epoch_year = catalog["epoch_year"]
+    # Data giuliana dell'epoca: 1 gennaio dell'anno (formula di jday) + giorno frazionario
+    epoch_jd = 367.0 * epoch_year - np.floor(7.0 * epoch_year / 4.0) + 30.0 + 1721013.5 + catalog["epoch_day"]
+
+    invalid = int(np.count_nonzero(np.isnan(apoapsis) | np.isnan(catalog["periapsis"]) | np.isnan(catalog["inclination"])))
+    if invalid:
+        logger.warning(f"{invalid} TLE rows with non numeric orbital elements excluded from the index")
+
+    by_norad = {}
+    for i, code in enumerate(norad.tolist()):
+        by_norad.setdefault(code, i)
+
+    apoapsis_order = np.argsort(apoapsis, kind="stable")
+    return {
+        "catalog": catalog,
+        "norad": norad,
+        "apoapsis": apoapsis,
+        "periapsis": catalog["periapsis"],
+        "inclination": catalog["inclination"],
+        "raan": catalog["raan"],
+        "eccentricity": catalog["eccentricity"],
+        "arg_perigee": catalog["arg_perigee"],
+        "mean_anomaly": catalog["mean_anomaly"],
+        "mean_motion": catalog["mean_motion"],
+        "epoch_jd": epoch_jd,
+        "apoapsis_order": apoapsis_order,
+        "apoapsis_sorted": apoapsis[apoapsis_order],
+        "by_norad": by_norad,
+        "satrecs": {},
+    }
+
+
+def get_catalog_satrec(catalog_index, row_index):
+    """
+    Restituisce il `Satrec` della riga indicata, inizializzandolo dal TLE solo al
+    primo utilizzo per la versione corrente del catalogo. Restituisce None se il
+    TLE manca o non e' leggibile.
+    """
+    norad = int(catalog_index["norad"][row_index])
+    if norad not in catalog_index["satrecs"]:
+        tle_line1 = str(catalog_index["catalog"]["tle_line1"][row_index])
+        tle_line2 = str(catalog_index["catalog"]["tle_line2"][row_index])
+        satellite = None
+        if tle_line1 and tle_line2:
+            try:
+                satellite = Satrec.twoline2rv(tle_line1, tle_line2)
+            except Exception as e:
+                logger.warning(f"Invalid TLE for NORAD_CAT_ID {norad}: {e}")
+        catalog_index["satrecs"][norad] = satellite
+    return catalog_index["satrecs"][norad]
 
-        cartesian_data = []
-        for time, (x, y, z) in positions:
-            cartesian_data.extend([time, x, y, z])
 
-        logger.debug(f"Cartesian Data for {satellite_id}: {cartesian_data}")
+def query_catalog_index(catalog_index, apoapsis, periapsis, inclination, apoapsis_tolerance, periapsis_tolerance, inclination_tolerance, raan=None, raan_tolerance=None):
+    """
+    Restituisce, in ordine di catalogo, gli indici delle righe i cui elementi sono
+    entro le tolleranze indicate. La RAAN viene confrontata solo se raan_tolerance
+    e' specificata.
+    """
+    low = np.searchsorted(catalog_index["apoapsis_sorted"], apoapsis - apoapsis_tolerance, side="left")
+    high = np.searchsorted(catalog_index["apoapsis_sorted"], apoapsis + apoapsis_tolerance, side="right")
+    candidates = catalog_index["apoapsis_order"][low:high]
 
-        czml.append({
-            "id": f"line{idx}",
-            "name": f"Satellite {satellite_id}",
-            "availability": f"{epoch.isoformat()}Z/{(epoch + timedelta(hours=2)).isoformat()}Z",
-            "path": {
-                "material": {"solidColor": {"color": {"rgba": [255, 0, 0, 255]}}},
-                "width": 5
-            },
-            "position": {
-                "epoch": epoch.isoformat() + "Z",
-                "cartesian": cartesian_data
-            }
-        })
+    mask = (
+        (np.abs(catalog_index["periapsis"][candidates] - periapsis) <= periapsis_tolerance)
+        & (np.abs(catalog_index["inclination"][candidates] - inclination) <= inclination_tolerance)
+    )
+    if raan_tolerance is not None:
+        raan_delta = np.abs((catalog_index["raan"][candidates] - raan + 180.0) % 360.0 - 180.0)
+        mask &= raan_delta <= raan_tolerance
 
-    if intersections:
-        logger.debug(f"Intersections added to CZML: {intersections}")
+    return np.sort(candidates[mask])
 
-    return czml
 
-def update_match_actual(intersections):
+def get_main_object(catalog_index, norad_cat_id):
     """
-    Aggiorna la tabella match_actual: elimina tutti i record esistenti
-    e inserisce i nuovi dati.
+    Trova il main object nell'indice del catalogo in base al NORAD_CAT_ID ottenuto dal database.
+    """
+    try:
+        row_index = catalog_index["by_norad"].get(int(norad_cat_id))
+        if row_index is None:
+            # Solleva errore se il main object non viene trovato
+            raise ValueError(f"Main object con NORAD_CAT_ID {norad_cat_id} non trovato!")
+
+        logger.info(f"Main object found for NORAD_CAT_ID {norad_cat_id}")
+        catalog = catalog_index["catalog"]
+        return {
+            "TLE_LINE1": str(catalog["tle_line1"][row_index]),
+            "TLE_LINE2": str(catalog["tle_line2"][row_index]),
+            "SATREC": get_catalog_satrec(catalog_index, row_index),
+        }
+    except Exception as e:
+        logger.error(f"Errore in get_main_object: {e}")
+        raise
+
+def get_potential_colliders(catalog_index, norad_cat_id, filters, threshold_km, window):
+    """
+    Calcola i potenziali collider del NORAD_CAT_ID con la pipeline di filtri configurata.
+
+    Returns:
+        tuple: (indici di riga dei collider nell'indice del catalogo, statistiche per stadio).
+    """
+    try:
+        # Cerca i dati del TLE corrispondenti al NORAD_CAT_ID
+        row_index = catalog_index["by_norad"].get(int(norad_cat_id))
+        if row_index is None:
+            raise ValueError(f"Nessun TLE trovato per il NORAD_CAT_ID {norad_cat_id}")
+
+        target = {
+            "APOAPSIS": catalog_index["apoapsis"][row_index],
+            "PERIAPSIS": catalog_index["periapsis"][row_index],
+            "INCLINATION": catalog_index["inclination"][row_index]
+        }
+        if any(np.isnan(value) for value in target.values()):
+            raise ValueError(f"Errore nell'estrazione dei parametri dal TLE record: {target}")
+
+        logger.debug(f"Target TLE parameters: {target}")
+
+        with stage_timer("filter"):
+            colliders, filter_stats = run_filter_pipeline(catalog_index, row_index, filters, threshold_km, window)
+        count_metric("filter_candidates", len(colliders))
+
+        logger.info(f"Potential colliders for NORAD_CAT_ID {norad_cat_id}: {len(colliders)} found ({filter_stats})")
+        return colliders, filter_stats
+
+    except ValueError as e:
+        logger.error(f"Errore di valore: {e}")
+        raise
+    except Exception as e:
+        logger.error(f"Errore inatteso: {e}")
+        raise
+
+
+# ****************************************************************************************
+# Sezione 1: Funzioni di servizio
+# ****************************************************************************************
+
+def _db_connect_params():
+    """
+    Parametri di connessione per psycopg2 in base all'ambiente.
+    """
+    # Controlla l'ambiente
+    if ENV == "development":  # Locale
+        return {
+            "user": os.getenv("DB_USER", "postgres"),
+            "password": os.getenv("DB_PASS", "password"),
+            "host": os.getenv("DB_HOST", "localhost"),
+            "port": os.getenv("DB_PORT", 5432),
+            "database": os.getenv("DB_NAME", "spacepatrol"),
+        }
+    # Su Vercel
+    return {"dsn": URL_DB}
+
+
+def get_db_pool():
+    """
+    Restituisce il pool di connessioni del processo, creandolo al primo utilizzo
+    (cold start) e riutilizzandolo nelle invocazioni successive (warm start). Dopo
+    un fork il pool ereditato dal padre viene abbandonato e ricreato.
+    """
+    with _db_pool_lock:
+        if _db_pool["pool"] is None or _db_pool["pid"] != os.getpid():
+            logger.info(f"Creating database connection pool (min={DB_POOL_MIN}, max={DB_POOL_MAX}).")
+            _db_pool["pool"] = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **_db_connect_params())
+            _db_pool["pid"] = os.getpid()
+            _db_pool["slots"] = threading.BoundedSemaphore(DB_POOL_MAX)
+            _borrowed_connections.clear()
+        return _db_pool["pool"]
+
+
+def close_db_pool():
+    """
+    Chiude tutte le connessioni del pool (hook di shutdown del processo).
+    """
+    with _db_pool_lock:
+        if _db_pool["pool"] is not None and _db_pool["pid"] == os.getpid():
+            _db_pool["pool"].closeall()
+            logger.info("Database connection pool closed.")
+        _db_pool["pool"] = None
+        _borrowed_connections.clear()
+
+
+def _pool_checkout(pool):
+    """
+    Come `pool.getconn()`, ma apre le nuove connessioni (TCP/TLS) fuori da ogni
+    lock: ThreadedConnectionPool terrebbe il proprio lock durante la connessione,
+    bloccando gli altri prelievi e restituzioni. Il limite di DB_POOL_MAX
+    connessioni e' garantito dal semaforo di `get_db_connection`.
+    """
+    with pool._lock:
+        if pool.closed:
+            raise PoolError("connection pool is closed")
+        if pool._pool:
+            return pool._getconn()
+    conn = psycopg2.connect(*pool._args, **pool._kwargs)
+    with pool._lock:
+        if pool.closed:
+            conn.close()
+            raise PoolError("connection pool is closed")
+        key = pool._getkey()
+        pool._used[key] = conn
+        pool._rused[id(conn)] = key
+    return conn
+
+
+def get_db_connection():
+    """
+    Preleva una connessione dal pool (o ne apre una nuova in modalita' pgbouncer,
+    dove il pooling e' delegato a PgBouncer). Con il pool esaurito attende fino a
+    DB_POOL_WAIT_SECONDS che una connessione venga restituita. Ogni connessione va
+    restituita con `release_db_connection`; quelle prelevate durante una richiesta
+    e non restituite vengono recuperate a fine richiesta e contate come leak.
+    """
+    slot = None
+    try:
+        if DB_POOL_MODE == "pgbouncer":
+            conn = psycopg2.connect(**_db_connect_params())
+        else:
+            pool = get_db_pool()
+            slots = _db_pool["slots"]
+            if not slots.acquire(timeout=DB_POOL_WAIT_SECONDS):
+                raise PoolError(f"no connection released within {DB_POOL_WAIT_SECONDS}s (DB_POOL_MAX={DB_POOL_MAX})")
+            slot = slots
+            conn = _pool_checkout(pool)
+            if conn.closed:
+                pool.putconn(conn, close=True)
+                with _db_pool_lock:
+                    _db_pool_stats["discarded"] += 1
+                conn = _pool_checkout(pool)
+
+        with _db_pool_lock:
+            _borrowed_connections[id(conn)] = {
+                "since": time.monotonic(),
+                "origin": "".join(traceback.format_stack(limit=4)[:-1]),
+                "slot": slot,
+            }
+            _db_pool_stats["checkouts"] += 1
+        if has_request_context():
+            g.setdefault("db_connections", []).append(conn)
+        return conn
+    except Exception as e:
+        if slot is not None:
+            slot.release()
+        with _db_pool_lock:
+            _db_pool_stats["errors"] += 1
+        logger.error("Database connection error: %s", e)
+        return None
+
+
+def release_db_connection(conn):
+    """
+    Restituisce una connessione al pool, annullando un'eventuale transazione
+    rimasta aperta. Le connessioni chiuse o in stato sconosciuto vengono scartate.
+    """
+    if conn is None:
+        return
+    with _db_pool_lock:
+        borrowed = _borrowed_connections.pop(id(conn), None)
+        if borrowed is None:
+            return
+        _db_pool_stats["returns"] += 1
+    try:
+        if DB_POOL_MODE == "pgbouncer":
+            conn.close()
+            return
+
+        broken = conn.closed or conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+        if not broken and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        with _db_pool_lock:
+            if broken:
+                _db_pool_stats["discarded"] += 1
+            pool = _db_pool["pool"] if _db_pool["pid"] == os.getpid() else None
+        try:
+            if pool is None:
+                raise PoolError("connection pool is closed")
+            pool.putconn(conn, close=broken)
+        except PoolError:
+            # Pool chiuso o ricreato nel frattempo
+            conn.close()
+    except Exception as e:
+        logger.error("Error releasing database connection: %s", e)
+    finally:
+        if borrowed["slot"] is not None:
+            borrowed["slot"].release()
+
+
+@app.teardown_appcontext
+def release_request_connections(exc):
+    """
+    Recupera le connessioni prelevate durante la richiesta e non restituite.
+    """
+    for conn in g.pop("db_connections", []):
+        with _db_pool_lock:
+            borrowed = _borrowed_connections.get(id(conn))
+            if borrowed is None:
+                continue
+            _db_pool_stats["leaks"] += 1
+        logger.warning(f"Database connection not released by request, reclaimed. Borrowed at:\n{borrowed['origin']}")
+        release_db_connection(conn)
+
+
+def get_pool_metrics():
+    """
+    Metriche del pool: connessioni in uso/libere, contatori e connessioni prelevate
+    da piu' di DB_POOL_LEAK_SECONDS (probabili leak).
+    """
+    now = time.monotonic()
+    pool = _db_pool["pool"]
+    idle = 0
+    if pool is not None:
+        with pool._lock:
+            idle = len(pool._pool) if not pool.closed else 0
+    with _db_pool_lock:
+        suspected_leaks = [
+            {"held_seconds": round(now - borrowed["since"], 3), "origin": borrowed["origin"]}
+            for borrowed in _borrowed_connections.values()
+            if now - borrowed["since"] > DB_POOL_LEAK_SECONDS
+        ]
+        in_use = len(_borrowed_connections)
+        stats = dict(_db_pool_stats)
+    return {
+        "mode": DB_POOL_MODE,
+        "min": DB_POOL_MIN,
+        "max": DB_POOL_MAX,
+        "in_use": in_use,
+        "idle": idle,
+        **stats,
+        "suspected_leaks": suspected_leaks,
+    }
+
+
+atexit.register(close_db_pool)
+
+
+def get_catalog_version(conn):
+    """
+    Restituisce la versione attiva del catalogo (0 se nessuna versione e' stata
+    ancora pubblicata), usata per capire se l'indice in cache e' ancora valido.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM tle_catalog_version WHERE active")
+    version = cursor.fetchone()[0]
+    cursor.close()
+    return version
+
+
+def get_catalog_changes(conn, since_version):
+    """
+    Restituisce l'insieme dei NORAD modificati dalle versioni successive a
+    since_version, oppure None se una di esse e' un ricaricamento completo.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT source, changed_norad FROM tle_catalog_version WHERE version > %s ORDER BY version",
+        (since_version,)
+    )
+    changes = cursor.fetchall()
+    cursor.close()
+
+    changed = set()
+    for source, changed_norad in changes:
+        if source != "delta" or changed_norad is None:
+            return None
+        changed.update(changed_norad)
+    return changed
+
+
+def _quarantine_key(satellite):
+    return int(satellite.satnum), round(satellite.jdsatepoch + satellite.jdsatepochF, 8)
+
+
+def is_quarantined(satellite, start_jd):
+    """
+    True se l'element set del satellite e' in quarantena e la finestra inizia dopo
+    il primo istante in cui SGP4 ha iniziato a fallire in modo permanente.
+    """
+    since_jd = _quarantine.get(_quarantine_key(satellite))
+    return since_jd is not None and start_jd >= since_jd
+
+
+def quarantine_failures(satrecs, errors, jd, fr):
+    """
+    Mette in quarantena gli element set il cui errore SGP4 prosegue fino alla fine
+    della finestra propagata (oggetti decaduti o elementi degenerati): l'errore e'
+    permanente da quell'istante in poi, quindi le finestre successive non vengono
+    piu' propagate. Le nuove voci vengono salvate su tle_quarantine da
+    `sync_quarantine`.
+    """
+    if errors.size == 0:
+        return
+    for i in np.flatnonzero(errors[:, -1] != 0).tolist():
+        valid_steps = np.flatnonzero(errors[i] == 0)
+        first_failure = int(valid_steps[-1]) + 1 if len(valid_steps) else 0
+        since_jd = float(jd[first_failure] + fr[first_failure])
+        norad, epoch_jd = _quarantine_key(satrecs[i])
+        with _quarantine_lock:
+            if since_jd < _quarantine.get((norad, epoch_jd), np.inf):
+                _quarantine[(norad, epoch_jd)] = since_jd
+                _quarantine_state["pending"].append((norad, epoch_jd, int(errors[i, -1]), since_jd))
+                logger.warning(f"NORAD {norad} quarantined: SGP4 error {int(errors[i, -1])} from JD {since_jd:.5f}")
+
+
+def sync_quarantine(conn):
+    """
+    Salva su tle_quarantine le voci aggiunte nel processo e, ogni
+    QUARANTINE_REFRESH_SECONDS, ricarica quelle registrate dagli altri worker
+    eliminando le voci oltre QUARANTINE_RETENTION_DAYS.
+    """
+    with _quarantine_lock:
+        pending = _quarantine_state["pending"]
+        _quarantine_state["pending"] = []
+    refresh = time.monotonic() - _quarantine_state["loaded_at"] >= QUARANTINE_REFRESH_SECONDS
+    if not pending and not refresh:
+        return
+
+    cursor = conn.cursor()
+    try:
+        if pending:
+            cursor.executemany(
+                "INSERT INTO tle_quarantine (norad, epoch_jd, error_code, since_jd) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (norad, epoch_jd) DO UPDATE SET since_jd = LEAST(tle_quarantine.since_jd, EXCLUDED.since_jd), "
+                "error_code = EXCLUDED.error_code",
+                pending
+            )
+        if refresh:
+            cursor.execute(
+                "DELETE FROM tle_quarantine WHERE created_at < NOW() - make_interval(days => %s)",
+                (QUARANTINE_RETENTION_DAYS,)
+            )
+            cursor.execute("SELECT norad, epoch_jd, since_jd FROM tle_quarantine")
+            entries = {(norad, round(epoch_jd, 8)): since_jd for norad, epoch_jd, since_jd in cursor.fetchall()}
+            with _quarantine_lock:
+                _quarantine.clear()
+                _quarantine.update(entries)
+            _quarantine_state["loaded_at"] = time.monotonic()
+            logger.info(f"{len(entries)} element sets in SGP4 quarantine")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        with _quarantine_lock:
+            _quarantine_state["pending"].extend(pending)
+        logger.error(f"Unable to sync SGP4 quarantine: {e}")
+    finally:
+        cursor.close()
+
+
+def get_catalog_index(conn):
+    """
+    Restituisce il catalogo in cache nel processo (righe, array degli elementi e
+    Satrec gia' inizializzati), ricostruendolo solo quando la versione attiva in
+    tle_catalog_version cambia: il controllo e' una singola query sulla tabella
+    delle versioni, quindi ogni worker si accorge degli aggiornamenti fatti da altri.
+    Dopo aggiornamenti incrementali vengono riletti solo gli oggetti modificati.
+    """
+    sync_quarantine(conn)
+    version = get_catalog_version(conn)
+    cached_version = _catalog_index_cache["version"]
+    if _catalog_index_cache["index"] is not None and cached_version == version:
+        logger.info("Using cached catalog index")
+        return _catalog_index_cache["index"]
+
+    changed = None
+    if _catalog_index_cache["index"] is not None and cached_version < version:
+        changed = get_catalog_changes(conn, cached_version)
+
+    if changed is not None:
+        # Aggiornamento incrementale: rilegge solo gli oggetti modificati
+        previous = _catalog_index_cache["index"]["catalog"]
+        unchanged = previous[~np.isin(previous["norad"], list(changed))]
+        catalog = np.concatenate([unchanged, load_catalog_columns(conn, changed)])
+        logger.info(f"{len(changed)} changed objects reloaded from catalog version {cached_version} to {version}")
+    else:
+        catalog = load_catalog_columns(conn)
+        logger.info(f"{len(catalog)} lines in own space track data database found")
+
+    catalog_index = build_catalog_index(catalog)
+    if changed is not None:
+        # I Satrec degli oggetti non modificati restano validi
+        catalog_index["satrecs"] = {
+            norad: satellite for norad, satellite in _catalog_index_cache["index"]["satrecs"].items()
+            if norad not in changed
+        }
+    _catalog_index_cache["version"] = version
+    _catalog_index_cache["index"] = catalog_index
+    return catalog_index
+
+
+def retrieve_tle_engaged(filters, threshold_km, window, norad_cat_id_to_check):
+    try:
+        logger.info("Retrieving TLE and parameters...")
+
+        # Connessione al database
+        conn = get_db_connection()
+        if conn is None:
+            raise Exception("Connessione al database non riuscita.")
+
+        try:
+            with stage_timer("catalog"):
+                catalog_index = get_catalog_index(conn)
+        finally:
+            release_db_connection(conn)
+
+        try:
+            main_object = get_main_object(catalog_index, norad_cat_id_to_check)
+        except ValueError as e:
+            logger.error(f"Errore nella ricerca del main object: {e}")
+            raise
+
+        try:
+            potential_colliders, filter_stats = get_potential_colliders(catalog_index, norad_cat_id_to_check, filters, threshold_km, window)
+            logger.debug(f"TLE - Potential Colliders: {len(potential_colliders)}")
+        except ValueError as e:
+            logger.error(f"Errore nella ricerca dei colliders: {e}")
+            raise
+
+        # Satrec gia' inizializzati dalla cache del catalogo: nessun parsing dei TLE
+        tle_set = {
+            "main_object": main_object["SATREC"]
+        }
+
+        for i, row_index in enumerate(potential_colliders.tolist()):
+            satellite = get_catalog_satrec(catalog_index, row_index)
+            if satellite is not None:  # Aggiungi solo se il TLE e' leggibile
+                tle_set[f"object_{i + 1}"] = satellite
+
+
+        logger.debug(f"Generated TLE Set: {len(tle_set)}")
+        return tle_set, filter_stats
+    except Exception as e:
+        logger.error("Error retrieving TLE and parameters: %s", e)
+        raise
+
+def retrieve_tle_for_customers(filters, threshold_km, window, norad_codes):
+    """
+    Costruisce un unico set di TLE per lo screening di piu' clienti.
+
+    Returns:
+        tuple: (tle_set, candidates, filter_stats) dove tle_set e' {norad: Satrec}
+        con ogni oggetto presente una sola volta, candidates e' {norad
+        cliente: [norad dei potenziali collider]} e filter_stats {norad cliente:
+        statistiche per stadio}.
+    """
+    try:
+        logger.info(f"Retrieving TLE for {len(norad_codes)} customers...")
+
+        conn = get_db_connection()
+        if conn is None:
+            raise Exception("Connessione al database non riuscita.")
+
+        try:
+            with stage_timer("catalog"):
+                catalog_index = get_catalog_index(conn)
+        finally:
+            release_db_connection(conn)
+
+        tle_set = {}
+        candidates = {}
+        filter_stats = {}
+        for norad_code in norad_codes:
+            try:
+                main_object = get_main_object(catalog_index, norad_code)
+                potential_colliders, stats = get_potential_colliders(catalog_index, norad_code, filters, threshold_km, window)
+            except ValueError as e:
+                logger.warning(f"Skipping NORAD_CAT_ID {norad_code}: {e}")
+                continue
+
+            if main_object["SATREC"] is None:
+                logger.warning(f"Skipping NORAD_CAT_ID {norad_code}: invalid TLE")
+                continue
+
+            subject_id = str(int(norad_code))
+            tle_set.setdefault(subject_id, main_object["SATREC"])
+            candidates[subject_id] = []
+            filter_stats[subject_id] = stats
+            for row_index in potential_colliders.tolist():
+                satellite = get_catalog_satrec(catalog_index, row_index)
+                if satellite is not None:  # Aggiungi solo se il TLE e' leggibile
+                    object_id = str(catalog_index["norad"][row_index])
+                    tle_set.setdefault(object_id, satellite)
+                    candidates[subject_id].append(object_id)
+
+        logger.debug(f"Generated TLE Set: {len(tle_set)}")
+        return tle_set, candidates, filter_stats
+    except Exception as e:
+        logger.error("Error retrieving TLE and parameters: %s", e)
+        raise
+
+def build_time_grid(start_time, duration_minutes, step_seconds=60):
+    """
+    Costruisce la griglia temporale di propagazione come vettori NumPy.
+
+    Args:
+        start_time (datetime): Tempo di inizio.
+        duration_minutes (int): Durata in minuti.
+        step_seconds (int): Intervallo di tempo tra i passi in secondi.
+
+    Returns:
+        tuple: (offsets, jd, fr) - offset in secondi da start_time e data giuliana
+        divisa in parte intera e frazionaria, pronti per `sgp4_array`. La griglia
+        termina sempre alla fine della finestra, quindi l'ultimo passo puo' essere
+        piu' corto.
+    """
+    duration_seconds = duration_minutes * 60
+    offsets = np.arange(0, duration_seconds, step_seconds)
+    if len(offsets) and offsets[-1] < duration_seconds:
+        offsets = np.append(offsets, duration_seconds)
+    jd0, fr0 = jday(
+        start_time.year,
+        start_time.month,
+        start_time.day,
+        start_time.hour,
+        start_time.minute,
+        start_time.second + start_time.microsecond / 1e6,
+    )
+    jd = np.full(offsets.shape, jd0, dtype=np.float64)
+    fr = fr0 + offsets / 86400.0
+    return offsets, jd, fr
+
+
+def build_screening_window(start_time, duration_minutes):
+    """
+    Restituisce la finestra di screening (start_jd, duration_seconds) usata dai filtri.
+    """
+    jd, fr = jday(start_time.year, start_time.month, start_time.day, start_time.hour, start_time.minute, start_time.second)
+    return jd + fr, duration_minutes * 60.0
+
+
+def propagate_batch(satrecs, jd, fr):
+    """
+    Propaga tutti i satelliti su tutta la griglia temporale in un unico passaggio
+    vettoriale tramite `SatrecArray`. Oltre PROPAGATION_PARALLEL_MIN_POINTS punti,
+    con PROPAGATION_WORKERS > 1, i satelliti vengono distribuiti tra i processi di
+    `propagate_parallel`.
+
+    Args:
+        satrecs (list): Oggetti `Satrec` gia' inizializzati.
+        jd (np.ndarray): Parte intera della data giuliana, shape (n_steps,).
+        fr (np.ndarray): Parte frazionaria della data giuliana, shape (n_steps,).
+
+    Returns:
+        tuple: (errors, positions, velocities) con shape (n_sats, n_steps),
+        (n_sats, n_steps, 3) e (n_sats, n_steps, 3). Un codice di errore diverso
+        da 0 indica un punto non valido (posizione e velocita' NaN).
+    """
+    if not satrecs:
+        return (
+            np.zeros((0, len(jd)), dtype=np.uint8),
+            np.zeros((0, len(jd), 3)),
+            np.zeros((0, len(jd), 3)),
+        )
+    if (
+        PROPAGATION_WORKERS > 1
+        and len(satrecs) > PROPAGATION_CHUNK_SATS
+        and len(satrecs) * len(jd) >= PROPAGATION_PARALLEL_MIN_POINTS
+    ):
+        try:
+            return propagate_parallel(satrecs, jd, fr)
+        except Exception as e:
+            logger.warning(f"Parallel propagation failed, falling back to serial: {e}")
+            shutdown_propagation_pool()
+    return SatrecArray(satrecs).sgp4(jd, fr)
+
+
+def _satrec_elements(satellite):
+    """
+    Elementi per ricostruire il `Satrec` con sgp4init in un altro processo (gli
+    oggetti `Satrec` non sono serializzabili con pickle).
+    """
+    return (
+        satellite.satnum, (satellite.jdsatepoch - 2433281.5) + satellite.jdsatepochF,
+        satellite.bstar, satellite.ndot, satellite.nddot, satellite.ecco, satellite.argpo,
+        satellite.inclo, satellite.mo, satellite.no_kozai, satellite.nodeo,
+    )
+
+
+def _attach_shared_memory(name):
+    """
+    Apre un blocco di memoria condivisa creato dal processo principale senza
+    registrarlo nel resource tracker: l'unlink spetta solo al processo che lo ha
+    creato, mentre un tracker che vede il blocco registrato dal worker lo
+    eliminerebbe (o segnalerebbe un leak) all'uscita del worker. Prima di Python
+    3.13 SharedMemory non accetta track=False e la registrazione va annullata.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _propagate_shard(elements, jd, fr, shared, n_sats, low, high):
+    """
+    Eseguita nei processi del pool: propaga i satelliti [low, high) e scrive i
+    risultati direttamente negli array in memoria condivisa.
+    """
+    satrecs = []
+    for row in elements:
+        satellite = Satrec()
+        satellite.sgp4init(WGS72, "i", *row)
+        satrecs.append(satellite)
+    errors, positions, velocities = SatrecArray(satrecs).sgp4(jd, fr)
+
+    for name, values in zip(shared, (errors, positions, velocities)):
+        shm = _attach_shared_memory(name)
+        try:
+            target = np.ndarray((n_sats,) + values.shape[1:], dtype=values.dtype, buffer=shm.buf)
+            target[low:high] = values
+            del target
+        finally:
+            shm.close()
+    return high - low
+
+
+def get_propagation_pool():
+    """
+    Restituisce il pool di processi per la propagazione, creato al primo utilizzo
+    nel processo corrente.
+    """
+    with _propagation_pool_lock:
+        if _propagation_pool["executor"] is None or _propagation_pool["pid"] != os.getpid():
+            context = multiprocessing.get_context(PROPAGATION_START_METHOD)
+            _propagation_pool["executor"] = ProcessPoolExecutor(max_workers=PROPAGATION_WORKERS, mp_context=context)
+            _propagation_pool["pid"] = os.getpid()
+            logger.info(f"Propagation pool started: {PROPAGATION_WORKERS} workers ({PROPAGATION_START_METHOD})")
+        return _propagation_pool["executor"]
+
+
+def shutdown_propagation_pool():
+    with _propagation_pool_lock:
+        executor = _propagation_pool["executor"]
+        if executor is not None and _propagation_pool["pid"] == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+        _propagation_pool["executor"] = None
+
+
+atexit.register(shutdown_propagation_pool)
+
+
+def propagate_parallel(satrecs, jd, fr):
+    """
+    Come `propagate_batch`, ma divide i satelliti in blocchi di
+    PROPAGATION_CHUNK_SATS propagati in parallelo dal pool di processi. I worker
+    ricevono solo gli elementi orbitali e la griglia, e scrivono effemeridi ed
+    errori in blocchi di memoria condivisa allocati qui, quindi i risultati non
+    passano mai per pickle.
+    """
+    n_sats, n_steps = len(satrecs), len(jd)
+    layouts = [
+        ((n_sats, n_steps), np.uint8),
+        ((n_sats, n_steps, 3), np.float64),
+        ((n_sats, n_steps, 3), np.float64),
+    ]
+    blocks = []
+    try:
+        for shape, dtype in layouts:
+            blocks.append(shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)))
+        shared = [block.name for block in blocks]
+
+        elements = [_satrec_elements(satellite) for satellite in satrecs]
+        executor = get_propagation_pool()
+        futures = []
+        for low in range(0, n_sats, PROPAGATION_CHUNK_SATS):
+            high = min(low + PROPAGATION_CHUNK_SATS, n_sats)
+            futures.append(executor.submit(_propagate_shard, elements[low:high], jd, fr, shared, n_sats, low, high))
+        for future in futures:
+            future.result()
+
+        results = tuple(
+            np.ndarray(shape, dtype=dtype, buffer=block.buf).copy()
+            for (shape, dtype), block in zip(layouts, blocks)
+        )
+        logger.info(f"Parallel propagation: {n_sats} satellites in {len(futures)} chunks")
+        return results
+    finally:
+        for block in blocks:
+            if sys.version_info < (3, 13):
+                # Con un resource tracker condiviso l'annullamento della registrazione
+                # nei worker rimuove anche quella del processo principale
+                resource_tracker.register(block._name, "shared_memory")
+            block.close()
+            block.unlink()
+
+
+def _ephemeris_cache_key(satellite, jd, fr):
+    """
+    Chiave della cache: NORAD id, epoca dell'element set e griglia temporale.
+    """
+    return (
+        satellite.satnum, satellite.jdsatepoch, satellite.jdsatepochF,
+        float(jd[0]), float(fr[0]), float(fr[-1]), len(fr),
+    )
+
+
+def _ephemeris_cache_path(keys):
+    digest = hashlib.sha1(repr(keys).encode()).hexdigest()
+    return os.path.join(EPHEMERIS_CACHE_DIR, f"batch_{digest}.npy")
+
+
+def _ephemeris_cache_store(key, entry):
+    """
+    Inserisce un'effemeride nella LRU in memoria, eliminando le meno recenti oltre
+    il budget EPHEMERIS_CACHE_MB.
+    """
+    with _ephemeris_cache_lock:
+        previous = _ephemeris_cache.pop(key, None)
+        if previous is not None:
+            _ephemeris_cache_stats["bytes"] -= previous.nbytes
+        _ephemeris_cache[key] = entry
+        _ephemeris_cache_stats["bytes"] += entry.nbytes
+        budget = EPHEMERIS_CACHE_MB * 1024 * 1024
+        while _ephemeris_cache_stats["bytes"] > budget and _ephemeris_cache:
+            _, evicted = _ephemeris_cache.popitem(last=False)
+            _ephemeris_cache_stats["bytes"] -= evicted.nbytes
+            _ephemeris_cache_stats["evictions"] += 1
+
+
+def _ephemeris_cache_get(key):
+    """
+    Cerca un'effemeride nella LRU del processo.
+    """
+    with _ephemeris_cache_lock:
+        entry = _ephemeris_cache.get(key)
+        if entry is not None:
+            _ephemeris_cache.move_to_end(key)
+            _ephemeris_cache_stats["hits"] += 1
+            return entry
+        _ephemeris_cache_stats["misses"] += 1
+        return None
+
+
+def _ephemeris_disk_get(keys, n_steps):
+    """
+    Cerca nella directory condivisa il file del batch con esattamente queste
+    chiavi, mappato in memoria: i worker che propagano lo stesso catalogo sulla
+    stessa griglia condividono le pagine tramite la page cache del sistema operativo.
+
+    Returns:
+        np.ndarray: Array (n_sats, n_steps, 7) oppure None se assente o non valido.
+    """
+    try:
+        batch = np.load(_ephemeris_cache_path(keys), mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if batch.shape != (len(keys), n_steps, 7):
+        return None
+    return batch
+
+
+def _ephemeris_disk_put(keys, batch):
+    """
+    Scrive l'intero batch in un unico file .npy (scrittura atomica tramite file
+    temporaneo) e, al massimo ogni EPHEMERIS_CACHE_PRUNE_SECONDS, riporta la
+    directory entro EPHEMERIS_CACHE_DISK_MB.
+    """
+    path = _ephemeris_cache_path(keys)
+    try:
+        os.makedirs(EPHEMERIS_CACHE_DIR, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as temp_file:
+            np.save(temp_file, batch)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning(f"Unable to write ephemeris cache file {path}: {e}")
+
+    now = time.monotonic()
+    with _ephemeris_cache_lock:
+        if now - _ephemeris_prune_state["last"] < EPHEMERIS_CACHE_PRUNE_SECONDS:
+            return
+        _ephemeris_prune_state["last"] = now
+    _prune_ephemeris_disk_cache()
+
+
+def _prune_ephemeris_disk_cache():
+    """
+    Mantiene la directory della cache entro EPHEMERIS_CACHE_DISK_MB eliminando i
+    file meno recenti.
+    """
+    try:
+        files = [entry for entry in os.scandir(EPHEMERIS_CACHE_DIR) if entry.name.endswith(".npy")]
+    except OSError:
+        return
+    stats = []
+    for entry in files:
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        stats.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in stats)
+    budget = EPHEMERIS_CACHE_DISK_MB * 1024 * 1024
+    for _, size, path in sorted(stats):
+        if total <= budget:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def propagate_cached(satrecs, jd, fr):
+    """
+    Come `propagate_batch`, ma riusa le effemeridi gia' calcolate per lo stesso
+    element set sulla stessa griglia temporale e propaga in batch solo le mancanti.
+    Le effemeridi sono memorizzate come array (n_steps, 7) - posizione, velocita' e
+    codice di errore - nel dtype EPHEMERIS_CACHE_DTYPE. Un batch che da solo supera
+    EPHEMERIS_CACHE_MB non viene messo in cache: svuoterebbe la LRU senza poter
+    essere riusato.
+    """
+    if EPHEMERIS_CACHE_MB <= 0 or not satrecs:
+        return propagate_batch(satrecs, jd, fr)
+
+    n_sats, n_steps = len(satrecs), len(jd)
+    if n_sats * n_steps * 7 * EPHEMERIS_CACHE_DTYPE.itemsize > EPHEMERIS_CACHE_MB * 1024 * 1024:
+        with _ephemeris_cache_lock:
+            _ephemeris_cache_stats["bypassed"] += 1
+        return propagate_batch(satrecs, jd, fr)
+
+    errors = np.zeros((n_sats, n_steps), dtype=np.uint8)
+    positions = np.empty((n_sats, n_steps, 3))
+    velocities = np.empty((n_sats, n_steps, 3))
+
+    keys = [_ephemeris_cache_key(satellite, jd, fr) for satellite in satrecs]
+    missing = []
+    for i, key in enumerate(keys):
+        entry = _ephemeris_cache_get(key)
+        if entry is None:
+            missing.append(i)
+            continue
+        positions[i] = entry[:, 0:3]
+        velocities[i] = entry[:, 3:6]
+        errors[i] = entry[:, 6]
+
+    batch = _ephemeris_disk_get(keys, n_steps) if missing and EPHEMERIS_CACHE_DIR else None
+    if batch is not None:
+        for i in missing:
+            positions[i] = batch[i, :, 0:3]
+            velocities[i] = batch[i, :, 3:6]
+            errors[i] = batch[i, :, 6]
+            _ephemeris_cache_store(keys[i], batch[i])
+        logger.info(f"Ephemeris cache: {n_sats - len(missing)} hits, {len(missing)} loaded from disk")
+        return errors, positions, velocities
+
+    if missing:
+        e, r, v = propagate_batch([satrecs[i] for i in missing], jd, fr)
+        errors[missing] = e
+        positions[missing] = r
+        velocities[missing] = v
+        entries = np.empty((len(missing), n_steps, 7), dtype=EPHEMERIS_CACHE_DTYPE)
+        entries[:, :, 0:3] = r
+        entries[:, :, 3:6] = v
+        entries[:, :, 6] = e
+        for k, i in enumerate(missing):
+            _ephemeris_cache_store(keys[i], entries[k])
+        if EPHEMERIS_CACHE_DIR:
+            batch = np.empty((n_sats, n_steps, 7), dtype=EPHEMERIS_CACHE_DTYPE)
+            batch[:, :, 0:3] = positions
+            batch[:, :, 3:6] = velocities
+            batch[:, :, 6] = errors
+            _ephemeris_disk_put(keys, batch)
+
+    logger.info(f"Ephemeris cache: {n_sats - len(missing)} hits, {len(missing)} propagated")
+    return errors, positions, velocities
+
+
+def from_tle_to_ephemeris(tle_set, start_time, duration_minutes, step_seconds=60):
+    """
+    Converte un set di TLE nelle effemeridi dell'intero set su una griglia comune.
+
+    Args:
+        tle_set (dict): {satellite_id: [tle_line1, tle_line2]} oppure
+            {satellite_id: Satrec} con oggetti gia' inizializzati.
+        start_time (datetime): Tempo di inizio.
+        duration_minutes (int): Durata in minuti.
+        step_seconds (int): Intervallo di tempo tra i passi in secondi.
+
+    Returns:
+        dict: Effemeridi con chiavi "epoch", "ids", "satrecs", "offsets", "jd", "fr",
+        "positions", "velocities" ed "errors". L'indice i di "ids" corrisponde alla
+        riga i degli array. Gli element set in quarantena (vedi
+        `quarantine_failures`) sono esclusi prima della propagazione.
+    """
+    offsets, jd, fr = build_time_grid(start_time, duration_minutes, step_seconds)
+    start_jd = float(jd[0] + fr[0]) if len(jd) else 0.0
+
+    ids = []
+    satrecs = []
+    quarantined = 0
+    for satellite_id, tle in tle_set.items():
+        if isinstance(tle, Satrec):
+            satellite = tle
+        else:
+            try:
+                satellite = Satrec.twoline2rv(tle[0], tle[1])
+            except Exception as e:
+                logger.warning(f"Invalid TLE for {satellite_id}: {e}. Skipping.")
+                continue
+        if satellite.error != 0:
+            logger.warning(f"Invalid TLE for {satellite_id}: e={satellite.error}. Skipping.")
+            continue
+        if is_quarantined(satellite, start_jd):
+            quarantined += 1
+            continue
+        ids.append(satellite_id)
+        satrecs.append(satellite)
+    if quarantined:
+        logger.info(f"{quarantined} quarantined objects skipped")
+
+    with stage_timer("propagate"):
+        errors, positions, velocities = propagate_cached(satrecs, jd, fr)
+    count_metric("propagated_points", errors.size)
+
+    failed_points = int(np.count_nonzero(errors))
+    if failed_points:
+        logger.warning(f"SGP4 errors on {failed_points} of {errors.size} propagated points")
+        quarantine_failures(satrecs, errors, jd, fr)
+
+    return {
+        "epoch": start_time,
+        "ids": ids,
+        "satrecs": satrecs,
+        "offsets": offsets,
+        "jd": jd,
+        "fr": fr,
+        "positions": positions,
+        "velocities": velocities,
+        "errors": errors,
+    }
+
+
+def ephemeris_to_positions(ephemeris):
+    """
+    Converte le effemeridi nel formato {satellite_id: [(offset_seconds, (x, y, z)), ...]},
+    scartando i punti con errore SGP4 e i satelliti senza alcun punto valido.
+    """
+    tle_positions = {}
+    offsets = ephemeris["offsets"].tolist()
+    for i, satellite_id in enumerate(ephemeris["ids"]):
+        valid = ephemeris["errors"][i] == 0
+        if not valid.any():
+            logger.warning(f"No positions calculated for {satellite_id}. Skipping.")
+            continue
+        coords = ephemeris["positions"][i].tolist()
+        tle_positions[satellite_id] = [
+            (offsets[k], tuple(coords[k])) for k in np.flatnonzero(valid)
+        ]
+    return tle_positions
+
+
+def calculate_positions(tle, start_time, duration_minutes, step_seconds=60):
+    """
+    Calcola le posizioni di un satellite in un determinato intervallo di tempo.
+
+    Args:
+        tle (list): Due linee del TLE.
+        start_time (datetime): Tempo di inizio.
+        duration_minutes (int): Durata in minuti.
+        step_seconds (int): Intervallo di tempo tra i passi in secondi.
+
+    Returns:
+        list: Posizioni del satellite [(offset_seconds, [x, y, z]), ...].
+    """
+    try:
+        ephemeris = from_tle_to_ephemeris({"satellite": tle}, start_time, duration_minutes, step_seconds)
+        return ephemeris_to_positions(ephemeris).get("satellite", [])
+
+    except Exception as e:
+        logger.error(f"Error calculating positions: {e}")
+        return []
+
+
+def from_tle_to_positions(tle_set, start_time, duration_minutes, step_seconds=60):
+    ephemeris = from_tle_to_ephemeris(tle_set, start_time, duration_minutes, step_seconds)
+    tle_positions = ephemeris_to_positions(ephemeris)
+    logger.debug(f"Processed Positions for {len(tle_positions)} satellites")
+    return tle_positions
+
+def screen_distances(ephemeris, threshold_km, main_index=0, chunk_size=None):
+    """
+    Calcola in blocchi vettoriali la distanza tra l'oggetto principale e tutti gli
+    altri oggetti delle effemeridi, per ogni passo della griglia.
+
+    Args:
+        ephemeris (dict): Effemeridi prodotte da `from_tle_to_ephemeris`.
+        threshold_km (float): Distanza massima per considerare un passaggio ravvicinato.
+        main_index (int): Riga dell'oggetto principale negli array delle effemeridi.
+        chunk_size (int): Numero di satelliti elaborati per blocco (limita la memoria).
+
+    Returns:
+        dict: Array NumPy "sat_index", "step_index" e "distance", uno per passaggio.
+    """
+    chunk_size = chunk_size or SCREENING_CHUNK_SIZE
+    positions = ephemeris["positions"]
+    valid = ephemeris["errors"] == 0
+    main_positions = positions[main_index]
+    main_valid = valid[main_index]
+
+    sat_index, step_index, distance = [], [], []
+    for start in range(0, len(positions), chunk_size):
+        stop = min(start + chunk_size, len(positions))
+        delta = positions[start:stop] - main_positions
+        block_distance = np.sqrt(np.einsum("ijk,ijk->ij", delta, delta))
+        hit = (block_distance <= threshold_km) & valid[start:stop] & main_valid
+        if start <= main_index < stop:
+            hit[main_index - start] = False
+        rows, steps = np.nonzero(hit)
+        sat_index.append(rows + start)
+        step_index.append(steps)
+        distance.append(block_distance[rows, steps])
+
+    if not sat_index:
+        return {
+            "sat_index": np.zeros(0, dtype=np.intp),
+            "step_index": np.zeros(0, dtype=np.intp),
+            "distance": np.zeros(0),
+        }
+    return {
+        "sat_index": np.concatenate(sat_index),
+        "step_index": np.concatenate(step_index),
+        "distance": np.concatenate(distance),
+    }
+
+
+def hits_to_intersections(ephemeris, hits, main_index=0):
+    """
+    Converte i passaggi compatti di `screen_distances` nei dict restituiti dall'API.
+    """
+    ids = ephemeris["ids"]
+    offsets = ephemeris["offsets"]
+    positions = ephemeris["positions"]
+    main_object_id = ids[main_index]
+
+    intersections = []
+    for sat, step, distance in zip(hits["sat_index"].tolist(), hits["step_index"].tolist(), hits["distance"].tolist()):
+        intersections.append({
+            "time": offsets[step].item(),
+            "sat1": main_object_id,
+            "sat2": ids[sat],
+            "coord1": tuple(positions[main_index, step].tolist()),
+            "coord2": tuple(positions[sat, step].tolist()),
+            "distance": distance
+        })
+    return intersections
+
+
+def _relative_state(main_satellite, satellite, jd, fr):
+    """
+    Restituisce (dr, dv) tra due satelliti all'istante (jd, fr), oppure None se
+    SGP4 fallisce per uno dei due.
+    """
+    e1, r1, v1 = main_satellite.sgp4(jd, fr)
+    e2, r2, v2 = satellite.sgp4(jd, fr)
+    if e1 != 0 or e2 != 0:
+        return None
+    dr = (r2[0] - r1[0], r2[1] - r1[1], r2[2] - r1[2])
+    dv = (v2[0] - v1[0], v2[1] - v1[1], v2[2] - v1[2])
+    return dr, dv
+
+
+def refine_tca(main_satellite, satellite, jd0, fr0, t_low, t_high):
+    """
+    Raffina il tempo di massimo avvicinamento (TCA) cercando lo zero del range-rate
+    nell'intervallo [t_low, t_high] con il metodo di Illinois (regula falsi).
+
+    Args:
+        main_satellite (Satrec): Oggetto principale.
+        satellite (Satrec): Oggetto secondario.
+        jd0, fr0 (float): Data giuliana dell'offset 0.
+        t_low, t_high (float): Estremi dell'intervallo in secondi, con range-rate
+            negativo in t_low e non negativo in t_high.
+
+    Returns:
+        tuple: (tca_offset, dr, dv) oppure None se SGP4 fallisce durante il raffinamento.
+    """
+    def range_rate(t):
+        state = _relative_state(main_satellite, satellite, jd0, fr0 + t / 86400.0)
+        if state is None:
+            return None, None
+        dr, dv = state
+        return dr[0] * dv[0] + dr[1] * dv[1] + dr[2] * dv[2], state
+
+    f_low, _ = range_rate(t_low)
+    f_high, state = range_rate(t_high)
+    if f_low is None or f_high is None:
+        return None
+
+    t, side = t_high, 0
+    for _ in range(TCA_MAX_ITERATIONS):
+        if t_high - t_low <= TCA_TOLERANCE_SECONDS:
+            break
+        t = (t_low * f_high - t_high * f_low) / (f_high - f_low)
+        if not t_low < t < t_high:
+            t = 0.5 * (t_low + t_high)
+        f, state = range_rate(t)
+        if f is None:
+            return None
+        if f == 0.0:
+            break
+        if f < 0.0:
+            t_low, f_low = t, f
+            if side == -1:
+                f_high *= 0.5
+            side = -1
+        else:
+            t_high, f_high = t, f
+            if side == 1:
+                f_low *= 0.5
+            side = 1
+
+    return t, state[0], state[1]
+
+
+def _orbit_speed_limits(satrecs):
+    """
+    Periodo (s) e velocita' massima, al perigeo (km/s), delle orbite medie dei `Satrec`.
+    """
+    mean_motion = np.array([satellite.no_kozai for satellite in satrecs]) / 60.0
+    a = np.array([satellite.a for satellite in satrecs]) * EARTH_RADIUS_KM
+    e = np.array([satellite.ecco for satellite in satrecs])
+    perigee_speed = np.sqrt(WGS72_MU_KM3_S2 * (1 + e) / (a * (1 - e)))
+    return 2 * np.pi / mean_motion, perigee_speed
+
+
+def _subsampled_brackets(main_satellite, satellite, jd0, fr0, intervals, max_step, threshold_km, speed_bound):
+    """
+    Ricampiona con SGP4 gli intervalli (t_low, t_high) della griglia con passo non
+    superiore a max_step e restituisce i sotto-intervalli con cambio di segno del
+    range-rate in cui la distanza minima raggiungibile e' sotto la soglia.
+    """
+    samples = [np.linspace(t_low, t_high, int(np.ceil((t_high - t_low) / max_step)) + 1) for t_low, t_high in intervals]
+    times = np.concatenate(samples)
+    jd = np.full(len(times), jd0)
+    fr = fr0 + times / 86400.0
+    e1, r1, v1 = main_satellite.sgp4_array(jd, fr)
+    e2, r2, v2 = satellite.sgp4_array(jd, fr)
+    dr = r2 - r1
+    distance = np.sqrt(np.einsum("ij,ij->i", dr, dr))
+    dot = np.einsum("ij,ij->i", dr, v2 - v1)
+    valid = (e1 == 0) & (e2 == 0)
+
+    brackets = []
+    start = 0
+    for sample in samples:
+        end = start + len(sample)
+        d, f, ok = distance[start:end], dot[start:end], valid[start:end]
+        reachable = 0.5 * (d[:-1] + d[1:] - speed_bound * np.diff(sample)) <= threshold_km
+        hit = ok[:-1] & ok[1:] & (f[:-1] < 0) & (f[1:] >= 0) & reachable
+        brackets.extend(zip(sample[:-1][hit].tolist(), sample[1:][hit].tolist()))
+        start = end
+    return brackets
+
+
+def find_conjunctions(ephemeris, threshold_km, main_index=0, candidates=None):
+    """
+    Individua gli incontri ravvicinati tra l'oggetto principale e gli altri oggetti.
+
+    La griglia serve solo a localizzare i minimi locali della distanza (cambio di
+    segno del range-rate tra due passi); ogni minimo viene poi raffinato al vero TCA
+    con `refine_tca`. Un intervallo viene raffinato solo se il limite inferiore della
+    distanza raggiungibile al suo interno, stimato con la velocita' relativa agli
+    estremi, e' sotto la soglia.
+
+    Un passo lungo rispetto al periodo orbitale puo' contenere piu' minimi, o un
+    minimo senza cambio di segno netto: gli intervalli piu' lunghi di 1 /
+    TCA_BRACKET_STEPS_PER_PERIOD del periodo piu' breve della coppia, se la somma
+    delle velocita' al perigeo consente di scendere sotto soglia, vengono
+    ricampionati con SGP4 prima di cercare i cambi di segno.
+
+    Args:
+        ephemeris (dict): Effemeridi prodotte da `from_tle_to_ephemeris`.
+        threshold_km (float): Distanza di miss massima per riportare un evento.
+        main_index (int): Riga dell'oggetto principale negli array delle effemeridi.
+        candidates (array): Righe da confrontare con l'oggetto principale
+            (default: tutte le altre).
+
+    Returns:
+        dict: Array NumPy "sat_index", "time", "distance", "relative_speed",
+        "coord1" e "coord2", un elemento per incontro.
+    """
+    if candidates is None:
+        rows = np.delete(np.arange(len(ephemeris["ids"])), main_index)
+    else:
+        rows = np.asarray(candidates, dtype=np.intp)
+        rows = rows[rows != main_index]
+
+    offsets = ephemeris["offsets"].astype(np.float64)
+    main_positions = ephemeris["positions"][main_index]
+    dr = ephemeris["positions"][rows] - main_positions
+    dv = ephemeris["velocities"][rows] - ephemeris["velocities"][main_index]
+    valid = (ephemeris["errors"][rows] == 0) & (ephemeris["errors"][main_index] == 0)
+
+    distance = np.sqrt(np.einsum("ijk,ijk->ij", dr, dr))
+    dot = np.einsum("ijk,ijk->ij", dr, dv)
+    speed = np.sqrt(np.einsum("ijk,ijk->ij", dv, dv))
+
+    main_satellite = ephemeris["satrecs"][main_index]
+    period, perigee_speed = _orbit_speed_limits([main_satellite] + [ephemeris["satrecs"][row] for row in rows])
+    max_step = np.minimum(period[0], period[1:]) / TCA_BRACKET_STEPS_PER_PERIOD
+    speed_bound = 1.01 * (perigee_speed[0] + perigee_speed[1:])
+
+    # Minimi interni: range-rate da negativo a non negativo tra due passi validi
+    both_valid = valid[:, :-1] & valid[:, 1:]
+    step_seconds = np.diff(offsets)
+    coarse = step_seconds[None, :] > max_step[:, None]
+    bracket = both_valid & ~coarse & (dot[:, :-1] < 0) & (dot[:, 1:] >= 0)
+    lower_bound = 0.5 * (distance[:, :-1] + distance[:, 1:] - np.maximum(speed[:, :-1], speed[:, 1:]) * step_seconds)
+    bracket &= lower_bound <= threshold_km
+
+    # Intervalli troppo lunghi per il periodo: da ricampionare
+    coarse_bound = 0.5 * (distance[:, :-1] + distance[:, 1:] - speed_bound[:, None] * step_seconds)
+    resample = both_valid & coarse & (coarse_bound <= threshold_km)
+
+    # Minimi agli estremi della finestra di propagazione
+    at_start = valid[:, 0] & (dot[:, 0] >= 0) & (distance[:, 0] <= threshold_km)
+    at_end = valid[:, -1] & (dot[:, -1] < 0) & (distance[:, -1] <= threshold_km)
+
+    events = {"sat_index": [], "time": [], "distance": [], "relative_speed": [], "coord1": [], "coord2": []}
+
+    def add_event(sat, time, rel_position, rel_velocity, coord1):
+        miss = float(np.linalg.norm(rel_position))
+        if miss > threshold_km:
+            return
+        events["sat_index"].append(sat)
+        events["time"].append(time)
+        events["distance"].append(miss)
+        events["relative_speed"].append(float(np.linalg.norm(rel_velocity)))
+        events["coord1"].append(coord1)
+        events["coord2"].append(np.add(coord1, rel_position))
+
+    jd0, fr0 = ephemeris["jd"][0], ephemeris["fr"][0]
+    brackets = [(row, offsets[step], offsets[step + 1]) for row, step in zip(*np.nonzero(bracket))]
+    for row in np.flatnonzero(resample.any(axis=1)):
+        intervals = [(offsets[step], offsets[step + 1]) for step in np.flatnonzero(resample[row])]
+        brackets.extend(
+            (row, t_low, t_high) for t_low, t_high in _subsampled_brackets(
+                main_satellite, ephemeris["satrecs"][rows[row]], jd0, fr0, intervals, max_step[row], threshold_km, speed_bound[row]
+            )
+        )
+
+    for row in np.flatnonzero(at_start):
+        add_event(rows[row], offsets[0], dr[row, 0], dv[row, 0], main_positions[0])
+    for row, t_low, t_high in brackets:
+        sat = rows[row]
+        refined = refine_tca(main_satellite, ephemeris["satrecs"][sat], jd0, fr0, t_low, t_high)
+        if refined is None:
+            logger.warning(f"SGP4 error refining TCA for {ephemeris['ids'][sat]} near offset {t_low}")
+            continue
+        tca, rel_position, rel_velocity = refined
+        _, main_position, _ = main_satellite.sgp4(jd0, fr0 + tca / 86400.0)
+        add_event(sat, tca, rel_position, rel_velocity, main_position)
+    for row in np.flatnonzero(at_end):
+        add_event(rows[row], offsets[-1], dr[row, -1], dv[row, -1], main_positions[-1])
+
+    return {
+        "sat_index": np.asarray(events["sat_index"], dtype=np.intp),
+        "time": np.asarray(events["time"], dtype=np.float64),
+        "distance": np.asarray(events["distance"], dtype=np.float64),
+        "relative_speed": np.asarray(events["relative_speed"], dtype=np.float64),
+        "coord1": np.asarray(events["coord1"], dtype=np.float64).reshape(-1, 3),
+        "coord2": np.asarray(events["coord2"], dtype=np.float64).reshape(-1, 3),
+    }
+
+
+def _grid_neighbour_pairs(positions, valid, subjects, radius):
+    """
+    Trova, per un singolo passo temporale, le coppie (soggetto, oggetto) a distanza
+    non superiore a radius usando una griglia spaziale uniforme di lato radius:
+    ogni soggetto viene confrontato solo con gli oggetti delle 27 celle adiacenti.
+
+    Returns:
+        tuple: (subject_rows, object_rows) come array NumPy (vuoti se radius <= 0).
+    """
+    rows = np.flatnonzero(valid)
+    subjects = subjects[valid[subjects]]
+    if len(rows) == 0 or len(subjects) == 0 or not radius > 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+    def cell_key(cells):
+        cells = cells + GRID_KEY_OFFSET
+        return (cells[:, 0] * GRID_KEY_BASE + cells[:, 1]) * GRID_KEY_BASE + cells[:, 2]
+
+    cells = np.floor(positions[rows] / radius).astype(np.int64)
+    keys = cell_key(cells)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    sorted_rows = rows[order]
+
+    subject_cells = np.floor(positions[subjects] / radius).astype(np.int64)
+    subject_out, object_out = [], []
+    for shift in GRID_NEIGHBOUR_SHIFTS:
+        neighbour_keys = cell_key(subject_cells + shift)
+        low = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+        high = np.searchsorted(sorted_keys, neighbour_keys, side="right")
+        counts = high - low
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        # Espansione vettoriale degli intervalli [low, high) di ogni soggetto
+        starts = np.repeat(low - np.cumsum(counts) + counts, counts)
+        subject_out.append(np.repeat(subjects, counts))
+        object_out.append(sorted_rows[starts + np.arange(total)])
+
+    if not subject_out:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    subject_rows = np.concatenate(subject_out)
+    object_rows = np.concatenate(object_out)
+
+    delta = positions[object_rows] - positions[subject_rows]
+    close = (np.einsum("ij,ij->i", delta, delta) <= radius * radius) & (object_rows != subject_rows)
+    return subject_rows[close], object_rows[close]
+
+
+def _candidate_samples(ephemeris, max_step):
+    """
+    Genera (posizioni, velocita', validi) di tutti gli oggetti su campioni distanti al
+    piu' max_step: i passi delle effemeridi se abbastanza fitti, altrimenti una
+    griglia ricampionata con SGP4 a blocchi di circa un milione di punti.
+
+    Returns:
+        tuple: (passo massimo tra i campioni, generatore dei campioni).
+    """
+    offsets = ephemeris["offsets"].astype(np.float64)
+    step_seconds = float(np.max(np.diff(offsets))) if len(offsets) > 1 else 0.0
+    if step_seconds <= max_step:
+        valid = ephemeris["errors"] == 0
+        samples = (
+            (ephemeris["positions"][:, step], ephemeris["velocities"][:, step], valid[:, step])
+            for step in range(len(offsets))
+        )
+        return step_seconds, samples
+
+    times = np.concatenate([
+        np.linspace(t_low, t_high, int(np.ceil((t_high - t_low) / max_step)) + 1)[:-1]
+        for t_low, t_high in zip(offsets[:-1], offsets[1:])
+    ] + [offsets[-1:]])
+    satrecs = SatrecArray(list(ephemeris["satrecs"]))
+    jd0, fr0 = ephemeris["jd"][0], ephemeris["fr"][0]
+    block = max(1, (1 << 20) // max(1, len(ephemeris["ids"])))
+
+    def resampled():
+        for start in range(0, len(times), block):
+            t = times[start:start + block]
+            errors, positions, velocities = satrecs.sgp4(np.full(len(t), jd0), fr0 + t / 86400.0)
+            for step in range(len(t)):
+                yield positions[:, step], velocities[:, step], errors[:, step] == 0
+
+    return max_step, resampled()
+
+
+def screen_catalog(ephemeris, subject_indices, threshold_km, allowed_pairs=None):
+    """
+    Screening all-vs-all: per ogni campione individua con una griglia spaziale le
+    coppie (soggetto, oggetto) abbastanza vicine da poter avere un incontro entro
+    la soglia, poi raffina ogni coppia candidata con `find_conjunctions`.
+
+    I campioni distano al piu' SCREEN_CANDIDATE_STEP_SECONDS (vedi
+    `_candidate_samples`) e il raggio di ricerca e' threshold_km + v_max * passo:
+    un minimo sotto soglia tra due campioni dista al piu' mezzo passo da uno dei
+    due, con velocita' relativa non superiore a 2 * v_max. Le coppie vengono
+    deduplicate man mano, senza tenere quelle di ogni campione.
+
+    Args:
+        ephemeris (dict): Effemeridi dell'intero insieme soggetti + candidati.
+        subject_indices (array): Righe degli oggetti sottoscritti.
+        threshold_km (float): Distanza di miss massima per riportare un evento.
+        allowed_pairs (dict): Opzionale, {riga soggetto: righe ammesse} per limitare
+            le coppie ai candidati del singolo soggetto.
+
+    Returns:
+        dict: {riga soggetto: eventi di `find_conjunctions`}.
+    """
+    subject_indices = np.asarray(subject_indices, dtype=np.intp)
+    n_objects = len(ephemeris["ids"])
+    allowed_codes = None
+    if allowed_pairs is not None:
+        allowed_codes = np.unique(np.concatenate([
+            np.asarray(rows, dtype=np.int64) + subject * n_objects for subject, rows in allowed_pairs.items()
+        ] or [np.zeros(0, dtype=np.int64)]))
+
+    pair_codes = np.zeros(0, dtype=np.int64)
+    pending, pending_size = [], 0
+
+    def merge(pair_codes, pending):
+        codes = np.unique(np.concatenate(pending))
+        if allowed_codes is not None:
+            codes = codes[np.isin(codes, allowed_codes, assume_unique=True)]
+        return np.union1d(pair_codes, codes)
+
+    sample_step, samples = _candidate_samples(ephemeris, SCREEN_CANDIDATE_STEP_SECONDS)
+    for positions, velocities, valid in samples:
+        speeds = np.sqrt(np.einsum("ij,ij->i", velocities, velocities))
+        max_speed = float(np.nanmax(speeds[valid])) if valid.any() else 0.0
+        radius = threshold_km + max_speed * sample_step
+        subject_rows, object_rows = _grid_neighbour_pairs(positions, valid, subject_indices, radius)
+        if len(subject_rows):
+            pending.append(subject_rows.astype(np.int64) * n_objects + object_rows)
+            pending_size += len(subject_rows)
+        # Unione ammortizzata: si fonde quando i codici in attesa superano quelli gia' unici
+        if pending_size >= max(len(pair_codes), 1 << 16):
+            pair_codes = merge(pair_codes, pending)
+            pending, pending_size = [], 0
+    if pending:
+        pair_codes = merge(pair_codes, pending)
+    logger.info(f"Catalog screening: {len(pair_codes)} candidate pairs for {len(subject_indices)} subjects")
+
+    subjects, objects = np.divmod(pair_codes, n_objects)
+    conjunctions = {}
+    for subject in np.unique(subjects).tolist():
+        conjunctions[subject] = find_conjunctions(
+            ephemeris, threshold_km, main_index=subject, candidates=objects[subjects == subject]
+        )
+    return conjunctions
+
+
+def conjunctions_to_intersections(ephemeris, conjunctions, main_index=0):
+    """
+    Converte gli eventi compatti di `find_conjunctions` nei dict restituiti dall'API,
+    ordinati per satellite e TCA.
+    """
+    ids = ephemeris["ids"]
+    epoch = ephemeris["epoch"]
+    order = np.lexsort((conjunctions["time"], conjunctions["sat_index"]))
+
+    intersections = []
+    for i in order.tolist():
+        tca = conjunctions["time"][i].item()
+        intersections.append({
+            "time": tca,
+            "tca": (epoch + timedelta(seconds=tca)).isoformat() + "Z",
+            "sat1": ids[main_index],
+            "sat2": ids[conjunctions["sat_index"][i]],
+            "coord1": tuple(conjunctions["coord1"][i].tolist()),
+            "coord2": tuple(conjunctions["coord2"][i].tolist()),
+            "distance": conjunctions["distance"][i].item(),
+            "relative_speed": conjunctions["relative_speed"][i].item()
+        })
+    return intersections
+
+
+def calculate_intersections(ephemeris, threshold_km=5000.0, refine=True):
+    """
+    Calcola gli incontri ravvicinati tra il main_object e gli altri satelliti.
+
+    Con refine=True restituisce un evento per incontro al vero TCA; altrimenti
+    restituisce ogni passo della griglia entro la soglia.
+    """
+    main_object_id = "main_object"
+    if main_object_id not in ephemeris["ids"]:
+        logger.warning("Main object has no valid ephemeris, no intersections computed.")
+        return []
+
+    main_index = ephemeris["ids"].index(main_object_id)
+    with stage_timer("screen"):
+        if refine:
+            conjunctions = find_conjunctions(ephemeris, threshold_km, main_index=main_index)
+            intersections = conjunctions_to_intersections(ephemeris, conjunctions, main_index=main_index)
+        else:
+            hits = screen_distances(ephemeris, threshold_km, main_index=main_index)
+            intersections = hits_to_intersections(ephemeris, hits, main_index=main_index)
+
+    logger.info(f"Total Intersections: {len(intersections)}")
+    return intersections
+
+def build_czml_config(data):
+    """
+    Unisce la configurazione "czml" della richiesta con i default. Con "compact"
+    i default diventano quelli di CZML_COMPACT_DEFAULTS: meno campioni, velocita'
+    per l'interpolazione di Hermite lato Cesium e coordinate arrotondate.
+    """
+    requested = data.get("czml") or {}
+    config = dict(CZML_COMPACT_DEFAULTS if requested.get("compact") else DEFAULT_CZML)
+    config.update(requested)
+    config["sample_stride"] = max(1, int(config["sample_stride"]))
+    return config
+
+
+def _czml_interval(epoch, start_seconds, end_seconds):
+    start = epoch + timedelta(seconds=start_seconds)
+    end = epoch + timedelta(seconds=end_seconds)
+    return f"{start.isoformat()}Z/{end.isoformat()}Z"
+
+
+def iter_czml_packets(ephemeris, intersections=None, config=None):
+    """
+    Genera i pacchetti CZML uno alla volta: prima il documento con il clock, poi un
+    pacchetto per satellite costruito direttamente dagli array delle effemeridi,
+    senza tenere in memoria l'intero documento.
+
+    Args:
+        ephemeris (dict): Effemeridi prodotte da `from_tle_to_ephemeris`.
+        intersections (list): Opzionale, incontri calcolati sulle stesse effemeridi.
+        config (dict): Opzioni di output, vedi `build_czml_config`. Il clock e la
+            disponibilita' coprono la finestra realmente propagata.
+    """
+    config = config or DEFAULT_CZML
+    epoch = ephemeris["epoch"]
+    offsets = ephemeris["offsets"].astype(np.float64)
+    interval = _czml_interval(epoch, 0.0, offsets[-1] if len(offsets) else 0.0)
+    yield {
+        "id": "document",
+        "name": "Satellite Orbits",
+        "version": "1.0",
+        "clock": {
+            "interval": interval,
+            "currentTime": epoch.isoformat() + "Z",
+            "multiplier": 1,
+            "range": "CLAMPED"
+        }
+    }
+
+    stride = config["sample_stride"]
+    hermite = (config["interpolation"] or "").upper() == "HERMITE"
+    for idx, satellite_id in enumerate(ephemeris["ids"], start=1):
+        valid = np.flatnonzero(ephemeris["errors"][idx - 1] == 0)
+        if len(valid) < 2:
+            logger.warning(f"Satellite {satellite_id} has insufficient data: {len(valid)} valid positions")
+            continue
+
+        # Un campione ogni `stride` passi validi, mantenendo sempre l'ultimo
+        steps = valid[::stride]
+        if steps[-1] != valid[-1]:
+            steps = np.append(steps, valid[-1])
+
+        # [t, x, y, z, ...] oppure, per Hermite, [t, x, y, z, vx, vy, vz, ...]
+        columns = [offsets[steps], ephemeris["positions"][idx - 1][steps]]
+        if hermite:
+            columns.append(ephemeris["velocities"][idx - 1][steps])
+        samples = np.column_stack(columns)
+        if config["precision"] is not None:
+            samples = np.round(samples, int(config["precision"]))
+
+        position = {"epoch": epoch.isoformat() + "Z"}
+        if config["interpolation"]:
+            position["interpolationAlgorithm"] = config["interpolation"].upper()
+            position["interpolationDegree"] = int(config["interpolation_degree"])
+        position["cartesianVelocity" if hermite else "cartesian"] = samples.ravel().tolist()
+
+        yield {
+            "id": f"line{idx}",
+            "name": f"Satellite {satellite_id}",
+            "availability": _czml_interval(epoch, offsets[valid[0]], offsets[valid[-1]]),
+            "path": {
+                "material": {"solidColor": {"color": {"rgba": [255, 0, 0, 255]}}},
+                "width": 5
+            },
+            "position": position
+        }
+
+    if intersections:
+        logger.info(f"{len(intersections)} intersections available for the CZML document")
+
+
+def create_czml(ephemeris, intersections=None, config=None):
+    """
+    Restituisce l'intero documento CZML come lista di pacchetti.
+    """
+    return list(iter_czml_packets(ephemeris, intersections, config))
+
+
+def stream_czml(packets, compress=False):
+    """
+    Serializza i pacchetti CZML come array JSON con un pacchetto per riga, cosi' il
+    client puo' processarli man mano che arrivano. Con compress=True l'output e'
+    gzip, svuotato ogni CZML_GZIP_FLUSH_PACKETS pacchetti per non trattenere i dati
+    nel compressore.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def encode(text, flush=False):
+        data = text.encode("utf-8")
+        if compressor is None:
+            return data
+        data = compressor.compress(data)
+        if flush:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    count = 0
+    yield encode("[\n")
+    for packet in packets:
+        separator = ",\n" if count else ""
+        count += 1
+        chunk = encode(separator + json.dumps(packet, separators=(",", ":")), flush=count % CZML_GZIP_FLUSH_PACKETS == 0)
+        if chunk:
+            yield chunk
+    yield encode("\n]\n")
+    if compressor is not None:
+        yield compressor.flush()
+    logger.info(f"CZML streamed: {count} packets")
+
+
+def czml_response(packets):
+    """
+    Risposta HTTP chunked con i pacchetti CZML, compressa in gzip se il client lo
+    accetta e il parametro "gzip" non la disabilita.
+    """
+    compress = (
+        "gzip" in request.headers.get("Accept-Encoding", "")
+        and str(request.args.get("gzip", "true")).lower() != "false"
+    )
+    response = Response(stream_czml(packets, compress=compress), mimetype="application/json")
+    if compress:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+MATCH_COLUMNS = ["norad_code", "sat1", "sat2", "time", "distance", "coord1", "coord2"]
+
+
+def _pg_array(values):
+    return "{" + ",".join(repr(float(value)) for value in values) + "}"
+
+
+def prepare_match_rows(intersections):
+    """
+    Converte gli incontri nelle righe di match_actual/match_history, nell'ordine di
+    MATCH_COLUMNS, con le coordinate come letterali double precision[]. Ogni
+    incontro deve indicare il cliente in "norad_code" (KeyError altrimenti).
+    """
+    return [
+        (
+            str(intersect["norad_code"]), intersect["sat1"], intersect["sat2"],
+            float(intersect["time"]), float(intersect["distance"]),
+            _pg_array(intersect["coord1"]), _pg_array(intersect["coord2"]),
+        )
+        for intersect in intersections
+    ]
+
+
+def write_match_actual(conn, intersections, norad_codes):
+    """
+    Sostituisce i record di match_actual dei clienti indicati con i nuovi incontri
+    (DELETE e un unico COPY). Non esegue il commit.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "DELETE FROM match_actual WHERE norad_code = ANY(%s)",
+            ([str(code) for code in norad_codes],)
+        )
+        with stage_timer("write_match_actual"):
+            copy_rows(conn, "match_actual", MATCH_COLUMNS, prepare_match_rows(intersections))
+    finally:
+        cursor.close()
+    count_metric("rows_written", len(intersections), table="match_actual")
+
+
+def write_match_history(conn, intersections):
+    """
+    Aggiunge gli incontri a match_history con un unico COPY. Non esegue il commit.
+    """
+    with stage_timer("write_match_history"):
+        copy_rows(conn, "match_history", MATCH_COLUMNS, prepare_match_rows(intersections))
+    count_metric("rows_written", len(intersections), table="match_history")
+
+
+def update_match_actual(intersections, norad_codes):
+    """
+    Aggiorna la tabella match_actual per i clienti indicati: elimina i loro record
+    e carica i nuovi incontri con un unico COPY, nella stessa transazione. I
+    record degli altri clienti restano invariati.
     """
     conn = get_db_connection()
     if conn is None:
         raise Exception("Database connection failed")
 
     try:
-        cursor = conn.cursor()
-
-        # Elimina tutti i record esistenti
-        cursor.execute("DELETE FROM match_actual")
-
-        # Query per inserire i dati (tutta su una riga)
-        insert_query = "INSERT INTO match_actual (time, sat1, sat2, coord1, coord2, distance) VALUES (%s, %s, %s, %s, %s, %s)"
-
-        # Funzione per normalizzare i valori
-        def normalize_value(value):
-            if isinstance(value, (np.float64, np.float32)):  # Converte NumPy float in float
-                return float(value)
-            elif isinstance(value, (np.int64, np.int32)):  # Converte NumPy int in int
-                return int(value)
-            elif isinstance(value, (list, tuple)):  # Converte liste o tuple in stringhe
-                return str(value)
-            return value  # Restituisce il valore se già compatibile
-
-        # Inserisci i nuovi dati
-        for intersect in intersections:
-            # Normalizza tutti i dati
-            time = normalize_value(intersect["time"])
-            sat1 = normalize_value(intersect["sat1"])
-            sat2 = normalize_value(intersect["sat2"])
-            coord1 = normalize_value(intersect["coord1"])
-            coord2 = normalize_value(intersect["coord2"])
-            distance = normalize_value(intersect["distance"])
-
-            # Debugging: Stampa la query SQL completa per verifica
-            print(cursor.mogrify(insert_query, (time, sat1, sat2, coord1, coord2, distance)))
-
-            # Esegui la query
-            cursor.execute(insert_query, (time, sat1, sat2, coord1, coord2, distance))
-
-        # Conferma le modifiche
+        write_match_actual(conn, intersections, norad_codes)
         conn.commit()
+        logger.info(f"match_actual replaced for {len(norad_codes)} customers: {len(intersections)} rows")
     except Exception as e:
         conn.rollback()
         raise Exception(f"Failed to update match_actual: {str(e)}")
     finally:
-        cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 
 def update_match_history(intersections):
     """
-    Aggiunge nuovi dati alla tabella match_history senza eliminare i record esistenti.
+    Aggiunge nuovi dati alla tabella match_history senza eliminare i record
+    esistenti, con un unico COPY.
     """
     conn = get_db_connection()
     if conn is None:
         raise Exception("Database connection failed")
 
     try:
-        cursor = conn.cursor()
-
-        # Query per inserire i dati (tutta su una riga)
-        insert_query = "INSERT INTO match_history (sat1, sat2, distance, time, coord1, coord2) VALUES (%s, %s, %s, %s, %s, %s)"
-
-        # Funzione per normalizzare i valori
-        def normalize_value(value):
-            if isinstance(value, (np.float64, np.float32)):  # Converte NumPy float in float
-                return float(value)
-            elif isinstance(value, (np.int64, np.int32)):  # Converte NumPy int in int
-                return int(value)
-            elif isinstance(value, (list, tuple)):  # Converte liste o tuple in stringhe
-                return str(value)
-            return value  # Restituisce il valore se già compatibile
-
-        # Inserisci i nuovi dati
-        for intersect in intersections:
-            # Normalizza tutti i dati
-            sat1 = normalize_value(intersect["sat1"])
-            sat2 = normalize_value(intersect["sat2"])
-            distance = normalize_value(intersect["distance"])
-            time = normalize_value(intersect["time"])
-            coord1 = normalize_value(intersect["coord1"])
-            coord2 = normalize_value(intersect["coord2"])
-
-            # Debugging: Stampa la query SQL completa per verifica
-            print(cursor.mogrify(insert_query, (sat1, sat2, distance, time, coord1, coord2)))
-
-            # Esegui la query
-            cursor.execute(insert_query, (sat1, sat2, distance, time, coord1, coord2))
-
-        # Conferma le modifiche
+        write_match_history(conn, intersections)
         conn.commit()
+        logger.info(f"{len(intersections)} rows appended to match_history")
     except Exception as e:
         conn.rollback()
         raise Exception(f"Failed to append to match_history: {str(e)}")
     finally:
-        cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
 
 @app.route("/register_new_norad", methods=["PUT"])
@@ -712,13 +2762,13 @@ def register_new_norad():
         # Commit delle modifiche e chiusura connessione
         conn.commit()
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
         return jsonify({"status": "success", "message": "Record added to norad_list"}), 201
 
     except Exception as e:
         conn.rollback()
-        conn.close()
+        release_db_connection(conn)
         return jsonify({"status": "error", "message": f"Database error: {str(e)}"}), 500
 
 
@@ -762,20 +2812,124 @@ def delete_norad():
         # Commit delle modifiche e chiusura connessione
         conn.commit()
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
         return jsonify({"status": "success", "message": f"Record with norad_code {norad_code} deleted"}), 200
 
     except Exception as e:
         conn.rollback()
-        conn.close()
+        release_db_connection(conn)
         return jsonify({"status": "error", "message": f"Database error: {str(e)}"}), 500
 
+def parse_start_time(value):
+    """
+    Converte lo start_time della richiesta ("%Y-%m-%dT%H:%M:%SZ") in datetime.
+    Solleva ValueError se manca o non e' nel formato atteso.
+    """
+    if not value:
+        raise ValueError("Missing required parameter: start_time")
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+    except ValueError as e:
+        logger.error(f"Invalid start_time format: {value}. Error: {e}")
+        raise ValueError("Invalid start_time format. Expected ISO 8601.")
+
+
+def screen_customer(data, norad_cat_id_to_check, persist=True):
+    """
+    Screening del singolo cliente con i parametri di /calculate_intersections:
+    calcola gli incontri e, con persist=True, aggiorna match_actual e match_history
+    (i job di screening li scrivono insieme al proprio checkpoint).
+
+    Returns:
+        dict: "filter_stats" e "intersections".
+    """
+    start_time = parse_start_time(data.get("start_time"))
+    duration_minutes = data.get("duration_minutes", 120)
+    step_seconds = data.get("step_seconds", 1800)
+    threshold_km = data.get("threshold", 5000.0)
+
+    filters = build_filter_config(
+        data,
+        data.get("min_or_equal_apoapsis_km_value", 100),
+        data.get("min_or_equal_periapsis_km_value", 100),
+        data.get("min_or_equal_inclination_degrees_value", 1),
+    )
+    window = build_screening_window(start_time, duration_minutes)
+    tle_engaged, filter_stats = retrieve_tle_engaged(filters, threshold_km, window, norad_cat_id_to_check)
+    ephemeris = from_tle_to_ephemeris(tle_engaged, start_time, duration_minutes, step_seconds)
+
+    intersections = calculate_intersections(ephemeris, threshold_km, refine=data.get("refine_tca", True))
+    for intersect in intersections:
+        intersect["norad_code"] = norad_cat_id_to_check
+
+    if persist:
+        update_match_actual(intersections, [norad_cat_id_to_check])
+        update_match_history(intersections)
+    return {"filter_stats": filter_stats, "intersections": intersections}
+
+
+def screen_customers(data, norad_codes, persist=True):
+    """
+    Screening di un insieme di clienti in un'unica propagazione del catalogo: ogni
+    cliente viene confrontato con i propri potenziali collider tramite griglia
+    spaziale. Con persist=True aggiorna match_actual (per i soli clienti indicati)
+    e match_history.
+
+    Returns:
+        dict: "customers" (clienti con effemeridi valide), "filter_stats" e "intersections".
+    """
+    start_time = parse_start_time(data.get("start_time"))
+    duration_minutes = data.get("duration_minutes", 120)
+    step_seconds = data.get("step_seconds", 1800)
+    threshold_km = data.get("threshold", 5000.0)
+
+    filters = build_filter_config(
+        data,
+        data.get("min_or_equal_apoapsis_km_value", 100),
+        data.get("min_or_equal_periapsis_km_value", 100),
+        data.get("min_or_equal_inclination_degrees_value", 1),
+    )
+    window = build_screening_window(start_time, duration_minutes)
+    tle_set, candidates, filter_stats = retrieve_tle_for_customers(filters, threshold_km, window, norad_codes)
+    ephemeris = from_tle_to_ephemeris(tle_set, start_time, duration_minutes, step_seconds)
+
+    row_of = {satellite_id: i for i, satellite_id in enumerate(ephemeris["ids"])}
+    allowed_pairs = {
+        row_of[subject_id]: [row_of[object_id] for object_id in object_ids if object_id in row_of]
+        for subject_id, object_ids in candidates.items() if subject_id in row_of
+    }
+    with stage_timer("screen"):
+        conjunctions = screen_catalog(ephemeris, list(allowed_pairs), threshold_km, allowed_pairs=allowed_pairs)
+
+    intersections = []
+    for subject, events in conjunctions.items():
+        for intersect in conjunctions_to_intersections(ephemeris, events, main_index=subject):
+            intersect["norad_code"] = ephemeris["ids"][subject]
+            intersections.append(intersect)
+
+    if persist:
+        update_match_actual(intersections, norad_codes)
+        update_match_history(intersections)
+    return {"customers": len(allowed_pairs), "filter_stats": filter_stats, "intersections": intersections}
+
+
 # ****************************************************************************************
 # Sezione 2: API Endpoint
 # ****************************************************************************************
 
 
+def _parse_query_value(value):
+    """
+    Converte un parametro della query string nel tipo JSON corrispondente
+    (numeri, booleani, oggetti), lasciandolo stringa se non e' JSON valido.
+    """
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
 @app.route("/create_czml", methods=["GET"])
 def create_czml_api():
     # {
@@ -785,7 +2939,8 @@ def create_czml_api():
     #     "min_or_equal_apoapsis_km_value": 100,
     #     "min_or_equal_periapsis_km_value": 100,
     #     "min_or_equal_inclination_degrees_value": 1,
-    #     "threshold": 5000
+    #     "threshold": 5000,
+    #     "czml": {"compact": true, "sample_stride": 10, "precision": 3}
     # }
     try:
 
@@ -793,7 +2948,10 @@ def create_czml_api():
         if conn is None:
             raise Exception("Connessione al database non riuscita.")
     
-        data = request.get_json()
+        # Parametri dal body JSON o, per il viewer, dalla query string
+        data = request.get_json(silent=True) or {
+            key: _parse_query_value(value) for key, value in request.args.items()
+        }
         start_time = data.get("start_time", None)
         duration_minutes = data.get("duration_minutes", 120)
         logger.info(f"duration_minutes: {duration_minutes}")
@@ -820,13 +2978,14 @@ def create_czml_api():
         logger.debug(f"Parameters received - Threshold: {threshold_km}, Start Time: {start_time}")
 
         norad_cat_id_to_check = get_norad_code_from_db(conn, record_id=0)
-
-        tle_engaged = retrieve_tle_engaged(min_or_equal_apoapsis_km_value, min_or_equal_periapsis_km_value, min_or_equal_inclination_degrees_value, norad_cat_id_to_check)
-        tle_positions = from_tle_to_positions(tle_engaged, start_time, duration_minutes, step_seconds)
-        logger.debug(f"Positions Dict for CZML: {tle_positions}")
-        czml_data = create_czml(tle_positions, start_time)
-        logger.info("CZML data generated successfully")
-        return jsonify(czml_data)
+        release_db_connection(conn)
+
+        filters = build_filter_config(data, min_or_equal_apoapsis_km_value, min_or_equal_periapsis_km_value, min_or_equal_inclination_degrees_value)
+        window = build_screening_window(start_time, duration_minutes)
+        tle_engaged, filter_stats = retrieve_tle_engaged(filters, threshold_km, window, norad_cat_id_to_check)
+        ephemeris = from_tle_to_ephemeris(tle_engaged, start_time, duration_minutes, step_seconds)
+        logger.info("CZML ephemeris generated successfully, streaming packets")
+        return czml_response(iter_czml_packets(ephemeris, config=build_czml_config(data)))
     except Exception as e:
         logger.error("Error in /create_czml API: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -841,56 +3000,70 @@ def calculate_intersections_api():
     #     "min_or_equal_periapsis_km_value": 100,
     #     "min_or_equal_inclination_degrees_value": 1,
     #     "threshold": 5000,
-    #     "force_match_for_customers_record_id": 5
+    #     "force_match_for_customers_record_id": 5,
+    #     "refine_tca": true,
+    #     "filters": {
+    #         "tolerance": {"enabled": true},
+    #         "apsis": {"enabled": true, "pad_km": 25},
+    #         "orbit_path": {"enabled": true, "pad_km": 25},
+    #         "time": {"enabled": true, "pad_km": 25, "pad_seconds": 120}
+    #     }
     # }
     """Calcola le intersezioni tra il NORAD principale e altri satelliti."""
-    try:        
+    try:
+        data = request.get_json()
+        try:
+            parse_start_time(data.get("start_time"))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
 
         conn = get_db_connection()
         if conn is None:
             raise Exception("Connessione al database non riuscita.")
-        
-        data = request.get_json()
-        start_time = data.get("start_time", None)
-        duration_minutes = data.get("duration_minutes", 120)
-        step_seconds = data.get("step_seconds", 1800)
-        min_or_equal_apoapsis_km_value = data.get("min_or_equal_apoapsis_km_value", 100)
-        min_or_equal_periapsis_km_value = data.get("min_or_equal_periapsis_km_value", 100)
-        min_or_equal_inclination_degrees_value = data.get("min_or_equal_inclination_degrees_value", 1)
-        threshold_km = data.get("threshold", 5000.0)
-        force_match_for_customers_record_id = data.get("force_match_for_customers_record_id")
-
-        if force_match_for_customers_record_id:
-            customer_id_to_search = force_match_for_customers_record_id
-        else: 
-            customer_id_to_search = 0
-            
-        if not start_time:
-            return jsonify({"status": "error", "message": "Missing required parameter: start_time"}), 400
-        
-        try:
-            start_time = datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%SZ")
-        except ValueError as e:
-            logger.error(f"Invalid start_time format: {start_time}. Error: {e}")
-            return jsonify({"status": "error", "message": "Invalid start_time format. Expected ISO 8601."}), 400
-        
+        customer_id_to_search = data.get("force_match_for_customers_record_id") or 0
         norad_cat_id_to_check = get_norad_code_from_db(conn, record_id=customer_id_to_search)
+        release_db_connection(conn)
+
+        result = screen_customer(data, norad_cat_id_to_check)
+        intersections = result["intersections"]
+        with stage_timer("serialize"):
+            return jsonify({"status": "success", "filter_stats": result["filter_stats"], "intersections_numbers": len(intersections), "intersections": intersections})
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-        tle_engaged = retrieve_tle_engaged(min_or_equal_apoapsis_km_value, min_or_equal_periapsis_km_value, min_or_equal_inclination_degrees_value, norad_cat_id_to_check)
-        tle_positions = from_tle_to_positions(tle_engaged, start_time, duration_minutes, step_seconds)
 
-        intersections = calculate_intersections(tle_positions, threshold_km)
+@app.route("/calculate_intersections_all", methods=["GET"])
+def calculate_intersections_all_api():
+    # {
+    #     "start_time": "2024-11-25T00:00:00Z",
+    #     "duration_minutes": 120,
+    #     "step_seconds": 60,
+    #     "min_or_equal_apoapsis_km_value": 100,
+    #     "min_or_equal_periapsis_km_value": 100,
+    #     "min_or_equal_inclination_degrees_value": 1,
+    #     "threshold": 5000
+    # }
+    """
+    Screening dell'intero norad_list in un'unica propagazione del catalogo: ogni
+    cliente viene confrontato con i propri potenziali collider tramite griglia spaziale.
+    """
+    try:
+        data = request.get_json()
+        try:
+            parse_start_time(data.get("start_time"))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
 
-        # Aggiorna i database solo in produzione
-        #if app.config["ENV"] == "production":
-        
-        update_match_actual(intersections)
-        update_match_history(intersections)
-        
-        # else:
-        #     logger.info("Bypass database update in debug mode")
+        conn = get_db_connection()
+        if conn is None:
+            raise Exception("Connessione al database non riuscita.")
+        norad_codes = get_all_norad_codes_from_db(conn)
+        release_db_connection(conn)
 
-        return jsonify({"status": "success", "intersections_numbers": len(intersections), "intersections": intersections})
+        result = screen_customers(data, norad_codes)
+        intersections = result["intersections"]
+        with stage_timer("serialize"):
+            return jsonify({"status": "success", "customers": result["customers"], "filter_stats": result["filter_stats"], "intersections_numbers": len(intersections), "intersections": intersections})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -900,168 +3073,563 @@ def calculate_intersections_api():
 # ****************************************************************************************
 
 
-def clean_value(value):
-    try:
-        if isinstance(value, str):
-            # Rimuove spazi extra e tenta di convertire
-            return float(value.replace(" ", "").replace("-", "e-"))
-        return float(value)
-    except ValueError:
-        # Restituisce 0.0 come valore di fallback
-        return 0.0
-
-def process_tle_batch(conn, data):
-    batch_data = []
-
-    for tle in data:
-        tle_line1 = tle.get("TLE_LINE1")
-        tle_line2 = tle.get("TLE_LINE2")
-        tle_apoapsis = tle.get("APOAPSIS")
-        tle_periapsis = tle.get("PERIAPSIS")
-        tle_inclination = tle.get("INCLINATION")
-
-        # Salta i TLE incompleti
-        if not tle_line1 or not tle_line2 or not tle_apoapsis or not tle_periapsis or not tle_inclination:
-            logging.warning("Qualche dato del TLE mancante, salto questo TLE.")
-            continue
+def iter_json_array(chunks):
+    """
+    Decodifica in modo incrementale un array JSON di oggetti ricevuto a blocchi di
+    byte, restituendo un oggetto alla volta senza mai tenere in memoria l'intero array.
 
-        try:
-            # Estrai i dati richiesti
-            norad_cat_id = tle_line1[2:7]
-            classification = tle_line1[7:8]
-            launch_year = 1900 + int(tle_line1[9:11]) if int(tle_line1[9:11]) >= 57 else 2000 + int(tle_line1[9:11])
-            launch_number = int(tle_line1[11:14])
-            launch_piece = tle_line1[14:17].strip()
-            epoch_year = 2000 + int(tle_line1[18:20]) if int(tle_line1[18:20]) < 50 else 1900 + int(tle_line1[18:20])
-            epoch_day = clean_value(tle_line1[20:32])
-            first_derivative = clean_value(tle_line1[33:43])
-            second_derivative = clean_value(tle_line1[44:52])
-            bstar = clean_value(tle_line1[53:61])
-            ephemeris_type = int(tle_line1[62:63])
-            element_set = int(tle_line1[64:68])
-            checksum1 = int(tle_line1[68:69])
-
-            inclination = clean_value(tle_line2[8:16])
-            right_ascension = clean_value(tle_line2[17:25])
-            eccentricity = clean_value("0." + tle_line2[26:33])
-            argument_of_perigee = clean_value(tle_line2[34:42])
-            mean_anomaly = clean_value(tle_line2[43:51])
-            mean_motion = clean_value(tle_line2[52:63])
-            revolution_number = int(tle_line2[63:68])
-            checksum2 = int(tle_line2[68:69])
-
-            # Aggiungi i dati al batch
-            batch_data.append((
-                norad_cat_id, classification, launch_year, launch_number,
-                launch_piece, epoch_year, epoch_day, first_derivative, second_derivative,
-                bstar, ephemeris_type, element_set, checksum1, norad_cat_id,
-                inclination, right_ascension, eccentricity, argument_of_perigee,
-                mean_anomaly, mean_motion, revolution_number, checksum2,
-                json.dumps({"tle_line1": tle_line1, "tle_line2": tle_line2}), "{}",
-                tle_apoapsis, tle_periapsis, tle_inclination
-            ))
-        except Exception as e:
-            logging.error(f"Errore durante la preparazione del TLE: {e}")
-            continue
+    Args:
+        chunks (iterable): Blocchi di byte (es. `response.iter_content()`).
+
+    Yields:
+        Gli elementi dell'array, nell'ordine in cui arrivano.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    started = False
+
+    for chunk in chunks:
+        buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+        while True:
+            # Salta spazi e separatori tra gli elementi
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position >= len(buffer):
+                break
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError(f"Expected a JSON array, got: {buffer[position:position + 200]}")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Elemento incompleto: servono altri byte
+                break
+            yield item
+
+    raise ValueError("Truncated JSON array")
+
+
+def iter_batches(items, batch_size):
+    """
+    Raggruppa un iterabile in liste di al piu' batch_size elementi.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+TLE_LIST_COLUMNS = (
+    "codnorad_riga1", "classificazione", "anno", "nrlancio_anno",
+    "pezzo_lancio", "annoepoca_astro", "epoca_astro", "derivata_prima", "derivata_seconda",
+    "termine_trascinamento", "tipo_effemeridi", "nrset", "chksum_riga1", "codnorad_riga2",
+    "inclinazione", "ascensione_retta", "eccentricita", "arg_perigeo", "anomalia_media",
+    "moto_medio", "nr_rivoluzioni", "chksum_riga2", "json", "dt", "extra_info",
+    "apoapsis", "periapsis", "inclination", "gp_id", "creation_date",
+)
+
+
+# Campi di tle_list decodificati dalle linee del TLE, restituiti da `parse_tle_lines`
+TLE_RECORD_DTYPE = np.dtype([
+    ("codnorad_riga1", "i8"), ("classificazione", "U1"), ("anno", "f8"), ("nrlancio_anno", "f8"),
+    ("pezzo_lancio", "U3"), ("annoepoca_astro", "i8"), ("epoca_astro", "f8"), ("derivata_prima", "f8"),
+    ("derivata_seconda", "f8"), ("termine_trascinamento", "f8"), ("tipo_effemeridi", "i8"), ("nrset", "i8"),
+    ("chksum_riga1", "i8"), ("codnorad_riga2", "i8"), ("inclinazione", "f8"), ("ascensione_retta", "f8"),
+    ("eccentricita", "f8"), ("arg_perigeo", "f8"), ("anomalia_media", "f8"), ("moto_medio", "f8"),
+    ("nr_rivoluzioni", "i8"), ("chksum_riga2", "i8"),
+])
+
+TLE_LINE_LENGTH = 69
+
+# Valore della prima cifra dei NORAD Alpha-5 (A=10 ... Z=33, senza I e O)
+_ALPHA5_DIGIT = np.full(256, -1, dtype=np.int64)
+_ALPHA5_DIGIT[48:58] = np.arange(10)
+for _value, _letter in enumerate("ABCDEFGHJKLMNPQRSTUVWXYZ", start=10):
+    _ALPHA5_DIGIT[ord(_letter)] = _value
+
+
+def _tle_block(lines):
+    """
+    Converte una lista di linee TLE in una matrice di byte (69, n), una riga per
+    colonna del formato, completando con spazi le linee corte: ogni campo si
+    decodifica con operazioni su vettori contigui di n elementi.
+    """
+    text = "".join(line.ljust(TLE_LINE_LENGTH)[:TLE_LINE_LENGTH] for line in lines)
+    block = np.frombuffer(text.encode("ascii", "replace"), dtype=np.uint8).reshape(len(lines), TLE_LINE_LENGTH)
+    return np.ascontiguousarray(block.T)
+
+
+def _decode_number(block, start, end):
+    """
+    Decodifica in blocco un campo numerico a larghezza fissa (cifre, punto
+    decimale, segno e spazi) su tutti i TLE: le cifre vengono accumulate come
+    intero e divise una sola volta per la potenza di 10 dei decimali, quindi il
+    risultato coincide con float() sul testo del campo.
+
+    Returns:
+        tuple: (valori float64, maschera dei TLE con il campo valido).
+    """
+    n = block.shape[1]
+    mantissa = np.zeros(n, dtype=np.int64)
+    decimals = np.zeros(n, dtype=np.int64)
+    dots = np.zeros(n, dtype=np.int64)
+    has_digit = np.zeros(n, dtype=bool)
+    negative = np.zeros(n, dtype=bool)
+    valid = np.ones(n, dtype=bool)
+    for column in block[start:end]:
+        is_digit = (column >= 48) & (column <= 57)
+        is_dot = column == 46
+        is_minus = column == 45
+        valid &= is_digit | is_dot | is_minus | (column == 43) | (column == 32)
+        mantissa = np.where(is_digit, mantissa * 10 + column - 48, mantissa)
+        decimals += is_digit & (dots > 0)
+        dots += is_dot
+        has_digit |= is_digit
+        negative |= is_minus
+
+    values = mantissa / 10.0 ** decimals
+    return np.where(negative, -values, values), valid & has_digit & (dots <= 1)
+
+
+def _decode_exponential(block, start):
+    """
+    Decodifica un campo in notazione TLE con punto decimale implicito, " 12345-4"
+    = 0.12345e-4 (derivata seconda e BSTAR), di 8 caratteri da start.
+    """
+    mantissa, mantissa_valid = _decode_number(block, start, start + 6)
+    exponent, exponent_valid = _decode_number(block, start + 6, start + 8)
+    # Divisione o moltiplicazione per una potenza di 10 esatta: arrotondamento corretto
+    shift = 5 - exponent
+    scale = 10.0 ** np.abs(shift)
+    return np.where(shift >= 0, mantissa / scale, mantissa * scale), mantissa_valid & exponent_valid
+
+
+def _tle_checksum_valid(block):
+    """
+    Verifica il checksum modulo 10 (cifre, con '-' che vale 1) nell'ultima colonna.
+    """
+    total = np.zeros(block.shape[1], dtype=np.int64)
+    for column in block[:-1]:
+        total += np.where((column >= 48) & (column <= 57), column - 48, column == 45)
+    return total % 10 == block[-1].astype(np.int64) - 48
+
+
+def parse_tle_lines(lines1, lines2):
+    """
+    Decodifica in blocco i campi a larghezza fissa di un insieme di TLE, lavorando
+    su matrici di byte invece che campo per campo su ogni stringa. Le righe con
+    numero di linea, checksum o campi non validi, o con NORAD diverso tra le due
+    linee, sono segnalate come non valide.
+
+    Args:
+        lines1 (list): Prime linee dei TLE.
+        lines2 (list): Seconde linee dei TLE, nello stesso ordine.
+
+    Returns:
+        tuple: (array strutturato TLE_RECORD_DTYPE, maschera delle righe valide).
+    """
+    records = np.zeros(len(lines1), dtype=TLE_RECORD_DTYPE)
+    if not len(lines1):
+        return records, np.zeros(0, dtype=bool)
+    line1 = _tle_block(lines1)
+    line2 = _tle_block(lines2)
+    valid = (line1[0] == ord("1")) & (line2[0] == ord("2"))
+    valid &= _tle_checksum_valid(line1) & _tle_checksum_valid(line2)
+
+    def number(block, start, end):
+        nonlocal valid
+        values, field_valid = _decode_number(block, start, end)
+        valid &= field_valid
+        return values
+
+    def norad(block):
+        nonlocal valid
+        first = _ALPHA5_DIGIT[block[2]]
+        rest, rest_valid = _decode_number(block, 3, 7)
+        valid &= (first >= 0) & rest_valid
+        return first * 10000 + rest.astype(np.int64)
+
+    # Linea 1
+    records["codnorad_riga1"] = norad(line1)
+    records["classificazione"] = line1[7].view("S1").astype("U1")
+    # Designatore internazionale: facoltativo, NaN se assente
+    launch_year, launch_year_valid = _decode_number(line1, 9, 11)
+    records["anno"] = np.where(launch_year_valid, np.where(launch_year >= 57, 1900, 2000) + launch_year, np.nan)
+    launch_number, launch_number_valid = _decode_number(line1, 11, 14)
+    records["nrlancio_anno"] = np.where(launch_number_valid, launch_number, np.nan)
+    records["pezzo_lancio"] = np.char.strip(np.ascontiguousarray(line1[14:17].T).view("S3").ravel().astype("U3"))
+    # Anni a due cifre con il pivot del formato TLE (1957-2056), come per il designatore
+    epoch_year = number(line1, 18, 20)
+    records["annoepoca_astro"] = np.where(epoch_year < 57, 2000, 1900) + epoch_year.astype(np.int64)
+    records["epoca_astro"] = number(line1, 20, 32)
+    records["derivata_prima"] = number(line1, 33, 43)
+    second_derivative, second_derivative_valid = _decode_exponential(line1, 44)
+    bstar, bstar_valid = _decode_exponential(line1, 53)
+    valid &= second_derivative_valid & bstar_valid
+    records["derivata_seconda"] = second_derivative
+    records["termine_trascinamento"] = bstar
+    records["tipo_effemeridi"] = np.where(line1[62] == ord(" "), 0, line1[62].astype(np.int64) - 48)
+    records["nrset"] = number(line1, 64, 68)
+    records["chksum_riga1"] = line1[68].astype(np.int64) - 48
+
+    # Linea 2
+    records["codnorad_riga2"] = norad(line2)
+    records["inclinazione"] = number(line2, 8, 16)
+    records["ascensione_retta"] = number(line2, 17, 25)
+    records["eccentricita"] = number(line2, 26, 33) / 1e7
+    records["arg_perigeo"] = number(line2, 34, 42)
+    records["anomalia_media"] = number(line2, 43, 51)
+    records["moto_medio"] = number(line2, 52, 63)
+    records["nr_rivoluzioni"] = number(line2, 63, 68)
+    records["chksum_riga2"] = line2[68].astype(np.int64) - 48
+
+    valid &= records["codnorad_riga1"] == records["codnorad_riga2"]
+    return records, valid
+
+
+def copy_rows(conn, table, columns, rows):
+    """
+    Carica le righe nella tabella con un unico COPY FROM STDIN in formato CSV.
+    Non esegue il commit.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(rows)
+    buffer.seek(0)
+
+    cursor = conn.cursor()
+    cursor.copy_expert(
+        sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+            sql.Identifier(table),
+            sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+        ),
+        buffer,
+    )
+    cursor.close()
+
+
+def _nullable(values, cast=float):
+    return [cast(value) if value == value else None for value in values.tolist()]
+
+
+def prepare_tle_batch(data):
+    """
+    Converte un blocco di record GP di Space-Track nelle righe di tle_list,
+    nell'ordine di TLE_LIST_COLUMNS, scartando i TLE incompleti o non leggibili.
+    Le linee vengono decodificate tutte insieme da `parse_tle_lines`.
+    """
+    complete = [
+        tle for tle in data
+        if tle.get("TLE_LINE1") and tle.get("TLE_LINE2")
+        and tle.get("APOAPSIS") and tle.get("PERIAPSIS") and tle.get("INCLINATION")
+    ]
+    if len(complete) < len(data):
+        logging.warning(f"{len(data) - len(complete)} TLE con dati mancanti scartati.")
+
+    with stage_timer("parse_tle"):
+        records, valid = parse_tle_lines(
+            [tle["TLE_LINE1"] for tle in complete], [tle["TLE_LINE2"] for tle in complete]
+        )
+    count_metric("tle_parsed", len(complete))
+    if not valid.all():
+        logging.warning(f"{np.count_nonzero(~valid)} TLE non leggibili o con checksum errato scartati.")
+    complete = [tle for tle, ok in zip(complete, valid.tolist()) if ok]
+    records = records[valid]
+
+    dt = datetime.now()
+    columns = {name: records[name].tolist() for name in TLE_RECORD_DTYPE.names}
+    columns["anno"] = _nullable(records["anno"], int)
+    columns["nrlancio_anno"] = _nullable(records["nrlancio_anno"], int)
+    columns["json"] = [json.dumps({"tle_line1": tle["TLE_LINE1"], "tle_line2": tle["TLE_LINE2"]}) for tle in complete]
+    columns["dt"] = [dt] * len(complete)
+    columns["extra_info"] = ["{}"] * len(complete)
+    columns["apoapsis"] = [tle["APOAPSIS"] for tle in complete]
+    columns["periapsis"] = [tle["PERIAPSIS"] for tle in complete]
+    columns["inclination"] = [tle["INCLINATION"] for tle in complete]
+    columns["gp_id"] = [tle.get("GP_ID") for tle in complete]
+    columns["creation_date"] = [tle.get("CREATION_DATE") for tle in complete]
+
+    return list(zip(*(columns[column] for column in TLE_LIST_COLUMNS)))
+
+
+def process_tle_batch(conn, data, table="tle_list"):
+    """
+    Prepara un blocco di TLE di Space-Track e lo carica nella tabella indicata
+    (tle_list o la sua tabella di staging) con COPY, con un solo commit per blocco.
+
+    Returns:
+        int: Numero di TLE inseriti.
+    """
+    batch_data = prepare_tle_batch(data)
 
     # Inserisci i dati nel database in batch
-    if batch_data:
-        try:
-            cursor = conn.cursor()
-            cursor.executemany("""
-                INSERT INTO tle_list (
-                    codnorad_riga1, classificazione, anno, nrlancio_anno,
-                    pezzo_lancio, annoepoca_astro, epoca_astro, derivata_prima, derivata_seconda,
-                    termine_trascinamento, tipo_effemeridi, nrset, chksum_riga1, codnorad_riga2,
-                    inclinazione, ascensione_retta, eccentricita, arg_perigeo, anomalia_media,
-                    moto_medio, nr_rivoluzioni, chksum_riga2, json, dt, extra_info,
-                    apoapsis, periapsis, inclination
-                ) VALUES (
-                    %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, NOW(), %s,
-                    %s, %s, %s
-                )
-            """, batch_data)
+    if not batch_data:
+        return 0
+    try:
+        with stage_timer("write_tle"):
+            copy_rows(conn, table, TLE_LIST_COLUMNS, batch_data)
             conn.commit()
-            cursor.close()
-            print(f"Inseriti {len(batch_data)} TLE nel database.")
-        except Exception as e:
-            logging.error(f"Errore durante l'inserimento batch: {e}")
-            conn.rollback()
+        count_metric("rows_written", len(batch_data), table="tle_list")
+        logger.info(f"Inseriti {len(batch_data)} TLE nel database.")
+        return len(batch_data)
+    except Exception as e:
+        logging.error(f"Errore durante l'inserimento batch: {e}")
+        conn.rollback()
+        raise
 
-def insert_tle_data(conn, tle_line1, tle_line2, tle_apoapsis, tle_periapsis, tle_inclination):
-    try:
-        # Estrai i dati dai TLE (linea 1 e linea 2)
-        norad_cat_id = tle_line1[2:7]
-        classification = tle_line1[7:8]
-        launch_year = 1900 + int(tle_line1[9:11]) if int(tle_line1[9:11]) >= 57 else 2000 + int(tle_line1[9:11])
-        launch_number = int(tle_line1[11:14])
-        launch_piece = tle_line1[14:17].strip()
-        epoch_year = 2000 + int(tle_line1[18:20]) if int(tle_line1[18:20]) < 50 else 1900 + int(tle_line1[18:20])
-        epoch_day = clean_value(tle_line1[20:32])
-        first_derivative = clean_value(tle_line1[33:43])
-        second_derivative = clean_value(tle_line1[44:52])
-        bstar = clean_value(tle_line1[53:61])
-        ephemeris_type = int(tle_line1[62:63])
-        element_set = int(tle_line1[64:68])
-        checksum1 = int(tle_line1[68:69])
-
-        inclination = clean_value(tle_line2[8:16])
-        right_ascension = clean_value(tle_line2[17:25])
-        eccentricity = clean_value("0." + tle_line2[26:33])
-        argument_of_perigee = clean_value(tle_line2[34:42])
-        mean_anomaly = clean_value(tle_line2[43:51])
-        mean_motion = clean_value(tle_line2[52:63])
-        revolution_number = int(tle_line2[63:68])
-        checksum2 = int(tle_line2[68:69])
-        
-        # Query SQL aggiornata per includere APOAPSIS, PERIAPSIS e INCLINATION
-        query = sql.SQL("""
-            INSERT INTO tle_list (
-                codnorad_riga1, classificazione, anno, nrlancio_anno,
-                pezzo_lancio, annoepoca_astro, epoca_astro, derivata_prima, derivata_seconda,
-                termine_trascinamento, tipo_effemeridi, nrset, chksum_riga1, codnorad_riga2,
-                inclinazione, ascensione_retta, eccentricita, arg_perigeo, anomalia_media,
-                moto_medio, nr_rivoluzioni, chksum_riga2, json, dt, extra_info,
-                apoapsis, periapsis, inclination
-            ) VALUES (
-                %s, %s, %s, %s,
-                %s, %s, %s, %s, %s,
-                %s, %s, %s, %s, %s,
-                %s, %s, %s, %s, %s,
-                %s, %s, %s, %s, NOW(), %s,
-                %s, %s, %s
-            )
-        """)
 
+def upsert_tle_batch(conn, data):
+    """
+    Inserisce o aggiorna, per NORAD id, un blocco di TLE in tle_list: le righe
+    passano da una tabella temporanea caricata con COPY e sostituiscono solo i
+    record con GP_ID piu' vecchio. Non esegue il commit.
+
+    Returns:
+        list: NORAD id effettivamente inseriti o aggiornati.
+    """
+    batch_data = prepare_tle_batch(data)
+    if not batch_data:
+        return []
+
+    columns = sql.SQL(", ").join(sql.Identifier(column) for column in TLE_LIST_COLUMNS)
+    cursor = conn.cursor()
+    cursor.execute(sql.SQL(
+        "CREATE TEMP TABLE IF NOT EXISTS tle_delta ON COMMIT DROP AS SELECT {} FROM tle_list WITH NO DATA"
+    ).format(columns))
+    cursor.execute("TRUNCATE tle_delta")
+    copy_rows(conn, "tle_delta", TLE_LIST_COLUMNS, batch_data)
+
+    cursor.execute(sql.SQL("""
+        INSERT INTO tle_list ({columns})
+        SELECT DISTINCT ON (codnorad_riga1) {columns} FROM tle_delta ORDER BY codnorad_riga1, gp_id DESC
+        ON CONFLICT (codnorad_riga1) DO UPDATE SET {updates}
+        WHERE tle_list.gp_id IS NULL OR EXCLUDED.gp_id > tle_list.gp_id
+        RETURNING codnorad_riga1
+    """).format(
+        columns=columns,
+        updates=sql.SQL(", ").join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(column)) for column in TLE_LIST_COLUMNS
+        ),
+    ))
+    changed = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    count_metric("rows_written", len(changed), table="tle_list")
+    return changed
+
+
+def create_catalog_staging(conn):
+    """
+    Ricrea la tabella di staging del catalogo con la stessa struttura di tle_list.
+    """
+    cursor = conn.cursor()
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(TLE_STAGING_TABLE)))
+    cursor.execute(sql.SQL("CREATE TABLE {} (LIKE tle_list INCLUDING ALL)").format(sql.Identifier(TLE_STAGING_TABLE)))
+    conn.commit()
+    cursor.close()
+
+
+def drop_catalog_staging(conn):
+    cursor = conn.cursor()
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(TLE_STAGING_TABLE)))
+    conn.commit()
+    cursor.close()
+
+
+def swap_catalog(conn, row_count, source):
+    """
+    Pubblica la tabella di staging come nuovo tle_list in un'unica transazione:
+    il tle_list corrente viene rinominato in tle_list_v<versione> e la staging
+    prende il suo posto, poi il puntatore della versione attiva viene aggiornato.
+
+    Returns:
+        int: Nuova versione attiva del catalogo.
+    """
+    try:
         cursor = conn.cursor()
-        cursor.execute(query, (
-            norad_cat_id, classification, launch_year, launch_number,
-            launch_piece, epoch_year, epoch_day, first_derivative, second_derivative,
-            bstar, ephemeris_type, element_set, checksum1, norad_cat_id,
-            inclination, right_ascension, eccentricity, argument_of_perigee,
-            mean_anomaly, mean_motion, revolution_number, checksum2,
-            json.dumps({"tle_line1": tle_line1, "tle_line2": tle_line2}), "{}",
-            tle_apoapsis, tle_periapsis, tle_inclination
-        ))
+        cursor.execute("SELECT version FROM tle_catalog_version WHERE active FOR UPDATE")
+        current = cursor.fetchone()
+        archived_table = f"tle_list_v{current[0] if current else 0}"
+
+        cursor.execute(sql.SQL("ALTER TABLE tle_list RENAME TO {}").format(sql.Identifier(archived_table)))
+        cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO tle_list").format(sql.Identifier(TLE_STAGING_TABLE)))
+        if current:
+            cursor.execute(
+                "UPDATE tle_catalog_version SET active = FALSE, archived_table = %s WHERE version = %s",
+                (archived_table, current[0])
+            )
+        cursor.execute(
+            "INSERT INTO tle_catalog_version (source, row_count, active) VALUES (%s, %s, TRUE) RETURNING version",
+            (source, row_count)
+        )
+        version = cursor.fetchone()[0]
         conn.commit()
-        print(f"TLE {norad_cat_id} inserito correttamente.")
         cursor.close()
-    except Exception as e:
-        print(f"Errore durante l'inserimento del TLE: {e}")
+
+        logger.info(f"Catalog version {version} active, previous catalog archived as {archived_table}")
+        return version
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def purge_archived_catalogs(conn, retention):
+    """
+    Elimina le tabelle di catalogo archiviate oltre le ultime `retention` versioni.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT version, archived_table FROM tle_catalog_version WHERE archived_table IS NOT NULL ORDER BY version DESC OFFSET %s",
+        (retention,)
+    )
+    for version, archived_table in cursor.fetchall():
+        cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(archived_table)))
+        cursor.execute("UPDATE tle_catalog_version SET archived_table = NULL WHERE version = %s", (version,))
+        logger.info(f"Dropped archived catalog {archived_table}")
+    conn.commit()
+    cursor.close()
+
+
+def publish_catalog_delta(conn, changed_norad):
+    """
+    Registra una nuova versione attiva del catalogo per un aggiornamento
+    incrementale, con l'elenco dei NORAD modificati. Non esegue il commit.
+
+    Returns:
+        int: Nuova versione attiva del catalogo.
+    """
+    cursor = conn.cursor()
+    cursor.execute("UPDATE tle_catalog_version SET active = FALSE WHERE active")
+    cursor.execute(
+        "INSERT INTO tle_catalog_version (source, row_count, changed_norad, active) VALUES ('delta', %s, %s, TRUE) RETURNING version",
+        (len(changed_norad), changed_norad)
+    )
+    version = cursor.fetchone()[0]
+    cursor.close()
+    return version
+
+
+def get_catalog_high_water_mark(conn):
+    """
+    Restituisce il GP_ID piu' alto presente in tle_list (0 se nessuno).
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(gp_id), 0) FROM tle_list")
+    high_water_mark = cursor.fetchone()[0]
+    cursor.close()
+    return high_water_mark
+
+
+def ingest_full_catalog(conn, records):
+    """
+    Carica un catalogo completo nella tabella di staging e lo pubblica con `swap_catalog`.
+    I record (anche un iteratore in streaming) vengono caricati a blocchi di
+    TLE_INGEST_BATCH_SIZE, quindi la memoria usata non dipende dalla dimensione del catalogo.
+    """
+    try:
+        create_catalog_staging(conn)
+        received = 0
+        inserted = 0
+        for batch in iter_batches(records, TLE_INGEST_BATCH_SIZE):
+            received += len(batch)
+            inserted += process_tle_batch(conn, batch, table=TLE_STAGING_TABLE)
+        logger.info(f"{inserted} TLE inseriti su {received} ricevuti")
+
+        if inserted == 0:
+            raise ValueError("Nessun TLE valido ricevuto, catalogo invariato")
+
+        # Pubblica atomicamente il nuovo catalogo e applica la retention
+        version = swap_catalog(conn, inserted, source="full")
+        purge_archived_catalogs(conn, TLE_CATALOG_RETENTION)
+        return {"inserted": inserted, "catalog_version": version}
+    except Exception:
+        conn.rollback()
+        drop_catalog_staging(conn)
+        raise
+
+
+def remove_stale_tles(conn, decayed_norad, max_age_days):
+    """
+    Elimina da tle_list gli oggetti il cui nuovo GP riporta un DECAY_DATE e quelli
+    con epoca piu' vecchia di max_age_days, cioe' gli stessi esclusi dal
+    caricamento completo. Non esegue il commit.
+
+    Returns:
+        list: NORAD id eliminati.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        DELETE FROM tle_list
+        WHERE codnorad_riga1 = ANY(%s)
+           OR make_date(annoepoca_astro, 1, 1) + (epoca_astro - 1) * INTERVAL '1 day'
+              < NOW() - make_interval(days => %s)
+        RETURNING codnorad_riga1
+        """,
+        (decayed_norad, max_age_days)
+    )
+    removed = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return removed
+
+
+def ingest_catalog_delta(conn, records):
+    """
+    Applica un aggiornamento incrementale a tle_list in un'unica transazione e, se
+    qualche oggetto e' cambiato, pubblica una versione delta del catalogo. Gli
+    oggetti rientrati o con epoca oltre SPACETRACK_MAX_EPOCH_AGE_DAYS vengono
+    eliminati, cosi' che il catalogo coincida con quello di un caricamento completo.
+    """
+    try:
+        received = 0
+        changed = set()
+        decayed = set()
+        for batch in iter_batches(records, TLE_INGEST_BATCH_SIZE):
+            received += len(batch)
+            decayed.update(int(record["NORAD_CAT_ID"]) for record in batch if record.get("DECAY_DATE"))
+            changed.update(upsert_tle_batch(conn, [record for record in batch if not record.get("DECAY_DATE")]))
+        removed = remove_stale_tles(conn, sorted(decayed), SPACETRACK_MAX_EPOCH_AGE_DAYS)
+        logger.info(f"{len(changed)} TLE aggiornati e {len(removed)} eliminati su {received} ricevuti")
+
+        changed.update(removed)
+        version = publish_catalog_delta(conn, sorted(changed)) if changed else None
+        conn.commit()
+        return {"inserted": len(changed) - len(removed), "removed": len(removed), "catalog_version": version}
+    except Exception:
         conn.rollback()
+        raise
+
 
 @app.route("/from_spacetrack_to_our_db")
 def from_spacetrack_to_our_db():
     # {
-    #     "limit_number_or_null": null
+    #     "limit_number_or_null": null,
+    #     "mode": "full"
     # }
+    # mode: "full" ricarica l'intero catalogo, "delta" scarica solo gli element set
+    # con GP_ID successivo all'ultimo presente in tle_list ed elimina gli oggetti
+    # rientrati o con epoca oltre SPACETRACK_MAX_EPOCH_AGE_DAYS
 
     data = request.get_json()
     limit_number_or_null = data.get("limit_number_or_null", None)
+    mode = data.get("mode", "full")
+
+    if mode not in ("full", "delta"):
+        return {
+            "status": "error",
+            "message": f"Modalita' non valida: {mode}"
+        }
 
     if limit_number_or_null == None:
         limit_number_or_null = ""
@@ -1070,7 +3638,7 @@ def from_spacetrack_to_our_db():
 
     BASE_URL = "https://www.space-track.org"
     SESSION = requests.Session()
-    query = f"/basicspacedata/query/class/gp/decay_date/null-val/epoch/>now-30/orderby/norad_cat_id/format/json/object_type/debris{limit_number_or_null}"
+    query = f"/basicspacedata/query/class/gp/decay_date/null-val/epoch/>now-{SPACETRACK_MAX_EPOCH_AGE_DAYS}/orderby/norad_cat_id/format/json/object_type/debris{limit_number_or_null}"
 
     def login(email, password):
         """Effettua il login a SpaceTrack."""
@@ -1081,36 +3649,32 @@ def from_spacetrack_to_our_db():
         }
         response = SESSION.post(login_url, data=payload)
         if response.status_code == 200:
-            print("Login effettuato con successo.")
+            logger.info("Login effettuato con successo.")
         else:
-            print("Errore durante il login.")
+            logger.error("Errore durante il login.")
             response.raise_for_status()
 
     def get_data(query):
-        """Estrae dati dalla query fornita."""
+        """Estrae i dati dalla query fornita come flusso di record, senza caricare l'intera risposta."""
         request_url = f"{BASE_URL}{query}"
-        response = SESSION.get(request_url)
-        if response.status_code == 200:
-            print("Dati estratti con successo.")
-            return response.json()  
-        else:
-            print("Errore durante l'estrazione dei dati.")
-            response.raise_for_status()
+        with SESSION.get(request_url, stream=True) as response:
+            if response.status_code != 200:
+                logger.error("Errore durante l'estrazione dei dati.")
+                response.raise_for_status()
+            logger.info("Estrazione dei dati in streaming.")
+            yield from iter_json_array(response.iter_content(chunk_size=SPACETRACK_STREAM_CHUNK_BYTES))
 
     def logout():
         """Effettua il logout da SpaceTrack."""
         logout_url = f"{BASE_URL}/ajaxauth/logout"
         response = SESSION.get(logout_url)
         if response.status_code == 200:
-            print("Logout effettuato.")
+            logger.info("Logout effettuato.")
         else:
-            print("Errore durante il logout.")
+            logger.error("Errore durante il logout.")
             response.raise_for_status()
         
     try:
-        login(USR_SPACETRACK, SCRT_SPACETRACK)
-        data = get_data(query)
-
         # Connessione al database
         conn = get_db_connection()
         if conn is None:
@@ -1118,34 +3682,47 @@ def from_spacetrack_to_our_db():
                 "status": "error",
                 "message": "Connessione al database fallita"
             }
-        
-        # Elimina tutti i record esistenti
+
+        # Un solo aggiornamento del catalogo alla volta
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM tle_list")
-        conn.commit()
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (CATALOG_LOCK_KEY,))
+        locked = cursor.fetchone()[0]
         cursor.close()
+        if not locked:
+            release_db_connection(conn)
+            return {
+                "status": "error",
+                "message": "Aggiornamento del catalogo gia' in corso"
+            }
 
-        # Itera sui dati ricevuti dall'API
-        for tle in data:
-            tle_line1 = tle.get("TLE_LINE1")
-            tle_line2 = tle.get("TLE_LINE2")
-            tle_apoapsis = tle.get("APOAPSIS")
-            tle_periapsis = tle.get("PERIAPSIS")
-            tle_inclination = tle.get("INCLINATION")
-
-            # Verifica che entrambe le linee siano presenti
-            if not tle_line1 or not tle_line2 or not tle_apoapsis or not tle_periapsis or not tle_inclination:
-                logging.warning("Qualche dato del TLE mancante, salto questo TLE.")
-                continue
-
-            # Inserisci i dati nel database
-            insert_tle_data(conn, tle_line1, tle_line2, tle_apoapsis, tle_periapsis, tle_inclination)
+        try:
+            if mode == "delta":
+                high_water_mark = get_catalog_high_water_mark(conn)
+                if high_water_mark == 0:
+                    logger.info("No GP_ID stored in tle_list, falling back to a full sync")
+                    mode = "full"
+                else:
+                    # Senza filtro su decay_date: i GP con DECAY_DATE eliminano l'oggetto
+                    query = f"/basicspacedata/query/class/gp/GP_ID/>{high_water_mark}/object_type/debris/orderby/GP_ID/format/json{limit_number_or_null}"
+
+            login(USR_SPACETRACK, SCRT_SPACETRACK)
+            records = get_data(query)
+
+            if mode == "delta":
+                result = ingest_catalog_delta(conn, records)
+            else:
+                result = ingest_full_catalog(conn, records)
+        finally:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (CATALOG_LOCK_KEY,))
+            cursor.close()
+            release_db_connection(conn)
 
-        # Chiudi la connessione al database
-        conn.close()
         return {
             "status": "success",
-            "message": "Dati inseriti correttamente nel database."
+            "message": "Dati inseriti correttamente nel database.",
+            "mode": mode,
+            **result
         }
     except Exception as e:
         logging.error(f"Errore durante l'inserimento dei dati nel database: {e}")
@@ -1199,6 +3776,628 @@ def get_norad_code_from_db(conn, record_id):
         raise Exception(f"Errore inatteso durante il recupero del NORAD_CAT_ID: {e}")
 
 
+def get_all_norad_codes_from_db(conn):
+    """
+    Recupera tutti i 'norad_code' distinti dalla tabella 'norad_list'.
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT norad_code FROM norad_list ORDER BY norad_code")
+        norad_codes = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+
+        logger.info(f"Retrieved {len(norad_codes)} 'norad_code' from norad_list")
+        return norad_codes
+    except psycopg2.Error as db_error:
+        logger.error("Database error while retrieving 'norad_code' list: %s", db_error)
+        raise Exception(f"Errore durante il recupero dei NORAD_CAT_ID: {db_error}")
+
+
+# ****************************************************************************************
+# Sezione 4: Storico match
+# ****************************************************************************************
+
+
+def encode_page_cursor(values):
+    """
+    Codifica i valori della chiave dell'ultima riga di una pagina in un cursore opaco.
+    """
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_page_cursor(token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid page cursor")
+
+
+def fetch_page(conn, table, columns, conditions, params, key_columns, limit, after=None):
+    """
+    Legge una pagina di righe con paginazione keyset, in ordine decrescente sulle
+    colonne chiave: ogni pagina riparte dalla chiave dell'ultima riga della
+    precedente, quindi il costo non cresce con la profondita' della pagina.
+
+    Args:
+        conn: Connessione al database.
+        table (str): Tabella da leggere.
+        columns (list): Colonne restituite (devono includere key_columns).
+        conditions (list): Condizioni SQL (sql.Composable) con segnaposto %s.
+        params (list): Valori dei segnaposto di conditions.
+        key_columns (list): Colonne della chiave di ordinamento, univoca.
+        limit (int): Righe per pagina.
+        after (str): Cursore restituito dalla pagina precedente.
+
+    Returns:
+        dict: "items" (righe come dict) e "next_cursor" (None all'ultima pagina).
+    """
+    conditions = list(conditions)
+    params = list(params)
+    if after:
+        key = decode_page_cursor(after)
+        if len(key) != len(key_columns):
+            raise ValueError("Invalid page cursor")
+        conditions.append(sql.SQL("({}) < ({})").format(
+            sql.SQL(", ").join(sql.Identifier(column) for column in key_columns),
+            sql.SQL(", ").join(sql.Placeholder() for _ in key_columns),
+        ))
+        params.extend(key)
+
+    query = sql.SQL("SELECT {} FROM {} {} ORDER BY {} LIMIT %s").format(
+        sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+        sql.Identifier(table),
+        sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL(""),
+        sql.SQL(", ").join(sql.SQL("{} DESC").format(sql.Identifier(column)) for column in key_columns),
+    )
+    cursor = conn.cursor()
+    cursor.execute(query, params + [limit + 1])
+    rows = cursor.fetchall()
+    cursor.close()
+
+    items = [dict(zip(columns, row)) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_page_cursor([items[-1][column] for column in key_columns])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def _history_conditions(args, time_column, distance_column):
+    """
+    Traduce i filtri della query string (norad_code, sat2, since, until,
+    max_distance) in condizioni SQL e parametri.
+    """
+    conditions, params = [], []
+    for name, column, operator in (
+        ("norad_code", "norad_code", "="),
+        ("sat2", "sat2", "="),
+        ("since", time_column, ">="),
+        ("until", time_column, "<"),
+        ("max_distance", distance_column, "<="),
+    ):
+        value = args.get(name)
+        if value is None:
+            continue
+        if name == "max_distance":
+            value = float(value)
+        elif name in ("since", "until"):
+            value = datetime.fromisoformat(value.rstrip("Z"))
+        conditions.append(sql.SQL("{} " + operator + " %s").format(sql.Identifier(column)))
+        params.append(value)
+    return conditions, params
+
+
+def _page_limit(args):
+    limit = int(args.get("limit", HISTORY_PAGE_SIZE))
+    return max(1, min(limit, HISTORY_PAGE_MAX))
+
+
+def maintain_match_history(conn):
+    """
+    Crea le partizioni mensili future di match_history e applica la retention:
+    le righe piu' vecchie di MATCH_HISTORY_RETENTION_DAYS (arrotondate al mese)
+    vengono riassunte in match_history_rollup ed eliminate.
+
+    Returns:
+        int: Numero di incontri riassunti.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT match_history_create_partitions(%s)", (MATCH_HISTORY_PARTITIONS_AHEAD,))
+        cursor.execute(
+            "SELECT match_history_apply_retention(make_interval(days => %s))",
+            (MATCH_HISTORY_RETENTION_DAYS,)
+        )
+        rolled = cursor.fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    logger.info(f"match_history maintenance: {rolled} encounters rolled up")
+    return rolled
+
+
+@app.route("/match_history", methods=["GET"])
+def get_match_history():
+    """
+    Pagina di match_history, dalla piu' recente, filtrabile per norad_code, sat2,
+    intervallo di created_at (since/until) e max_distance.
+    """
+    try:
+        conditions, params = _history_conditions(request.args, "created_at", "distance")
+        limit = _page_limit(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    conn = get_db_connection()
+    if conn is None:
+        raise Exception("Database connection failed")
+
+    try:
+        page = fetch_page(
+            conn, "match_history",
+            ["id", "norad_code", "sat1", "sat2", "time", "distance", "coord1", "coord2", "created_at"],
+            conditions, params, ["created_at", "id"], limit, request.args.get("after")
+        )
+        return jsonify(page), 200
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        conn.rollback()
+        raise Exception(f"Failed to get match_history: {str(e)}")
+    finally:
+        release_db_connection(conn)
+
+
+@app.route("/match_history/rollups", methods=["GET"])
+def get_match_history_rollups():
+    """
+    Pagina dei riepiloghi per incontro di match_history_rollup, con gli stessi
+    filtri di /match_history applicati a encounter_day e min_distance.
+    """
+    try:
+        conditions, params = _history_conditions(request.args, "encounter_day", "min_distance")
+        limit = _page_limit(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    conn = get_db_connection()
+    if conn is None:
+        raise Exception("Database connection failed")
+
+    try:
+        page = fetch_page(
+            conn, "match_history_rollup",
+            ["norad_code", "sat1", "sat2", "encounter_day", "hits", "min_distance",
+             "time_at_min_distance", "coord1", "coord2", "first_seen", "last_seen"],
+            conditions, params, ["encounter_day", "norad_code", "sat1", "sat2"], limit, request.args.get("after")
+        )
+        return jsonify(page), 200
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        conn.rollback()
+        raise Exception(f"Failed to get match_history_rollup: {str(e)}")
+    finally:
+        release_db_connection(conn)
+
+
+@app.route("/maintain_match_history", methods=["GET", "POST"])
+def maintain_match_history_api():
+    """
+    Manutenzione periodica dello storico (partizioni e retention), richiamata dal
+    cron di Vercel.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"status": "error", "message": "Database connection failed"}), 500
+
+    try:
+        rolled = maintain_match_history(conn)
+        return jsonify({"status": "success", "rolled_up": rolled}), 200
+    except Exception as e:
+        logger.error(f"Error in match_history maintenance: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    finally:
+        release_db_connection(conn)
+
+
+# ****************************************************************************************
+# Sezione 4: Job di screening
+# ****************************************************************************************
+
+
+def submit_screening_job(conn, kind, params):
+    """
+    Accoda un job di screening ("customer" per /calculate_intersections, "all" per
+    /calculate_intersections_all) e ne restituisce l'id.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO screening_jobs (kind, params) VALUES (%s, %s) RETURNING id",
+        (kind, json.dumps(params))
+    )
+    job_id = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    return job_id
+
+
+def claim_screening_job(conn, worker_id):
+    """
+    Prende in carico il job accodato piu' vecchio, oppure uno in esecuzione il cui
+    worker non aggiorna l'heartbeat da JOB_STALE_SECONDS, incrementandone i
+    tentativi (azzerati quando un job va in pausa). FOR UPDATE SKIP LOCKED
+    permette a piu' worker di prelevare job diversi senza attese. I job in
+    esecuzione con heartbeat scaduto che hanno esaurito i JOB_MAX_ATTEMPTS
+    tentativi vengono prima marcati "failed", altrimenti resterebbero "running"
+    per sempre.
+
+    Returns:
+        tuple: (id, kind, params, checkpoint) oppure None se non ci sono job.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        UPDATE screening_jobs
+        SET status = 'failed', finished_at = NOW(),
+            error = format('Worker %%s stopped responding on attempt %%s/%%s', worker, attempts, %s::int)
+        WHERE status = 'running' AND attempts >= %s
+          AND heartbeat_at < NOW() - make_interval(secs => %s)
+        """,
+        (JOB_MAX_ATTEMPTS, JOB_MAX_ATTEMPTS, JOB_STALE_SECONDS)
+    )
+    if cursor.rowcount:
+        logger.warning(f"{cursor.rowcount} stale screening jobs marked failed after {JOB_MAX_ATTEMPTS} attempts")
+    cursor.execute(
+        """
+        UPDATE screening_jobs
+        SET status = 'running', worker = %s, attempts = attempts + 1,
+            started_at = COALESCE(started_at, NOW()), heartbeat_at = NOW()
+        WHERE id = (
+            SELECT id FROM screening_jobs
+            WHERE attempts < %s AND (
+                status = 'queued'
+                OR (status = 'running' AND heartbeat_at < NOW() - make_interval(secs => %s))
+            )
+            ORDER BY created_at
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING id, kind, params, checkpoint
+        """,
+        (worker_id, JOB_MAX_ATTEMPTS, JOB_STALE_SECONDS)
+    )
+    job = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    return job
+
+
+def update_screening_job(conn, job_id, worker_id, **fields):
+    """
+    Aggiorna i campi indicati del job (status, progress, stage, checkpoint, error)
+    e l'heartbeat; i dict vengono salvati come JSON. L'aggiornamento ha effetto
+    solo se il job e' ancora assegnato a worker_id.
+
+    Returns:
+        bool: False se il job e' stato ripreso da un altro worker.
+    """
+    assignments = [sql.SQL("heartbeat_at = NOW()")]
+    params = []
+    for column, value in fields.items():
+        assignments.append(sql.SQL("{} = %s").format(sql.Identifier(column)))
+        params.append(json.dumps(value) if isinstance(value, dict) else value)
+    if fields.get("status") in ("done", "failed"):
+        assignments.append(sql.SQL("finished_at = NOW()"))
+
+    cursor = conn.cursor()
+    cursor.execute(
+        sql.SQL("UPDATE screening_jobs SET {} WHERE id = %s AND worker = %s").format(sql.SQL(", ").join(assignments)),
+        params + [job_id, worker_id]
+    )
+    owned = cursor.rowcount > 0
+    conn.commit()
+    cursor.close()
+    return owned
+
+
+def save_job_batch(conn, job_id, worker_id, batch, result, norad_codes, checkpoint, progress, stage):
+    """
+    Salva nella stessa transazione il checkpoint aggiornato, il risultato del
+    blocco e i suoi incontri in match_actual e match_history: un job ripreso non
+    rielabora i blocchi gia' salvati e un blocco interrotto non lascia righe di
+    storico che verrebbero duplicate alla ripresa. Se nel frattempo il job e'
+    stato ripreso da un altro worker non scrive nulla.
+
+    Returns:
+        bool: False se il job non e' piu' assegnato a worker_id.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "UPDATE screening_jobs SET checkpoint = %s, progress = %s, stage = %s, heartbeat_at = NOW() "
+            "WHERE id = %s AND worker = %s",
+            (json.dumps(checkpoint), progress, stage, job_id, worker_id)
+        )
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return False
+        cursor.execute(
+            "INSERT INTO screening_job_results (job_id, batch, payload) VALUES (%s, %s, %s) "
+            "ON CONFLICT (job_id, batch) DO UPDATE SET payload = EXCLUDED.payload",
+            (job_id, batch, json.dumps(result, default=_json_default))
+        )
+        write_match_actual(conn, result["intersections"], norad_codes)
+        write_match_history(conn, result["intersections"])
+        conn.commit()
+        return True
+    finally:
+        cursor.close()
+
+
+@contextmanager
+def job_heartbeat(conn, job_id, worker_id):
+    """
+    Aggiorna l'heartbeat del job ogni JOB_HEARTBEAT_SECONDS mentre un blocco e' in
+    elaborazione, cosi' che un blocco piu' lungo di JOB_STALE_SECONDS non venga
+    ripreso da un altro worker. Usa la connessione del job, inutilizzata durante
+    lo screening.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                if not update_screening_job(conn, job_id, worker_id):
+                    logger.warning(f"Screening job {job_id} was reclaimed by another worker")
+                    return
+            except Exception as e:
+                logger.warning(f"Screening job {job_id} heartbeat failed: {e}")
+                conn.rollback()
+
+    thread = threading.Thread(target=beat, name=f"screening-job-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _job_batches(conn, kind, params, checkpoint):
+    """
+    Restituisce il checkpoint del job, creandolo alla prima esecuzione con la
+    lista dei clienti da elaborare, fissata per tutta la durata del job.
+    """
+    if checkpoint:
+        return checkpoint
+    if kind == "all":
+        norad_codes = get_all_norad_codes_from_db(conn)
+    else:
+        customer_id_to_search = params.get("force_match_for_customers_record_id") or 0
+        norad_codes = [get_norad_code_from_db(conn, record_id=customer_id_to_search)]
+    batch_size = max(1, int(params.get("batch_customers", JOB_BATCH_CUSTOMERS)))
+    batches = [norad_codes[i:i + batch_size] for i in range(0, len(norad_codes), batch_size)]
+    return {"batches": batches, "done": 0}
+
+
+def run_screening_job(job, deadline, worker_id):
+    """
+    Elabora i blocchi di clienti rimanenti del job, salvando un checkpoint dopo
+    ognuno. Se il tempo a disposizione finisce il job torna in coda, con i
+    tentativi azzerati, e il prossimo worker riparte dal primo blocco non
+    completato. Se il job viene ripreso da un altro worker (heartbeat scaduto)
+    l'elaborazione si interrompe senza salvare nulla.
+
+    Returns:
+        str: Stato finale del job ("done", "queued", "failed" o "lost").
+    """
+    job_id, kind, params, checkpoint = job
+    conn = get_db_connection()
+    if conn is None:
+        raise Exception("Database connection failed")
+
+    try:
+        checkpoint = _job_batches(conn, kind, params, checkpoint)
+        total = len(checkpoint["batches"])
+        while checkpoint["done"] < total:
+            if time.monotonic() >= deadline:
+                paused = update_screening_job(
+                    conn, job_id, worker_id, status="queued", worker=None, attempts=0, checkpoint=checkpoint
+                )
+                if not paused:
+                    return "lost"
+                logger.info(f"Screening job {job_id} paused at batch {checkpoint['done']}/{total}")
+                return "queued"
+
+            batch = checkpoint["done"]
+            if not update_screening_job(conn, job_id, worker_id, stage=f"screening batch {batch + 1}/{total}"):
+                return "lost"
+            norad_codes = checkpoint["batches"][batch]
+            with job_heartbeat(conn, job_id, worker_id):
+                if kind == "all":
+                    result = screen_customers(params, norad_codes, persist=False)
+                else:
+                    result = screen_customer(params, norad_codes[0], persist=False)
+
+            checkpoint["done"] = batch + 1
+            if not save_job_batch(
+                conn, job_id, worker_id, batch, result, norad_codes, checkpoint,
+                checkpoint["done"] / total, f"batch {batch + 1}/{total} done"
+            ):
+                logger.warning(f"Screening job {job_id} lost to another worker, batch {batch + 1}/{total} discarded")
+                return "lost"
+
+        update_screening_job(conn, job_id, worker_id, status="done", progress=1.0, stage="done")
+        logger.info(f"Screening job {job_id} completed: {total} batches")
+        return "done"
+    except Exception as e:
+        logger.error(f"Screening job {job_id} failed: {e}")
+        conn.rollback()
+        update_screening_job(conn, job_id, worker_id, status="failed", error=str(e))
+        return "failed"
+    finally:
+        release_db_connection(conn)
+
+
+def process_screening_jobs(budget_seconds=None):
+    """
+    Preleva ed elabora job finche' ce ne sono e resta tempo nel budget.
+
+    Returns:
+        list: (id, stato finale) dei job elaborati.
+    """
+    deadline = time.monotonic() + (budget_seconds or JOB_WORK_SECONDS)
+    worker_id = f"{os.getpid()}-{threading.get_ident()}"
+    processed = []
+    while time.monotonic() < deadline:
+        conn = get_db_connection()
+        if conn is None:
+            raise Exception("Database connection failed")
+        try:
+            job = claim_screening_job(conn, worker_id)
+        finally:
+            release_db_connection(conn)
+        if job is None:
+            break
+        processed.append((job[0], run_screening_job(job, deadline, worker_id)))
+    return processed
+
+
+def _job_worker_loop():
+    while True:
+        try:
+            if not process_screening_jobs():
+                time.sleep(JOB_POLL_SECONDS)
+        except Exception as e:
+            logger.error(f"Screening job worker error: {e}")
+            time.sleep(JOB_POLL_SECONDS)
+
+
+def start_job_workers():
+    """
+    Avvia JOB_WORKER_THREADS thread di elaborazione nel processo (per i deploy
+    con processi di lunga durata; su Vercel i job sono elaborati da /jobs/work).
+    Non fa nulla nei processi figli del pool di propagazione, che reimportano
+    questo modulo.
+    """
+    if multiprocessing.parent_process() is not None:
+        return
+    for i in range(JOB_WORKER_THREADS):
+        threading.Thread(target=_job_worker_loop, name=f"screening-job-worker-{i}", daemon=True).start()
+    if JOB_WORKER_THREADS:
+        logger.info(f"{JOB_WORKER_THREADS} screening job workers started")
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job_api():
+    # {
+    #     "kind": "customer" | "all",
+    #     ... parametri di /calculate_intersections o /calculate_intersections_all,
+    #     "batch_customers": 50
+    # }
+    """
+    Accoda uno screening e restituisce subito l'id del job.
+    """
+    data = request.get_json() or {}
+    kind = data.get("kind", "customer")
+    if kind not in ("customer", "all"):
+        return jsonify({"status": "error", "message": f"Unknown job kind: {kind}"}), 400
+    try:
+        parse_start_time(data.get("start_time"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"status": "error", "message": "Database connection failed"}), 500
+    try:
+        job_id = submit_screening_job(conn, kind, data)
+        return jsonify({"status": "queued", "job_id": job_id}), 202
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+    finally:
+        release_db_connection(conn)
+
+
+@app.route("/jobs/<int:job_id>", methods=["GET"])
+def get_job_api(job_id):
+    """
+    Stato e avanzamento di un job di screening.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"status": "error", "message": "Database connection failed"}), 500
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, kind, status, progress, stage, error, attempts, created_at, started_at, finished_at "
+            "FROM screening_jobs WHERE id = %s",
+            (job_id,)
+        )
+        row = cursor.fetchone()
+        cursor.close()
+        if row is None:
+            return jsonify({"status": "error", "message": f"Job {job_id} not found"}), 404
+        columns = ["job_id", "kind", "status", "progress", "stage", "error", "attempts", "created_at", "started_at", "finished_at"]
+        return jsonify(dict(zip(columns, row))), 200
+    finally:
+        release_db_connection(conn)
+
+
+@app.route("/jobs/<int:job_id>/result", methods=["GET"])
+def get_job_result_api(job_id):
+    """
+    Risultato di un job completato, nello stesso formato degli endpoint sincroni.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"status": "error", "message": "Database connection failed"}), 500
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT status FROM screening_jobs WHERE id = %s", (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return jsonify({"status": "error", "message": f"Job {job_id} not found"}), 404
+        if row[0] != "done":
+            return jsonify({"status": row[0], "message": f"Job {job_id} is not completed"}), 409
+
+        cursor.execute("SELECT payload FROM screening_job_results WHERE job_id = %s ORDER BY batch", (job_id,))
+        payloads = [payload for payload, in cursor.fetchall()]
+        cursor.close()
+
+        intersections = [intersect for payload in payloads for intersect in payload["intersections"]]
+        return jsonify({
+            "status": "success",
+            "customers": sum(payload.get("customers", 1) for payload in payloads),
+            "filter_stats": [payload["filter_stats"] for payload in payloads],
+            "intersections_numbers": len(intersections),
+            "intersections": intersections,
+        }), 200
+    finally:
+        release_db_connection(conn)
+
+
+@app.route("/jobs/work", methods=["GET", "POST"])
+def work_jobs_api():
+    """
+    Elabora i job in coda per al massimo JOB_WORK_SECONDS, richiamato dal cron di
+    Vercel: i job piu' lunghi proseguono alle invocazioni successive dal checkpoint.
+    """
+    try:
+        processed = process_screening_jobs()
+        return jsonify({"status": "success", "jobs": [{"job_id": job_id, "status": status} for job_id, status in processed]}), 200
+    except Exception as e:
+        logger.error(f"Error processing screening jobs: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+start_job_workers()
+
+
 # ****************************************************************************************
 # Sezione 5: Main Application
 # ****************************************************************************************
@@ -0,0 +1,472 @@
+"""
+Benchmark offline del motore di screening su cataloghi sintetici.
+
+Genera cataloghi di N oggetti (default 1k, 10k, 50k) da elementi orbitali
+realistici (LEO eliosincrone, costellazioni, detriti, MEO GNSS, GTO, GEO,
+Molniya), con TLE validi e record in formato Space-Track, e misura:
+
+    parse            prepare_tle_batch sui record Space-Track         (rows/s)
+    ingest           COPY nella tabella di staging (solo con --ingest) (rows/s)
+    propagate        from_tle_to_ephemeris sull'intero catalogo        (points/s)
+    positions        from_tle_to_positions su --positions-max oggetti  (points/s)
+    calculate_positions  calculate_positions su --targets oggetti      (points/s)
+    filter           get_potential_colliders per --targets oggetti     (pairs/s)
+    screen           calculate_intersections oggetto / catalogo        (pairs/s)
+    czml             create_czml + serializzazione JSON                (points/s)
+
+Ogni misura e' il migliore di --repeat esecuzioni; il picco di memoria e' misurato
+con tracemalloc in un'esecuzione separata (esclusa la memoria dei processi del
+pool di propagazione). La cache delle effemeridi e' disattivata, cosi' le
+ripetizioni propagano sempre.
+
+Esempi:
+    python dev/bench/bench.py --sizes 1000 10000 --save dev/bench/baselines/locale.json
+    python dev/bench/bench.py --compare dev/bench/baselines/locale.json
+    python dev/bench/bench.py --sizes 50000 --ingest   # usa il database configurato in .env
+
+Con --compare lo script termina con codice 1 se un throughput peggiora piu' di --tolerance.
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# La cache renderebbe gratuite le ripetizioni dopo la prima
+os.environ["EPHEMERIS_CACHE_MB"] = "0"
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+
+import logging  # noqa: E402
+
+import numpy as np  # noqa: E402
+import sgp4  # noqa: E402
+from sgp4.api import Satrec  # noqa: E402
+
+import index  # noqa: E402
+
+MU_KM3_S2 = 398600.8
+EARTH_RADIUS_KM = 6378.135
+
+# Popolazioni del catalogo sintetico: (nome, peso, generatore di elementi)
+# Ogni generatore restituisce (perigeo_km, apogeo_km, inclinazione_deg)
+
+
+def _sun_synchronous(r):
+    altitude = r.uniform(480, 850)
+    return altitude - r.uniform(0, 15), altitude + r.uniform(0, 15), 96.5 + altitude / 850 * 2.2 + r.gauss(0, 0.1)
+
+
+def _constellation(r):
+    altitude, inclination = r.choice([(550, 53.0), (540, 53.2), (570, 70.0), (560, 97.6), (1200, 87.9)])
+    return altitude - r.uniform(0, 2), altitude + r.uniform(0, 2), inclination + r.gauss(0, 0.02)
+
+
+def _debris(r):
+    perigee = r.uniform(300, 1500)
+    return perigee, perigee + abs(r.gauss(0, 150)), r.uniform(30, 100)
+
+
+def _space_station(r):
+    altitude = r.uniform(400, 430)
+    return altitude - r.uniform(0, 5), altitude + r.uniform(0, 5), 51.64 + r.gauss(0, 0.01)
+
+
+def _gnss(r):
+    altitude = r.uniform(19100, 23300)
+    return altitude - r.uniform(0, 300), altitude + r.uniform(0, 300), 55.0 + r.gauss(0, 1.5)
+
+
+def _gto(r):
+    return r.uniform(200, 600), r.uniform(35000, 36500), r.uniform(0, 28.5)
+
+
+def _geo(r):
+    return 35786 - r.uniform(0, 40), 35786 + r.uniform(0, 40), r.uniform(0, 15)
+
+
+def _molniya(r):
+    return r.uniform(500, 1200), r.uniform(39000, 40000), 63.4 + r.gauss(0, 0.3)
+
+
+POPULATIONS = [
+    ("sun_synchronous", 0.28, _sun_synchronous),
+    ("constellation", 0.25, _constellation),
+    ("debris", 0.27, _debris),
+    ("space_station", 0.02, _space_station),
+    ("gnss", 0.05, _gnss),
+    ("gto", 0.05, _gto),
+    ("geo", 0.06, _geo),
+    ("molniya", 0.02, _molniya),
+]
+
+BENCHMARKS = ["parse", "ingest", "propagate", "positions", "calculate_positions", "filter", "screen", "czml"]
+
+
+def _checksum(line):
+    return str(sum(int(c) if c.isdigit() else (1 if c == "-" else 0) for c in line[:68]) % 10)
+
+
+def _tle_exponent(value):
+    """
+    Formatta un valore nel campo esponenziale implicito dei TLE (" 12345-4").
+    """
+    if value == 0:
+        return " 00000-0"
+    exponent = math.floor(math.log10(abs(value))) + 1
+    mantissa = round(abs(value) / 10 ** exponent * 1e5)
+    if mantissa >= 100000:
+        mantissa //= 10
+        exponent += 1
+    return f"{'-' if value < 0 else ' '}{mantissa:05d}{'-' if exponent < 0 else '+'}{abs(exponent)}"
+
+
+def make_tle(norad, epoch, inclination, raan, eccentricity, arg_perigee, mean_anomaly, mean_motion, bstar, ndot):
+    """
+    Costruisce le due linee di un TLE valido (checksum inclusi) dagli elementi.
+    """
+    day_of_year = (epoch - datetime(epoch.year, 1, 1)).total_seconds() / 86400 + 1
+    ndot_text = ("-" if ndot < 0 else " ") + f"{abs(ndot):.8f}"[1:]
+    line1 = (
+        f"1 {norad:05d}U {epoch.year % 100:02d}{norad % 997:03d}A   {epoch.year % 100:02d}{day_of_year:012.8f} "
+        f"{ndot_text} {_tle_exponent(0)} {_tle_exponent(bstar)} 0 {norad % 1000:4d}"
+    )
+    line2 = (
+        f"2 {norad:05d} {inclination:8.4f} {raan:8.4f} {round(eccentricity * 1e7):07d} "
+        f"{arg_perigee:8.4f} {mean_anomaly:8.4f} {mean_motion:11.8f}{norad % 100000:5d}"
+    )
+    return line1 + _checksum(line1), line2 + _checksum(line2)
+
+
+def generate_catalog(size, start_time, seed):
+    """
+    Genera `size` record in formato Space-Track (TLE_LINE1, TLE_LINE2, APOAPSIS,
+    PERIAPSIS, INCLINATION, GP_ID, ...), con epoche negli ultimi tre giorni
+    prima di start_time.
+    """
+    r = random.Random(seed)
+    weights = [weight for _, weight, _ in POPULATIONS]
+    records = []
+    for i in range(size):
+        name, _, generator = r.choices(POPULATIONS, weights)[0]
+        periapsis, apoapsis, inclination = generator(r)
+        inclination = min(max(inclination, 0.0), 179.9)
+        semi_major_axis = (periapsis + apoapsis) / 2 + EARTH_RADIUS_KM
+        eccentricity = (apoapsis - periapsis) / (apoapsis + periapsis + 2 * EARTH_RADIUS_KM)
+        mean_motion = math.sqrt(MU_KM3_S2 / semi_major_axis ** 3) * 86400 / (2 * math.pi)
+        # Resistenza atmosferica decrescente con la quota del perigeo
+        bstar = 1e-3 * math.exp(-(periapsis - 300) / 250) * r.uniform(0.2, 2.0) if periapsis < 1500 else 0.0
+        ndot = bstar * r.uniform(0, 0.05)
+        epoch = start_time - timedelta(days=r.uniform(0, 3))
+        norad = 10000 + i
+        line1, line2 = make_tle(
+            norad, epoch, inclination, r.uniform(0, 360), eccentricity,
+            r.uniform(0, 360), r.uniform(0, 360), mean_motion, bstar, ndot,
+        )
+        records.append({
+            "NORAD_CAT_ID": str(norad),
+            "OBJECT_NAME": f"{name.upper()} {norad}",
+            "TLE_LINE1": line1,
+            "TLE_LINE2": line2,
+            "APOAPSIS": f"{apoapsis:.3f}",
+            "PERIAPSIS": f"{periapsis:.3f}",
+            "INCLINATION": f"{inclination:.4f}",
+            "GP_ID": str(200000000 + i),
+            "CREATION_DATE": start_time.strftime("%Y-%m-%dT%H:%M:%S"),
+        })
+    return records
+
+
+def build_catalog(records):
+    """
+    Costruisce l'array strutturato di `load_catalog_columns` direttamente dai
+    record sintetici, senza database.
+    """
+    parsed, valid = index.parse_tle_lines(
+        [record["TLE_LINE1"] for record in records], [record["TLE_LINE2"] for record in records]
+    )
+    if not valid.all():
+        raise ValueError(f"{np.count_nonzero(~valid)} TLE sintetici non validi")
+    catalog = np.zeros(len(records), dtype=index.CATALOG_DTYPE)
+    catalog["norad"] = parsed["codnorad_riga1"]
+    catalog["apoapsis"] = [float(record["APOAPSIS"]) for record in records]
+    catalog["periapsis"] = [float(record["PERIAPSIS"]) for record in records]
+    catalog["inclination"] = [float(record["INCLINATION"]) for record in records]
+    catalog["raan"] = parsed["ascensione_retta"]
+    catalog["eccentricity"] = parsed["eccentricita"]
+    catalog["arg_perigee"] = parsed["arg_perigeo"]
+    catalog["mean_anomaly"] = parsed["anomalia_media"]
+    catalog["mean_motion"] = parsed["moto_medio"]
+    catalog["epoch_year"] = parsed["annoepoca_astro"]
+    catalog["epoch_day"] = parsed["epoca_astro"]
+    catalog["tle_line1"] = [record["TLE_LINE1"] for record in records]
+    catalog["tle_line2"] = [record["TLE_LINE2"] for record in records]
+    return catalog
+
+
+def measure(function, repeat, memory):
+    """
+    Esegue `function` repeat volte e restituisce il tempo migliore, il risultato
+    dell'ultima esecuzione e, con memory=True, il picco tracemalloc in MB.
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    peak_mb = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        function()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return best, result, peak_mb
+
+
+def _subset(ephemeris, rows):
+    subset = dict(ephemeris)
+    subset["ids"] = [ephemeris["ids"][i] for i in rows]
+    subset["satrecs"] = [ephemeris["satrecs"][i] for i in rows]
+    for key in ("positions", "velocities", "errors"):
+        subset[key] = ephemeris[key][rows]
+    return subset
+
+
+def _tle_lines(catalog, limit):
+    return {
+        str(catalog["norad"][row]): [str(catalog["tle_line1"][row]), str(catalog["tle_line2"][row])]
+        for row in range(min(limit, len(catalog)))
+    }
+
+
+def run_size(size, args, selected):
+    """
+    Esegue i benchmark selezionati su un catalogo di `size` oggetti.
+
+    Returns:
+        dict: {benchmark: {"seconds", "work", "unit", "throughput", "peak_mb"}}.
+    """
+    start_time = datetime.strptime(args.start_time, "%Y-%m-%dT%H:%M:%SZ")
+    records = generate_catalog(size, start_time, args.seed)
+    catalog = build_catalog(records)
+    catalog_index = index.build_catalog_index(catalog)
+    tle_set = {str(norad): index.get_catalog_satrec(catalog_index, row) for row, norad in enumerate(catalog["norad"].tolist())}
+    targets = random.Random(args.seed).sample(range(size), min(args.targets, size))
+    window = index.build_screening_window(start_time, args.duration)
+    filters = index.build_filter_config({}, 100, 100, 1)
+    steps = len(index.build_time_grid(start_time, args.duration, args.step)[0])
+
+    results = {}
+
+    def record(name, function, work, unit):
+        seconds, value, peak_mb = measure(function, args.repeat, not args.no_memory)
+        work = work(value) if callable(work) else work
+        results[name] = {
+            "seconds": round(seconds, 6),
+            "work": work,
+            "unit": unit,
+            "throughput": round(work / seconds, 3) if seconds > 0 else None,
+            "peak_mb": round(peak_mb, 2) if peak_mb is not None else None,
+        }
+        return value
+
+    if "parse" in selected:
+        record("parse", lambda: index.prepare_tle_batch(records), len, "rows/s")
+
+    if "ingest" in selected and args.ingest:
+        def ingest():
+            conn = index.get_db_connection()
+            try:
+                index.create_catalog_staging(conn)
+                inserted = 0
+                for batch in index.iter_batches(records, index.TLE_INGEST_BATCH_SIZE):
+                    inserted += index.process_tle_batch(conn, batch, table=index.TLE_STAGING_TABLE)
+                return inserted
+            finally:
+                index.drop_catalog_staging(conn)
+                index.release_db_connection(conn)
+        record("ingest", ingest, lambda inserted: inserted, "rows/s")
+
+    ephemeris = None
+    if selected & {"propagate", "screen", "czml"}:
+        ephemeris = record(
+            "propagate",
+            lambda: index.from_tle_to_ephemeris(tle_set, start_time, args.duration, args.step),
+            lambda eph: int(eph["errors"].size),
+            "points/s",
+        )
+        if "propagate" not in selected:
+            del results["propagate"]
+
+    if "positions" in selected:
+        subset = _tle_lines(catalog, args.positions_max)
+        record(
+            "positions",
+            lambda: index.from_tle_to_positions(subset, start_time, args.duration, args.step),
+            lambda positions: sum(len(points) for points in positions.values()),
+            "points/s",
+        )
+
+    if "calculate_positions" in selected:
+        lines = [[str(catalog["tle_line1"][row]), str(catalog["tle_line2"][row])] for row in targets]
+        record(
+            "calculate_positions",
+            lambda: [index.calculate_positions(tle, start_time, args.duration, args.step) for tle in lines],
+            lambda positions: sum(len(points) for points in positions),
+            "points/s",
+        )
+
+    if "filter" in selected:
+        norads = [int(catalog["norad"][row]) for row in targets]
+        candidates = record(
+            "filter",
+            lambda: [
+                len(index.get_potential_colliders(catalog_index, norad, filters, args.threshold, window)[0])
+                for norad in norads
+            ],
+            len(norads) * (size - 1),
+            "pairs/s",
+        )
+        results["filter"]["candidates"] = int(sum(candidates))
+
+    if "screen" in selected:
+        screened = dict(ephemeris)
+        screened["ids"] = list(ephemeris["ids"])
+        screened["ids"][targets[0]] = "main_object"
+        intersections = record(
+            "screen",
+            lambda: index.calculate_intersections(screened, args.threshold, refine=True),
+            size - 1,
+            "pairs/s",
+        )
+        results["screen"]["intersections"] = len(intersections)
+
+    if "czml" in selected:
+        rows = list(range(min(args.czml_max, size)))
+        czml_ephemeris = _subset(ephemeris, rows)
+        config = index.build_czml_config({"czml": {"compact": args.czml_compact}})
+        document = record(
+            "czml",
+            lambda: json.dumps(index.create_czml(czml_ephemeris, config=config)),
+            len(rows) * steps,
+            "points/s",
+        )
+        results["czml"]["bytes"] = len(document)
+
+    return results
+
+
+def environment(args):
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "sgp4": getattr(sgp4, "__version__", "unknown"),
+        "sgp4_accelerated": Satrec.__module__ != "sgp4.model",
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "propagation_workers": index.PROPAGATION_WORKERS,
+        "params": {
+            "start_time": args.start_time,
+            "duration": args.duration,
+            "step": args.step,
+            "threshold": args.threshold,
+            "targets": args.targets,
+            "positions_max": args.positions_max,
+            "czml_max": args.czml_max,
+            "czml_compact": args.czml_compact,
+            "seed": args.seed,
+        },
+    }
+
+
+def print_report(results):
+    print(f"{'size':>7} {'benchmark':<20} {'seconds':>10} {'throughput':>16} {'unit':<9} {'peak MB':>9}")
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            peak = f"{result['peak_mb']:9.1f}" if result["peak_mb"] is not None else f"{'-':>9}"
+            print(f"{size:>7} {name:<20} {result['seconds']:10.4f} {result['throughput']:16,.0f} {result['unit']:<9} {peak}")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Confronta i throughput con quelli della baseline e restituisce il numero di
+    regressioni oltre la tolleranza.
+    """
+    regressions = 0
+    print(f"\n{'size':>7} {'benchmark':<20} {'baseline':>16} {'attuale':>16} {'ratio':>7}")
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            reference = baseline["results"].get(size, {}).get(name)
+            if not reference or not reference.get("throughput") or not result["throughput"]:
+                continue
+            ratio = result["throughput"] / reference["throughput"]
+            flag = ""
+            if ratio < 1 - tolerance:
+                flag = "  REGRESSIONE"
+                regressions += 1
+            elif ratio > 1 + tolerance:
+                flag = "  miglioramento"
+            print(f"{size:>7} {name:<20} {reference['throughput']:16,.0f} {result['throughput']:16,.0f} {ratio:7.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline di propagazione, screening e ingest dei TLE")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Esegue solo i benchmark indicati")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--start-time", default="2024-11-25T00:00:00Z")
+    parser.add_argument("--duration", type=int, default=120, help="Durata della finestra in minuti")
+    parser.add_argument("--step", type=int, default=60, help="Passo della griglia in secondi")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Soglia di screening in km")
+    parser.add_argument("--targets", type=int, default=20, help="Oggetti usati per filter e calculate_positions")
+    parser.add_argument("--positions-max", type=int, default=2000, help="Oggetti massimi per from_tle_to_positions")
+    parser.add_argument("--czml-max", type=int, default=1000, help="Oggetti massimi nel documento CZML")
+    parser.add_argument("--czml-compact", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ingest", action="store_true", help="Misura il COPY in staging sul database di .env")
+    parser.add_argument("--no-memory", action="store_true", help="Non misura il picco di memoria")
+    parser.add_argument("--save", help="Salva i risultati come baseline JSON")
+    parser.add_argument("--compare", help="Baseline JSON da confrontare")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Peggioramento ammesso del throughput")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    selected = set(args.only or BENCHMARKS)
+
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = run_size(size, args, selected)
+    report = {"environment": environment(args), "results": results}
+    print_report(results)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline salvata in {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["environment"]["params"] != report["environment"]["params"]:
+            print("\nAttenzione: parametri diversi dalla baseline, il confronto non e' omogeneo")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{regressions} regressioni oltre il {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,22 +13,32 @@ CREATE TABLE match_actual (
     sat2 VARCHAR(50) NOT NULL,
     time DOUBLE PRECISION NOT NULL,
     distance DOUBLE PRECISION NOT NULL,
-    coord1 TEXT NOT NULL,
-    coord2 TEXT NOT NULL,
+    coord1 DOUBLE PRECISION[] NOT NULL,
+    coord2 DOUBLE PRECISION[] NOT NULL,
     created_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Storico dei match partizionato per mese su created_at; le righe fuori dalle
+-- partizioni mensili finiscono nella partizione di default
 CREATE TABLE match_history (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     norad_code VARCHAR(20) NOT NULL,
     sat1 VARCHAR(50) NOT NULL,
     sat2 VARCHAR(50) NOT NULL,
     time DOUBLE PRECISION NOT NULL,
     distance DOUBLE PRECISION NOT NULL,
-    coord1 TEXT NOT NULL,
-    coord2 TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT NOW()
-);
+    coord1 DOUBLE PRECISION[] NOT NULL,
+    coord2 DOUBLE PRECISION[] NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE match_history_default PARTITION OF match_history DEFAULT;
+-- Gli indici seguono l'ordinamento (created_at DESC, id DESC) della paginazione
+-- keyset di /match_history, senza filtri o filtrata per sat2
+CREATE INDEX match_history_created_at_id_idx ON match_history (created_at, id);
+CREATE INDEX match_history_norad_code_created_at_idx ON match_history (norad_code, created_at);
+CREATE INDEX match_history_sat2_created_at_id_idx ON match_history (sat2, created_at, id);
 
 CREATE TABLE tle_list (
     idcounter SERIAL PRIMARY KEY,  -- Generato automaticamente
@@ -57,8 +67,187 @@ CREATE TABLE tle_list (
     json JSON,
     sourceid INTEGER,
     dt TIMESTAMP WITHOUT TIME ZONE,
-    extra_info TEXT  -- Campo di testo per maggiore flessibilità
-    APOAPSIS TEXT,
-    PERIAPSIS TEXT,
-    INCLINATION TEXT,
+    extra_info TEXT,  -- Campo di testo per maggiore flessibilità
+    APOAPSIS DOUBLE PRECISION,
+    PERIAPSIS DOUBLE PRECISION,
+    INCLINATION DOUBLE PRECISION
+);
+
+-- Versioni del catalogo TLE: la versione attiva punta al tle_list corrente,
+-- le precedenti restano in tle_list_v<versione> fino alla retention
+CREATE TABLE tle_catalog_version (
+    version SERIAL PRIMARY KEY,
+    created_at TIMESTAMP DEFAULT NOW(),
+    source TEXT NOT NULL,
+    row_count INTEGER,
+    archived_table TEXT,
+    active BOOLEAN NOT NULL DEFAULT FALSE,
+    changed_norad INTEGER[]  -- NORAD modificati dalle versioni "delta", NULL per i caricamenti completi
+);
+
+-- La sequenza di idcounter e' condivisa tra tle_list e le sue versioni archiviate
+ALTER SEQUENCE tle_list_idcounter_seq OWNED BY NONE;
+
+-- Sincronizzazione incrementale: GP_ID/CREATION_DATE di Space-Track e upsert per NORAD
+ALTER TABLE tle_list ADD COLUMN gp_id BIGINT;
+ALTER TABLE tle_list ADD COLUMN creation_date TIMESTAMP;
+CREATE UNIQUE INDEX tle_list_codnorad_riga1_key ON tle_list (codnorad_riga1);
+CREATE INDEX tle_list_gp_id_idx ON tle_list (gp_id);
+
+-- Filtri orbitali sul catalogo: apoapsis/periapsis/inclinazione numerici e indicizzati
+CREATE INDEX tle_list_apoapsis_periapsis_idx ON tle_list (apoapsis, periapsis);
+CREATE INDEX tle_list_inclination_idx ON tle_list (inclination);
+
+-- Scrittura dei risultati per cliente: match_actual viene sostituito per norad_code
+CREATE INDEX match_actual_norad_code_idx ON match_actual (norad_code);
+
+-- Riepilogo per incontro (cliente, coppia, giorno) delle righe di match_history
+-- eliminate dalla retention
+CREATE TABLE match_history_rollup (
+    norad_code VARCHAR(20) NOT NULL,
+    sat1 VARCHAR(50) NOT NULL,
+    sat2 VARCHAR(50) NOT NULL,
+    encounter_day DATE NOT NULL,
+    hits INTEGER NOT NULL,
+    min_distance DOUBLE PRECISION NOT NULL,
+    time_at_min_distance DOUBLE PRECISION,
+    coord1 DOUBLE PRECISION[],
+    coord2 DOUBLE PRECISION[],
+    first_seen TIMESTAMP NOT NULL,
+    last_seen TIMESTAMP NOT NULL,
+    PRIMARY KEY (norad_code, sat1, sat2, encounter_day)
+);
+CREATE INDEX match_history_rollup_sat2_idx ON match_history_rollup (sat2);
+
+-- Crea le partizioni mensili di match_history dal mese corrente a months_ahead mesi.
+-- Se la partizione di default contiene gia' righe del mese (partizione mancante
+-- quando sono state inserite) la creazione fallirebbe: la default viene staccata,
+-- le righe spostate nella nuova partizione e la default riattaccata.
+CREATE OR REPLACE FUNCTION match_history_create_partitions(months_ahead INTEGER DEFAULT 2)
+RETURNS VOID AS $$
+DECLARE
+    month_start DATE;
+    month_end DATE;
+    partition_name TEXT;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        month_start := (date_trunc('month', NOW()) + make_interval(months => i))::date;
+        month_end := (month_start + INTERVAL '1 month')::date;
+        partition_name := 'match_history_' || to_char(month_start, 'YYYY_MM');
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+
+        IF EXISTS (
+            SELECT 1 FROM match_history_default WHERE created_at >= month_start AND created_at < month_end
+        ) THEN
+            ALTER TABLE match_history DETACH PARTITION match_history_default;
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF match_history FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_end
+            );
+            EXECUTE format(
+                'INSERT INTO %I SELECT * FROM match_history_default WHERE created_at >= %L AND created_at < %L',
+                partition_name, month_start, month_end
+            );
+            DELETE FROM match_history_default WHERE created_at >= month_start AND created_at < month_end;
+            ALTER TABLE match_history ATTACH PARTITION match_history_default DEFAULT;
+        ELSE
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF match_history FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_end
+            );
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Riassume in match_history_rollup le righe precedenti all'inizio del mese di
+-- NOW() - raw_retention, poi elimina le partizioni mensili interamente piu'
+-- vecchie e le stesse righe dalla partizione di default. Restituisce il numero
+-- di incontri riassunti.
+CREATE OR REPLACE FUNCTION match_history_apply_retention(raw_retention INTERVAL)
+RETURNS BIGINT AS $$
+DECLARE
+    cutoff TIMESTAMP := date_trunc('month', NOW()::timestamp - raw_retention);
+    partition_name TEXT;
+    rolled BIGINT;
+BEGIN
+    INSERT INTO match_history_rollup (
+        norad_code, sat1, sat2, encounter_day, hits, min_distance,
+        time_at_min_distance, coord1, coord2, first_seen, last_seen
+    )
+    SELECT
+        norad_code, sat1, sat2, created_at::date, COUNT(*), MIN(distance),
+        (array_agg(time ORDER BY distance))[1],
+        (array_agg(coord1 ORDER BY distance))[1],
+        (array_agg(coord2 ORDER BY distance))[1],
+        MIN(created_at), MAX(created_at)
+    FROM match_history
+    WHERE created_at < cutoff
+    GROUP BY norad_code, sat1, sat2, created_at::date
+    ON CONFLICT (norad_code, sat1, sat2, encounter_day) DO UPDATE SET
+        hits = match_history_rollup.hits + EXCLUDED.hits,
+        time_at_min_distance = CASE WHEN EXCLUDED.min_distance < match_history_rollup.min_distance
+            THEN EXCLUDED.time_at_min_distance ELSE match_history_rollup.time_at_min_distance END,
+        coord1 = CASE WHEN EXCLUDED.min_distance < match_history_rollup.min_distance
+            THEN EXCLUDED.coord1 ELSE match_history_rollup.coord1 END,
+        coord2 = CASE WHEN EXCLUDED.min_distance < match_history_rollup.min_distance
+            THEN EXCLUDED.coord2 ELSE match_history_rollup.coord2 END,
+        min_distance = LEAST(match_history_rollup.min_distance, EXCLUDED.min_distance),
+        first_seen = LEAST(match_history_rollup.first_seen, EXCLUDED.first_seen),
+        last_seen = GREATEST(match_history_rollup.last_seen, EXCLUDED.last_seen);
+    GET DIAGNOSTICS rolled = ROW_COUNT;
+
+    FOR partition_name IN
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'match_history'::regclass
+          AND c.relname ~ '^match_history_[0-9]{4}_[0-9]{2}$'
+          AND to_date(right(c.relname, 7), 'YYYY_MM') < cutoff
+    LOOP
+        EXECUTE format('DROP TABLE %I', partition_name);
+    END LOOP;
+    DELETE FROM match_history_default WHERE created_at < cutoff;
+
+    RETURN rolled;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT match_history_create_partitions();
+
+-- Coda dei job di screening asincroni: i worker prelevano i job con
+-- FOR UPDATE SKIP LOCKED e salvano un checkpoint dopo ogni blocco di clienti
+CREATE TABLE screening_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed
+    progress DOUBLE PRECISION NOT NULL DEFAULT 0,
+    stage TEXT,
+    checkpoint JSONB,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMP,
+    heartbeat_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+CREATE INDEX screening_jobs_pending_idx ON screening_jobs (created_at) WHERE status IN ('queued', 'running');
+
+CREATE TABLE screening_job_results (
+    job_id BIGINT NOT NULL REFERENCES screening_jobs (id) ON DELETE CASCADE,
+    batch INTEGER NOT NULL,
+    payload JSONB NOT NULL,
+    PRIMARY KEY (job_id, batch)
+);
+
+-- Element set con errori SGP4 permanenti (oggetti decaduti o elementi degenerati):
+-- non vengono propagati per le finestre che iniziano da since_jd in poi
+CREATE TABLE tle_quarantine (
+    norad INTEGER NOT NULL,
+    epoch_jd DOUBLE PRECISION NOT NULL,
+    error_code INTEGER NOT NULL,
+    since_jd DOUBLE PRECISION NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (norad, epoch_jd)
 );
@@ -0,0 +1,88 @@
+import math
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("EPHEMERIS_CACHE_MB", "0")
+os.environ.setdefault("JOB_WORKER_THREADS", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import index  # noqa: E402
+
+MU_KM3_S2 = 398600.8
+START_TIME = datetime(2024, 11, 25)
+
+
+def _checksum(line):
+    return str(sum(int(c) if c.isdigit() else (1 if c == "-" else 0) for c in line[:68]) % 10)
+
+
+def _exponent(value):
+    if value == 0:
+        return " 00000-0"
+    exponent = math.floor(math.log10(abs(value))) + 1
+    mantissa = min(round(abs(value) / 10 ** exponent * 1e5), 99999)
+    return f"{'-' if value < 0 else ' '}{mantissa:05d}{'-' if exponent < 0 else '+'}{abs(exponent)}"
+
+
+def make_tle(norad, epoch, inclination, raan, eccentricity, arg_perigee, mean_anomaly, mean_motion, bstar=0.0, ndot=0.0):
+    day_of_year = (epoch - datetime(epoch.year, 1, 1)).total_seconds() / 86400 + 1
+    line1 = (
+        f"1 {norad:05d}U 24001A   {epoch.year % 100:02d}{day_of_year:012.8f} "
+        f"{'-' if ndot < 0 else ' '}{f'{abs(ndot):.8f}'[1:]} {_exponent(0)} {_exponent(bstar)} 0  999"
+    )
+    line2 = (
+        f"2 {norad:05d} {inclination:8.4f} {raan % 360:8.4f} {round(eccentricity * 1e7):07d} "
+        f"{arg_perigee % 360:8.4f} {mean_anomaly % 360:8.4f} {mean_motion:11.8f}    1"
+    )
+    return line1 + _checksum(line1), line2 + _checksum(line2)
+
+
+def synthetic_catalog(size, seed=0, max_age_days=30.0):
+    """
+    Catalogo LEO denso (perigeo 500-800 km, e fino a 0.02, inclinazioni 0-110 gradi)
+    con epoche fino a max_age_days prima di START_TIME e resistenza atmosferica.
+
+    Returns:
+        tuple: (indice del catalogo, {norad: Satrec}).
+    """
+    r = random.Random(seed)
+    catalog = np.zeros(size, dtype=index.CATALOG_DTYPE)
+    for i in range(size):
+        perigee = r.uniform(500, 800)
+        eccentricity = r.uniform(0, 0.02)
+        a = (perigee + index.EARTH_RADIUS_KM) / (1 - eccentricity)
+        inclination = r.choice([r.uniform(0, 110), r.uniform(96, 99), r.uniform(51, 54)])
+        mean_motion = math.sqrt(MU_KM3_S2 / a ** 3) * 86400 / (2 * math.pi)
+        bstar = r.uniform(1e-5, 5e-4)
+        epoch = START_TIME - timedelta(days=r.uniform(0, max_age_days))
+        line1, line2 = make_tle(
+            10000 + i, epoch, inclination, r.uniform(0, 360), eccentricity,
+            r.uniform(0, 360), r.uniform(0, 360), mean_motion, bstar, bstar * 1e-2,
+        )
+        catalog[i] = (
+            10000 + i, a * (1 + eccentricity) - index.EARTH_RADIUS_KM, perigee, inclination,
+            0, eccentricity, 0, 0, mean_motion, epoch.year, 0, line1, line2,
+        )
+    catalog_index = index.build_catalog_index(catalog)
+    satrecs = {int(norad): index.get_catalog_satrec(catalog_index, row) for row, norad in enumerate(catalog["norad"].tolist())}
+    return catalog_index, satrecs
+
+
+def brute_force_min_distance(ephemeris, main_index):
+    """
+    Distanza minima sulla griglia delle effemeridi tra main_index e ogni oggetto.
+    """
+    delta = ephemeris["positions"] - ephemeris["positions"][main_index]
+    distance = np.linalg.norm(delta, axis=-1)
+    distance[ephemeris["errors"] != 0] = np.inf
+    return distance.min(axis=1)
+
+
+@pytest.fixture(scope="session")
+def start_time():
+    return START_TIME
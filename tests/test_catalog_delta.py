@@ -0,0 +1,41 @@
+import index
+
+
+class Connection:
+    committed = False
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+
+def test_delta_removes_decayed_and_expired_objects(monkeypatch):
+    upserted, removals, published = [], [], []
+
+    def upsert(conn, batch):
+        upserted.extend(int(record["NORAD_CAT_ID"]) for record in batch)
+        return [int(record["NORAD_CAT_ID"]) for record in batch]
+
+    def remove(conn, decayed_norad, max_age_days):
+        removals.append((decayed_norad, max_age_days))
+        return decayed_norad + [10009]
+
+    monkeypatch.setattr(index, "upsert_tle_batch", upsert)
+    monkeypatch.setattr(index, "remove_stale_tles", remove)
+    monkeypatch.setattr(index, "publish_catalog_delta", lambda conn, changed: published.append(changed) or 7)
+
+    records = [
+        {"NORAD_CAT_ID": "10001", "DECAY_DATE": None},
+        {"NORAD_CAT_ID": "10002", "DECAY_DATE": "2024-11-20"},
+        {"NORAD_CAT_ID": "10003"},
+    ]
+    conn = Connection()
+    result = index.ingest_catalog_delta(conn, iter(records))
+
+    assert upserted == [10001, 10003]
+    assert removals == [([10002], index.SPACETRACK_MAX_EPOCH_AGE_DAYS)]
+    assert published == [[10001, 10002, 10003, 10009]]
+    assert result == {"inserted": 2, "removed": 2, "catalog_version": 7}
+    assert conn.committed
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import index
+from conftest import START_TIME, synthetic_catalog
+
+THRESHOLD_KM = 300.0
+DURATION_MINUTES = 120
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    _, satrecs = synthetic_catalog(800, seed=3, max_age_days=3)
+    fine = index.from_tle_to_ephemeris(satrecs, START_TIME, DURATION_MINUTES, 1)
+    return satrecs, fine
+
+
+def brute_force_minima(fine, main_index):
+    """
+    Minimi locali della distanza sotto soglia sulla griglia di 1 s: [(riga, secondo, distanza)].
+    """
+    distance = np.linalg.norm(fine["positions"] - fine["positions"][main_index], axis=-1)
+    minima = []
+    for row in range(distance.shape[0]):
+        if row == main_index:
+            continue
+        x = distance[row]
+        steps = np.flatnonzero((x[1:-1] <= x[:-2]) & (x[1:-1] < x[2:]) & (x[1:-1] <= THRESHOLD_KM)) + 1
+        minima.extend((row, fine["offsets"][step], x[step]) for step in steps)
+    return minima
+
+
+@pytest.mark.parametrize("step_seconds", [60, 300, 1800])
+@pytest.mark.parametrize("main_index", [5, 400])
+def test_find_conjunctions_matches_fine_grid(catalog, step_seconds, main_index):
+    satrecs, fine = catalog
+    truth = brute_force_minima(fine, main_index)
+    assert truth
+
+    ephemeris = index.from_tle_to_ephemeris(satrecs, START_TIME, DURATION_MINUTES, step_seconds)
+    events = index.find_conjunctions(ephemeris, THRESHOLD_KM, main_index=main_index)
+    assert (events["distance"] <= THRESHOLD_KM).all()
+
+    found = list(zip(events["sat_index"].tolist(), events["time"].tolist(), events["distance"].tolist()))
+    for row, second, distance in truth:
+        matches = [event for event in found if event[0] == row and abs(event[1] - second) <= 2.0]
+        assert matches, f"step {step_seconds}: missed encounter with row {row} at {second} s ({distance:.1f} km)"
+        assert matches[0][2] <= distance + 1e-3
+
+
+def test_time_grid_covers_the_whole_window():
+    offsets, jd, fr = index.build_time_grid(START_TIME, DURATION_MINUTES, 1800)
+    assert offsets.tolist() == [0, 1800, 3600, 5400, 7200]
+    assert fr[-1] - fr[0] == pytest.approx(7200 / 86400.0)
+
+
+def test_calculate_intersections_refines_to_tca(catalog):
+    satrecs, _ = catalog
+    tle_set = {"main_object": satrecs[10005], **{norad: satellite for norad, satellite in satrecs.items() if norad != 10005}}
+    ephemeris = index.from_tle_to_ephemeris(tle_set, START_TIME, DURATION_MINUTES, 60)
+
+    refined = index.calculate_intersections(ephemeris, THRESHOLD_KM, refine=True)
+    grid = index.calculate_intersections(ephemeris, THRESHOLD_KM, refine=False)
+    assert refined and grid
+    assert all(hit["distance"] <= THRESHOLD_KM and 0 <= hit["time"] <= DURATION_MINUTES * 60 for hit in refined)
+    assert all(hit["time"] % 60 == 0 for hit in grid)
+    assert any(hit["time"] % 60 for hit in refined)
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import psycopg2
+import pytest
+
+import index
+from conftest import synthetic_catalog
+
+
+class FakeConnection:
+    closed = 0
+
+    class info:
+        transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(index, "DB_POOL_MODE", "pool")
+    monkeypatch.setattr(index, "DB_POOL_MAX", 2)
+    monkeypatch.setattr(index, "DB_POOL_WAIT_SECONDS", 0.2)
+    monkeypatch.setattr(index.psycopg2, "connect", lambda **kwargs: FakeConnection())
+    index.close_db_pool()
+    yield
+    index.close_db_pool()
+
+
+def test_failed_lookups_release_their_connection(pool, monkeypatch):
+    catalog_index, _ = synthetic_catalog(20)
+    monkeypatch.setattr(index, "get_catalog_index", lambda conn: catalog_index)
+    window = index.build_screening_window(index.datetime(2024, 11, 25), 60)
+    filters = index.build_filter_config({}, 100, 100, 1)
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            index.retrieve_tle_engaged(filters, 10.0, window, 99999)
+
+    def broken_catalog(conn):
+        raise RuntimeError("catalog unavailable")
+
+    monkeypatch.setattr(index, "get_catalog_index", broken_catalog)
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            index.retrieve_tle_for_customers(filters, 10.0, window, [10000])
+    assert index.get_pool_metrics()["in_use"] == 0
+
+
+def test_checkout_waits_for_a_released_connection(pool):
+    first, second = index.get_db_connection(), index.get_db_connection()
+    assert index.get_db_connection() is None
+    assert index.get_pool_metrics()["errors"] >= 1
+
+    timer = threading.Timer(0.05, index.release_db_connection, args=(first,))
+    timer.start()
+    third = index.get_db_connection()
+    timer.join()
+    assert third is not None
+    index.release_db_connection(second)
+    index.release_db_connection(third)
+    metrics = index.get_pool_metrics()
+    assert metrics["in_use"] == 0 and metrics["idle"] == index.DB_POOL_MIN
+
+
+def test_slow_connect_does_not_block_release(pool, monkeypatch):
+    monkeypatch.setattr(index, "DB_POOL_MAX", index.DB_POOL_MIN + 2)
+    index.close_db_pool()
+    held = [index.get_db_connection() for _ in range(index.DB_POOL_MIN + 1)]
+
+    connecting = threading.Event()
+
+    def slow_connect(**kwargs):
+        connecting.set()
+        time.sleep(0.5)
+        return FakeConnection()
+
+    monkeypatch.setattr(index.psycopg2, "connect", slow_connect)
+    opener = threading.Thread(target=lambda: held.append(index.get_db_connection()))
+    opener.start()
+    assert connecting.wait(1.0)
+
+    started = time.monotonic()
+    index.release_db_connection(held.pop(0))
+    index.get_pool_metrics()
+    assert time.monotonic() - started < 0.2
+    opener.join()
+    for conn in held:
+        index.release_db_connection(conn)
+    assert index.get_pool_metrics()["in_use"] == 0
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import index
+from conftest import START_TIME, synthetic_catalog
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(index, "EPHEMERIS_CACHE_MB", 16)
+    monkeypatch.setattr(index, "EPHEMERIS_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(index, "_ephemeris_prune_state", {"last": float("-inf")})
+    index._ephemeris_cache.clear()
+    index._ephemeris_cache_stats["bytes"] = 0
+    yield tmp_path
+    index._ephemeris_cache.clear()
+    index._ephemeris_cache_stats["bytes"] = 0
+
+
+def _grid_and_satrecs(size, duration_minutes=120, step_seconds=60):
+    _, satrecs = synthetic_catalog(size)
+    _, jd, fr = index.build_time_grid(START_TIME, duration_minutes, step_seconds)
+    return list(satrecs.values()), jd, fr
+
+
+def _assert_same(actual, expected):
+    for a, b in zip(actual, expected):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_cached_matches_uncached_and_writes_one_file_per_batch(cache):
+    satrecs, jd, fr = _grid_and_satrecs(50)
+    expected = index.propagate_batch(satrecs, jd, fr)
+
+    _assert_same(index.propagate_cached(satrecs, jd, fr), expected)
+    assert len(list(cache.glob("*.npy"))) == 1
+
+    hits = index._ephemeris_cache_stats["hits"]
+    _assert_same(index.propagate_cached(satrecs, jd, fr), expected)
+    assert index._ephemeris_cache_stats["hits"] == hits + len(satrecs)
+
+    index._ephemeris_cache.clear()
+    index._ephemeris_cache_stats["bytes"] = 0
+    _assert_same(index.propagate_cached(satrecs, jd, fr), expected)
+    assert len(index._ephemeris_cache) == len(satrecs)
+    assert len(list(cache.glob("*.npy"))) == 1
+
+
+def test_batch_over_budget_is_not_cached(cache, monkeypatch):
+    satrecs, jd, fr = _grid_and_satrecs(50, duration_minutes=1440, step_seconds=10)
+    monkeypatch.setattr(index, "EPHEMERIS_CACHE_MB", 1)
+    bypassed = index._ephemeris_cache_stats["bypassed"]
+
+    _assert_same(index.propagate_cached(satrecs, jd, fr), index.propagate_batch(satrecs, jd, fr))
+    assert index._ephemeris_cache_stats["bypassed"] == bypassed + 1
+    assert len(index._ephemeris_cache) == 0
+    assert list(cache.glob("*.npy")) == []
+
+
+def test_disk_prune_is_rate_limited(cache, monkeypatch):
+    prunes = []
+    monkeypatch.setattr(index, "_prune_ephemeris_disk_cache", lambda: prunes.append(1))
+    satrecs, jd, fr = _grid_and_satrecs(20)
+    for i in range(5):
+        index.propagate_cached(satrecs[i:i + 10], jd, fr)
+    assert len(list(cache.glob("*.npy"))) == 5
+    assert len(prunes) == 1
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import index
+from conftest import START_TIME, brute_force_min_distance, synthetic_catalog
+
+
+@pytest.mark.parametrize("duration_minutes, threshold_km, step_seconds", [(120, 100.0, 2), (1440, 200.0, 20)])
+def test_prefilters_keep_every_brute_force_encounter(duration_minutes, threshold_km, step_seconds):
+    catalog_index, satrecs = synthetic_catalog(1000, seed=7)
+    ephemeris = index.from_tle_to_ephemeris(satrecs, START_TIME, duration_minutes, step_seconds)
+    assert ephemeris["ids"] == list(satrecs)
+    window = index.build_screening_window(START_TIME, duration_minutes)
+    filters = index.build_filter_config(
+        {"filters": {"tolerance": {"enabled": False}, "orbit_path": {"enabled": True}, "time": {"enabled": True}}}, 0, 0, 0
+    )
+
+    encounters = 0
+    for target_row in range(0, 1000, 25):
+        distance = brute_force_min_distance(ephemeris, target_row)
+        truth = set(np.flatnonzero(distance <= threshold_km).tolist()) - {target_row}
+        kept, stats = index.run_filter_pipeline(catalog_index, target_row, filters, threshold_km, window)
+        assert [stage["stage"] for stage in stats] == ["catalog", "apsis", "orbit_path", "time"]
+        assert truth <= set(kept.tolist()), f"target {target_row}: dropped {sorted(truth - set(kept.tolist()))}"
+        encounters += len(truth)
+    assert encounters > 0
+
+
+def test_geometric_stages_disabled_by_default():
+    filters = index.build_filter_config({}, 100, 100, 1)
+    assert not filters["orbit_path"]["enabled"]
+    assert not filters["time"]["enabled"]
+
+
+def test_window_elements_follow_the_orbit_plane_at_window_start():
+    catalog_index, satrecs = synthetic_catalog(200, seed=11, max_age_days=30)
+    start_time = START_TIME + index.timedelta(hours=6)
+    window = index.build_screening_window(start_time, 60)
+    rows = np.arange(200)
+    elements = index._window_elements(catalog_index, rows, window)
+    assert elements["valid"].all()
+
+    ephemeris = index.from_tle_to_ephemeris(satrecs, start_time, 1, 60)
+    r, v = ephemeris["positions"][:, 0], ephemeris["velocities"][:, 0]
+    h = np.cross(r, v)
+    h /= np.linalg.norm(h, axis=1)[:, None]
+
+    def normal(inclination, raan):
+        return np.stack([np.sin(inclination) * np.sin(raan), -np.sin(inclination) * np.cos(raan), np.cos(inclination)], axis=1)
+
+    def angle_deg(a, b):
+        return np.degrees(np.arccos(np.clip(np.einsum("ij,ij->i", a, b), -1, 1)))
+
+    window_error = angle_deg(h, normal(elements["inclination"], elements["raan"]))
+    epoch_error = angle_deg(h, normal(elements["inclination"], [satrecs[n].nodeo for n in satrecs]))
+    assert window_error.max() < 0.2
+    assert np.median(epoch_error) > 10 * np.median(window_error)
+
+    node = np.stack([np.cos(elements["raan"]), np.sin(elements["raan"]), np.zeros(200)], axis=1)
+    u = np.arctan2(np.einsum("ij,ij->i", r, np.cross(normal(elements["inclination"], elements["raan"]), node)), np.einsum("ij,ij->i", r, node))
+    assert np.abs(np.angle(np.exp(1j * (u - elements["u_start"])))).max() < 1e-6
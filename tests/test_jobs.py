@@ -0,0 +1,272 @@
+import copy
+import csv
+import json
+import threading
+import time
+import types
+
+import pytest
+from psycopg2 import sql
+
+import index
+
+
+def _flatten(query):
+    if isinstance(query, str):
+        return query
+    if isinstance(query, sql.Composed):
+        return "".join(_flatten(part) for part in query.seq)
+    if isinstance(query, sql.Identifier):
+        return ".".join(query.strings)
+    return query.string
+
+
+class JobStore:
+    """
+    Emula in memoria le istruzioni su screening_jobs, screening_job_results,
+    match_actual e match_history eseguite dai job; le scritture di ogni
+    connessione diventano visibili solo al commit.
+    """
+
+    def __init__(self, batches):
+        self.now = 0.0
+        self.lock = threading.Lock()
+        self.jobs = {1: {
+            "status": "queued", "worker": None, "attempts": 0, "heartbeat_at": None,
+            "checkpoint": None, "kind": "all", "params": {"batch_customers": 1}, "error": None,
+        }}
+        self.results = {}
+        self.history = []
+        self.heartbeats = 0
+        self.norad_codes = list(range(10000, 10000 + batches))
+
+    def connect(self):
+        return JobConnection(self)
+
+
+class JobCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.store = conn.store
+        self.rowcount = 0
+        self.row = None
+
+    def execute(self, query, params=()):
+        text = " ".join(_flatten(query).split())
+        params = list(params or ())
+        store, jobs = self.store, self.store.jobs
+        self.rowcount, self.row = 0, None
+
+        if text.startswith("UPDATE screening_jobs SET status = 'failed'"):
+            stale = store.now - params[2]
+            for job_id, job in jobs.items():
+                if job["status"] == "running" and job["attempts"] >= params[1] and job["heartbeat_at"] < stale:
+                    self.rowcount += 1
+                    self.conn.pending.append(lambda job=job: job.update(status="failed", error="stale"))
+        elif text.startswith("UPDATE screening_jobs SET status = 'running'"):
+            worker, max_attempts, stale_seconds = params
+            for job_id, job in sorted(jobs.items()):
+                stale = job["status"] == "running" and job["heartbeat_at"] < store.now - stale_seconds
+                if job["attempts"] < max_attempts and (job["status"] == "queued" or stale):
+                    self.row = (job_id, job["kind"], job["params"], copy.deepcopy(job["checkpoint"]))
+                    self.rowcount = 1
+                    self.conn.pending.append(lambda job=job: job.update(
+                        status="running", worker=worker, attempts=job["attempts"] + 1, heartbeat_at=store.now
+                    ))
+                    break
+        elif text.startswith("UPDATE screening_jobs SET heartbeat_at = NOW()"):
+            job_id, worker = params[-2:]
+            if jobs[job_id]["worker"] == worker:
+                self.rowcount = 1
+                columns = [part.split(" = ")[0] for part in text.split(" SET ")[1].split(" WHERE ")[0].split(", ")[1:]]
+                fields = dict(zip([c for c in columns if c != "finished_at"], params[:-2]))
+                if "checkpoint" in fields:
+                    fields["checkpoint"] = json.loads(fields["checkpoint"])
+                fields["heartbeat_at"] = store.now
+                if len(fields) == 1:
+                    store.heartbeats += 1
+                self.conn.pending.append(lambda job=jobs[job_id]: job.update(fields))
+        elif text.startswith("UPDATE screening_jobs SET checkpoint"):
+            checkpoint, progress, stage, job_id, worker = params
+            if jobs[job_id]["worker"] == worker:
+                self.rowcount = 1
+                self.conn.pending.append(lambda job=jobs[job_id]: job.update(
+                    checkpoint=json.loads(checkpoint), heartbeat_at=store.now
+                ))
+        elif text.startswith("INSERT INTO screening_job_results"):
+            job_id, batch, payload = params
+            self.conn.pending.append(lambda: store.results.__setitem__((job_id, batch), payload))
+        elif text.startswith("DELETE FROM match_actual"):
+            pass
+        else:
+            raise AssertionError(f"Unexpected statement: {text}")
+
+    def copy_expert(self, query, buffer):
+        table = _flatten(query).split()[1]
+        rows = list(csv.reader(buffer))
+        if table == "match_history":
+            self.conn.writes_history = True
+            self.conn.pending.append(lambda: self.store.history.extend(rows))
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+class JobConnection:
+    def __init__(self, store):
+        self.store = store
+        self.pending = []
+        self.writes_history = False
+        self.fail_commit = None
+
+    def cursor(self):
+        return JobCursor(self)
+
+    def commit(self):
+        if self.fail_commit is not None and self.fail_commit(self):
+            self.rollback()
+            raise SystemExit("worker killed")
+        with self.store.lock:
+            for apply in self.pending:
+                apply()
+        self.pending = []
+        self.writes_history = False
+
+    def rollback(self):
+        self.pending = []
+        self.writes_history = False
+
+
+class FakeTime:
+    """
+    Modulo time con monotonic() controllato dal test.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def monotonic(self):
+        return self.clock["now"]
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = JobStore(batches=2 * index.JOB_MAX_ATTEMPTS + 2)
+    clock = {"now": 0.0}
+
+    def screen_customers(params, norad_codes, persist=True):
+        assert not persist
+        clock["now"] += 10.0
+        store.screened.append(list(norad_codes))
+        intersections = [{
+            "norad_code": code, "sat1": str(code), "sat2": "99999", "time": 1.0,
+            "distance": 2.0, "coord1": (1.0, 2.0, 3.0), "coord2": (1.0, 2.0, 4.0),
+        } for code in norad_codes]
+        return {"customers": len(norad_codes), "intersections": intersections, "filter_stats": {}}
+
+    store.screened = []
+    store.clock = clock
+    monkeypatch.setattr(index, "time", FakeTime(clock))
+    monkeypatch.setattr(index, "JOB_HEARTBEAT_SECONDS", 3600.0)
+    monkeypatch.setattr(index, "get_db_connection", store.connect)
+    monkeypatch.setattr(index, "release_db_connection", lambda conn: None)
+    monkeypatch.setattr(index, "get_all_norad_codes_from_db", lambda conn: list(store.norad_codes))
+    monkeypatch.setattr(index, "screen_customers", screen_customers)
+    return store
+
+
+def test_claim_fails_stale_jobs_out_of_attempts(store):
+    job = store.jobs[1]
+    job.update(status="running", worker="dead", attempts=index.JOB_MAX_ATTEMPTS, heartbeat_at=0.0)
+    store.now = index.JOB_STALE_SECONDS + 1
+
+    conn = store.connect()
+    assert index.claim_screening_job(conn, "worker") is None
+    assert job["status"] == "failed"
+
+
+def test_paused_job_is_reclaimed_past_max_attempts(store):
+    claims = 0
+    while store.jobs[1]["status"] != "done":
+        processed = index.process_screening_jobs(budget_seconds=15.0)
+        assert processed, f"job stuck in {store.jobs[1]['status']} after {claims} claims"
+        claims += len(processed)
+        assert claims < 100
+
+    assert claims > index.JOB_MAX_ATTEMPTS
+    assert store.screened == [[code] for code in store.norad_codes]
+    assert sorted(store.results) == [(1, batch) for batch in range(len(store.norad_codes))]
+    assert sorted(int(row[0]) for row in store.history) == store.norad_codes
+
+
+def test_killed_worker_does_not_duplicate_history(store, monkeypatch):
+    saves = []
+
+    def killed_on_second_save(conn):
+        if not conn.writes_history:
+            return False
+        saves.append(conn)
+        return len(saves) == 2
+
+    def connect():
+        conn = JobConnection(store)
+        conn.fail_commit = killed_on_second_save
+        return conn
+
+    monkeypatch.setattr(index, "get_db_connection", connect)
+    with pytest.raises(SystemExit):
+        index.process_screening_jobs(budget_seconds=1e9)
+    assert store.jobs[1]["checkpoint"]["done"] == 1
+    assert len(store.history) == 1
+
+    store.now += index.JOB_STALE_SECONDS + 1
+    assert index.process_screening_jobs(budget_seconds=1e9) == [(1, "done")]
+    assert sorted(int(row[0]) for row in store.history) == store.norad_codes
+    assert store.screened[1] == store.screened[2]
+
+
+def test_worker_that_lost_its_claim_saves_nothing(store, monkeypatch):
+    screen_customers = index.screen_customers
+
+    def reclaimed(params, norad_codes, persist=True):
+        store.jobs[1]["worker"] = "other"
+        return screen_customers(params, norad_codes, persist)
+
+    monkeypatch.setattr(index, "screen_customers", reclaimed)
+    assert index.process_screening_jobs(budget_seconds=1e9) == [(1, "lost")]
+    assert store.jobs[1]["checkpoint"] is None
+    assert store.history == [] and store.results == {}
+
+
+def test_heartbeat_is_refreshed_during_a_batch(store, monkeypatch):
+    screen_customers = index.screen_customers
+
+    def slow(params, norad_codes, persist=True):
+        time.sleep(0.2)
+        return screen_customers(params, norad_codes, persist)
+
+    monkeypatch.setattr(index, "JOB_HEARTBEAT_SECONDS", 0.02)
+    monkeypatch.setattr(index, "screen_customers", slow)
+    store.norad_codes = store.norad_codes[:1]
+    assert index.process_screening_jobs(budget_seconds=1e9) == [(1, "done")]
+    assert store.heartbeats >= 3
+
+
+def test_job_workers_not_started_in_pool_children(monkeypatch):
+    started = []
+    monkeypatch.setattr(index, "JOB_WORKER_THREADS", 2)
+    monkeypatch.setattr(index.threading, "Thread", lambda **kwargs: types.SimpleNamespace(start=lambda: started.append(kwargs)))
+
+    monkeypatch.setattr(index.multiprocessing, "parent_process", lambda: object())
+    index.start_job_workers()
+    assert started == []
+
+    monkeypatch.setattr(index.multiprocessing, "parent_process", lambda: None)
+    index.start_job_workers()
+    assert len(started) == 2
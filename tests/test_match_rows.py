@@ -0,0 +1,18 @@
+import pytest
+
+import index
+
+INTERSECTION = {
+    "sat1": "main_object", "sat2": 10001, "time": 12.5, "distance": 0.1,
+    "coord1": (1.0, 2.0, 3.0), "coord2": (1.0, 2.0, 3.1),
+}
+
+
+def test_match_rows_carry_the_customer_norad_code():
+    rows = index.prepare_match_rows([{**INTERSECTION, "norad_code": 42661}])
+    assert rows == [("42661", "main_object", 10001, 12.5, 0.1, "{1.0,2.0,3.0}", "{1.0,2.0,3.1}")]
+
+
+def test_match_rows_without_norad_code_are_rejected():
+    with pytest.raises(KeyError):
+        index.prepare_match_rows([INTERSECTION])
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+import index
+from conftest import START_TIME, synthetic_catalog
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(index, "PROPAGATION_WORKERS", 2)
+    monkeypatch.setattr(index, "PROPAGATION_CHUNK_SATS", 70)
+    index.shutdown_propagation_pool()
+    yield
+    index.shutdown_propagation_pool()
+
+
+def test_parallel_propagation_matches_serial(pool):
+    _, satrecs = synthetic_catalog(300, seed=2)
+    satrecs = list(satrecs.values())
+    _, jd, fr = index.build_time_grid(START_TIME, 120, 60)
+
+    expected = index.SatrecArray(satrecs).sgp4(jd, fr)
+    for _ in range(2):
+        actual = index.propagate_parallel(satrecs, jd, fr)
+        for a, b in zip(actual, expected):
+            assert a.shape == b.shape and a.dtype == b.dtype
+            np.testing.assert_array_equal(a, b)
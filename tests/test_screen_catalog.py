@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import index
+from conftest import START_TIME, synthetic_catalog
+
+THRESHOLD_KM = 100.0
+DURATION_MINUTES = 180
+SUBJECTS = [3, 150, 420, 777]
+
+
+@pytest.fixture(scope="module")
+def satrecs():
+    _, satrecs = synthetic_catalog(800, seed=5, max_age_days=3)
+    return satrecs
+
+
+def events_by_row(conjunctions):
+    return sorted(zip(conjunctions["sat_index"].tolist(), np.round(conjunctions["time"], 2).tolist()))
+
+
+@pytest.mark.parametrize("step_seconds", [30, 600, 1800])
+def test_screen_catalog_matches_pairwise_search(satrecs, step_seconds):
+    ephemeris = index.from_tle_to_ephemeris(satrecs, START_TIME, DURATION_MINUTES, step_seconds)
+    screened = index.screen_catalog(ephemeris, SUBJECTS, THRESHOLD_KM)
+
+    total = 0
+    for subject in SUBJECTS:
+        expected = events_by_row(index.find_conjunctions(ephemeris, THRESHOLD_KM, main_index=subject))
+        actual = events_by_row(screened[subject]) if subject in screened else []
+        assert actual == expected, f"subject {subject}, step {step_seconds}"
+        total += len(expected)
+    assert total
+
+
+def test_screen_catalog_restricts_to_allowed_pairs(satrecs):
+    ephemeris = index.from_tle_to_ephemeris(satrecs, START_TIME, DURATION_MINUTES, 60)
+    full = index.screen_catalog(ephemeris, SUBJECTS, THRESHOLD_KM)
+    subject = next(row for row in SUBJECTS if len(full.get(row, {"sat_index": []})["sat_index"]))
+    allowed = {subject: full[subject]["sat_index"][:1].tolist()}
+
+    restricted = index.screen_catalog(ephemeris, [subject], THRESHOLD_KM, allowed_pairs=allowed)
+    assert set(restricted[subject]["sat_index"].tolist()) == set(allowed[subject])
+
+
+def test_grid_neighbour_pairs_with_zero_radius():
+    positions = np.zeros((3, 3))
+    subject_rows, object_rows = index._grid_neighbour_pairs(positions, np.ones(3, dtype=bool), np.array([0]), 0.0)
+    assert len(subject_rows) == 0 and len(object_rows) == 0
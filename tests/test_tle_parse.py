@@ -0,0 +1,46 @@
+import random
+
+import numpy as np
+import pytest
+
+import index
+from conftest import START_TIME, _checksum, make_tle
+
+
+def _with_field(line, start, end, text):
+    line = line[:start] + text + line[end:68]
+    return line + _checksum(line)
+
+
+def test_eccentricity_matches_float_parsing():
+    r = random.Random(1)
+    line1, line2 = make_tle(10000, START_TIME, 51.6, 10.0, 0.001, 20.0, 30.0, 15.5)
+    mantissas = [f"{r.randrange(10 ** 7):07d}" for _ in range(20000)]
+    lines2 = [_with_field(line2, 26, 33, mantissa) for mantissa in mantissas]
+
+    records, valid = index.parse_tle_lines([line1] * len(lines2), lines2)
+    assert valid.all()
+    expected = np.array([float("0." + mantissa) for mantissa in mantissas])
+    np.testing.assert_array_equal(records["eccentricita"], expected)
+
+
+@pytest.mark.parametrize("field, expected", [
+    (" 12345-4", 0.12345e-4),
+    ("-12345-3", -0.12345e-3),
+    (" 12345+2", 0.12345e2),
+    (" 99999+9", 0.99999e9),
+    (" 00000+0", 0.0),
+])
+def test_exponential_fields_match_float_parsing(field, expected):
+    line1, line2 = make_tle(10000, START_TIME, 51.6, 10.0, 0.001, 20.0, 30.0, 15.5)
+    records, valid = index.parse_tle_lines([_with_field(line1, 53, 61, field)], [line2])
+    assert valid.all()
+    assert records["termine_trascinamento"][0] == expected
+
+
+@pytest.mark.parametrize("year, expected", [("56", 2056), ("57", 1957), ("24", 2024), ("99", 1999)])
+def test_epoch_year_pivot(year, expected):
+    line1, line2 = make_tle(10000, START_TIME, 51.6, 10.0, 0.001, 20.0, 30.0, 15.5)
+    records, valid = index.parse_tle_lines([_with_field(line1, 18, 20, year)], [line2])
+    assert valid.all()
+    assert records["annoepoca_astro"][0] == expected